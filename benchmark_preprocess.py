@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+画像前処理（デコード＋リサイズ）のベンチマーク
+
+従来の方法（全画素をデコードして引き伸ばす）と、縮小デコード（Image.draft / reduce）＋
+縦横比を保った余白埋めの速度を比較する。--model_dir を指定すると、従来の方法の
+タグを正解として、各方法のタグの一致度も計算する。
+
+使い方:
+    # 大きなJPEGを生成して速度だけ比較
+    python benchmark_preprocess.py --synthetic 20 --size 4000x6000
+
+    # 手元の画像で速度とタグの一致度を比較
+    python benchmark_preprocess.py --dir sample_images --model_dir tagger_data --report preprocess_report.yaml
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import yaml
+from PIL import Image
+from tagger_engine import DEFAULT_TARGET_SIZE, TaggerEngine, find_images, load_image
+
+# 比較する前処理（名前 → load_image の引数）。先頭が従来の方法
+VARIANTS = {
+    'stretch_full': {'preprocess': 'stretch', 'draft': False},
+    'stretch_draft': {'preprocess': 'stretch', 'draft': True},
+    'pad_full': {'preprocess': 'pad', 'draft': False},
+    'pad_draft': {'preprocess': 'pad', 'draft': True},
+}
+BASELINE = 'stretch_full'
+
+
+def synthetic_image(width, height, rng):
+    """写真に近い（滑らかな変化＋ノイズ）RGB画像を生成（同じ rng の状態なら同じ画像）"""
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    phase = rng.random(3) * np.pi * 2
+    pixels = np.stack([127 + 100 * np.sin(6 * x + 4 * y + p) for p in phase], axis=-1)
+    pixels += rng.normal(0, 8, size=(height, 1, 1)).astype(np.float32)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def make_synthetic_images(out_dir, count, size, seed=0):
+    """
+    同じサイズの合成JPEGを生成
+
+    Returns:
+        list: 作成した画像のパス
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        path = os.path.join(out_dir, f"synthetic_{i:04d}.jpg")
+        synthetic_image(size[0], size[1], rng).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def time_decode(image_files, target_size, variant, repeat=1):
+    """
+    前処理の速度を計測
+
+    Returns:
+        tuple: (画像/秒, 前処理後の配列のリスト（失敗した画像は None）)
+    """
+    arrays = []
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        arrays = []
+        for img_path in image_files:
+            try:
+                arrays.append(load_image(img_path, target_size, **VARIANTS[variant]))
+            except Exception as e:
+                print(f"エラー ({img_path}): {e}")
+                arrays.append(None)
+    elapsed = time.perf_counter() - start_time
+    return len(image_files) * repeat / elapsed if elapsed else None, arrays
+
+
+def infer_arrays(engine, arrays):
+    """前処理済みの配列をバッチ推論し、(画像数, タグ数) の確率を返す"""
+    rows = []
+    for start in range(0, len(arrays), engine.batch_size):
+        rows.append(engine.infer(np.stack(arrays[start:start + engine.batch_size])))
+    return np.concatenate(rows) if rows else np.zeros((0, len(engine.labels)), dtype=np.float32)
+
+
+def benchmark(image_files, target_size=DEFAULT_TARGET_SIZE, model_dir=None, threshold=0.35,
+              batch_size=8, repeat=1):
+    """
+    全ての前処理で速度を計測し、モデルがあればタグの一致度を比較
+
+    Returns:
+        dict: レポート（YAMLにそのまま保存できる形式）
+    """
+    engine = None
+    if model_dir:
+        engine = TaggerEngine(model_dir, batch_size=batch_size)
+        target_size = engine.target_size
+
+    results = {}
+    for variant in VARIANTS:
+        # 1枚目でファイルキャッシュを温めてから計測
+        time_decode(image_files[:1], target_size, variant)
+        results[variant] = time_decode(image_files, target_size, variant, repeat)
+
+    # どの方法でも読み込めた画像だけを比較
+    ok = [i for i in range(len(image_files)) if all(results[v][1][i] is not None for v in VARIANTS)]
+    baseline_speed = results[BASELINE][0]
+    report = {'images': len(image_files), 'target_size': list(target_size), 'variants': {}}
+
+    reference = None
+    if engine is not None and ok:
+        # quantize_model と同じ指標（基準の閾値判定を正解とした適合率・再現率）で比較
+        from quantize_model import compare_outputs
+        thresholds = engine.postprocessor(threshold).thresholds
+        reference = infer_arrays(engine, [results[BASELINE][1][i] for i in ok])
+        report['threshold'] = threshold
+
+    for variant, (speed, arrays) in results.items():
+        entry = {
+            'images_per_second': round(speed, 2) if speed else None,
+            'speedup': round(speed / baseline_speed, 2) if speed and baseline_speed else None,
+        }
+        if variant.endswith('_draft') and ok:
+            # 同じ前処理の全画素デコードとの入力の差（0〜1の画素値）
+            full = results[variant.replace('_draft', '_full')][1]
+            diff = np.mean([np.abs(arrays[i] - full[i]).mean() for i in ok])
+            entry['mean_abs_pixel_diff_vs_full'] = round(float(diff), 6)
+        if reference is not None:
+            metrics = compare_outputs(reference, infer_arrays(engine, [arrays[i] for i in ok]), thresholds)
+            entry['micro_precision'] = round(metrics['micro_precision'], 4)
+            entry['micro_recall'] = round(metrics['micro_recall'], 4)
+            entry['micro_f1'] = round(metrics['micro_f1'], 4)
+            entry['max_abs_prob_diff'] = round(metrics['max_abs_diff'], 6)
+        report['variants'][variant] = entry
+    return report
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='画像前処理（デコード＋リサイズ）のベンチマーク')
+    parser.add_argument('--dir', help='画像ディレクトリ（省略時は --synthetic で生成）')
+    parser.add_argument('--synthetic', type=int, default=20, help='生成する画像数（--dir 省略時）')
+    parser.add_argument('--size', type=parse_size, default=(4000, 6000), help='生成する画像のサイズ（幅x高さ）')
+    parser.add_argument('--limit', type=int, help='使う画像数の上限')
+    parser.add_argument('--repeat', type=int, default=1, help='計測の繰り返し回数')
+    parser.add_argument('--model_dir', help='タグの一致度も比較する場合のモデルディレクトリ')
+    parser.add_argument('--threshold', type=float, default=0.35, help='タグの閾値')
+    parser.add_argument('--batch_size', type=int, default=8, help='1回の推論にまとめる画像数')
+    parser.add_argument('--report', help='レポートを保存するYAMLファイル')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.dir:
+            image_files = find_images(args.dir)
+        else:
+            print(f"{args.size[0]}x{args.size[1]} のJPEGを {args.synthetic} 枚生成中...")
+            image_files = make_synthetic_images(tmp_dir, args.synthetic, args.size)
+        if args.limit:
+            image_files = image_files[:args.limit]
+        if not image_files:
+            print("画像ファイルが見つかりません")
+            return 1
+
+        report = benchmark(image_files, model_dir=args.model_dir, threshold=args.threshold,
+                           batch_size=args.batch_size, repeat=args.repeat)
+
+    print(f"\n=== 前処理ベンチマーク（{report['images']}枚 → {report['target_size'][0]}x{report['target_size'][1]}） ===")
+    for variant, entry in report['variants'].items():
+        line = f"{variant:14s} {entry['images_per_second']:8.2f}画像/秒 (x{entry['speedup']})"
+        if 'mean_abs_pixel_diff_vs_full' in entry:
+            line += f"  画素差 {entry['mean_abs_pixel_diff_vs_full']:.4f}"
+        if 'micro_f1' in entry:
+            line += f"  F1 {entry['micro_f1']:.4f}"
+        print(line)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            yaml.dump(report, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
+        print(f"\nレポートを保存しました: {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
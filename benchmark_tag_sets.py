@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+タグセット作成（貪欲法）のベンチマーク
+
+合成コーパス（いくつかのタグのまとまりが一緒に出現する）でカテゴリのタグ数を
+増やしながら、従来の方法（list.remove と候補リストの全並べ替え）と
+tag_set_builder.greedy_sets の時間、セットの平均スコア（シードと他のタグの共起回数の合計）
+を比較する（同じ乱数のシードなら同じセットになることも確認する）。従来の方法は
+タグ数の3乗近くで遅くなるので --legacy_max までのサイズで計測する。
+
+使い方:
+    python benchmark_tag_sets.py --sizes 1000,2000,5000,10000,20000
+    python benchmark_tag_sets.py --sizes 10000 --legacy_max 0 --report tag_sets_report.yaml
+"""
+
+import sys
+import time
+import random
+import argparse
+from collections import Counter
+import yaml
+from tag_cooccurrence import TagCooccurrence
+from tag_set_builder import greedy_sets, set_score
+
+# 合成コーパスで一緒に出現するタグのまとまりの大きさ
+CLUSTER_SIZE = 8
+
+
+def make_file_tags(num_tags, files=None, seed=0):
+    """
+    タグ数 num_tags の合成コーパス（ファイルごとのタグ名のリスト）を作成
+
+    各ファイルは2つのまとまりからそれぞれ数個と、ランダムなタグを数個持つ。
+    """
+    rng = random.Random(seed)
+    tags = [f"tag_{i:05d}" for i in range(num_tags)]
+    clusters = [tags[start:start + CLUSTER_SIZE] for start in range(0, num_tags, CLUSTER_SIZE)]
+    file_tags = []
+    for _ in range(files or num_tags * 2):
+        chosen = []
+        for cluster in rng.sample(clusters, min(2, len(clusters))):
+            chosen.extend(rng.sample(cluster, min(len(cluster), rng.randint(2, 5))))
+        chosen.extend(rng.sample(tags, 3))
+        file_tags.append(list(dict.fromkeys(chosen)))
+    return tags, file_tags
+
+
+def legacy_sets(co_occurrence, category_tags, num_sets=50, set_size=3, rng=None):
+    """従来の create_sets_from_co_occurrence（co_occurrence は {tag: Counter}）"""
+    rng = rng or random.Random()
+    sets = []
+    category_tags_list = list(category_tags)
+    if len(category_tags_list) < set_size:
+        return [category_tags_list] if category_tags_list else []
+
+    for _ in range(min(num_sets, len(category_tags_list) // set_size)):
+        if len(category_tags_list) < set_size:
+            break
+        seed_tag = rng.choice(category_tags_list)
+        category_tags_list.remove(seed_tag)
+        tag_set = [seed_tag]
+        for _ in range(set_size - 1):
+            candidates = [(tag, co_occurrence[seed_tag][tag]) for tag in category_tags_list]
+            if not candidates:
+                break
+            candidates.sort(key=lambda x: x[1], reverse=True)
+            tag_set.append(candidates[0][0])
+            category_tags_list.remove(candidates[0][0])
+        sets.append(tag_set)
+
+    while category_tags_list:
+        sets.append(category_tags_list[:set_size])
+        del category_tags_list[:set_size]
+    return sets
+
+
+def mean_score(cooccurrence, sets, set_size):
+    """共起で作ったセット（大きさが set_size のもの）の平均スコア"""
+    scores = [set_score(cooccurrence, tag_set) for tag_set in sets if len(tag_set) == set_size]
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def benchmark(sizes, set_size=3, num_sets=None, legacy_max=5000, seed=0):
+    """
+    Args:
+        sizes (list): カテゴリのタグ数のリスト
+        num_sets (int): 共起で作るセットの最大数（省略時はタグ数 / set_size、つまり全て）
+        legacy_max (int): 従来の方法を計測する最大のタグ数
+
+    Returns:
+        dict: レポート（YAMLにそのまま保存できる形式）
+    """
+    results = []
+    for size in sizes:
+        tags, file_tags = make_file_tags(size, seed=seed)
+        start_time = time.perf_counter()
+        cooccurrence = TagCooccurrence.from_file_tags(file_tags, tags)
+        entry = {
+            'tags': size,
+            'files': len(file_tags),
+            'cooccurrence_seconds': round(time.perf_counter() - start_time, 4),
+        }
+        limit = num_sets or size // set_size
+
+        start_time = time.perf_counter()
+        sets = greedy_sets(cooccurrence, tags, limit, set_size, random.Random(seed))
+        entry['greedy_seconds'] = round(time.perf_counter() - start_time, 4)
+        entry['greedy_mean_score'] = round(mean_score(cooccurrence, sets, set_size), 3)
+
+        if size <= legacy_max:
+            counters = {tag: Counter(cooccurrence.neighbor_counts(tag)) for tag in tags}
+            start_time = time.perf_counter()
+            legacy = legacy_sets(counters, tags, limit, set_size, random.Random(seed))
+            entry['legacy_seconds'] = round(time.perf_counter() - start_time, 4)
+            entry['legacy_mean_score'] = round(mean_score(cooccurrence, legacy, set_size), 3)
+            # 同じ乱数のシードなら同じセットになる
+            entry['identical'] = legacy == sets
+            entry['speedup'] = round(entry['legacy_seconds'] / max(entry['greedy_seconds'], 1e-9), 1)
+        results.append(entry)
+    return {'set_size': set_size, 'num_sets': num_sets, 'seed': seed, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='タグセット作成（貪欲法）のベンチマーク')
+    parser.add_argument('--sizes', default='1000,2000,5000,10000,20000', help='カテゴリのタグ数（カンマ区切り）')
+    parser.add_argument('--set_size', type=int, default=3, help='1セットのタグ数')
+    parser.add_argument('--sets', type=int, help='共起で作るセットの最大数（省略時は全て）')
+    parser.add_argument('--legacy_max', type=int, default=5000, help='従来の方法を計測する最大のタグ数')
+    parser.add_argument('--seed', type=int, default=0, help='コーパスとシードタグ選択の乱数シード')
+    parser.add_argument('--report', help='レポートを保存するYAMLファイル')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    report = benchmark(sizes, args.set_size, args.sets, args.legacy_max, args.seed)
+
+    print(f"\n=== タグセット作成ベンチマーク（セットの大きさ {args.set_size}） ===")
+    for entry in report['results']:
+        line = (f"{entry['tags']:6d}タグ  共起行列 {entry['cooccurrence_seconds']:7.3f}秒  "
+                f"貪欲法 {entry['greedy_seconds']:7.3f}秒 (スコア {entry['greedy_mean_score']:.2f})")
+        if 'legacy_seconds' in entry:
+            line += (f"  従来 {entry['legacy_seconds']:8.3f}秒 (スコア {entry['legacy_mean_score']:.2f})"
+                     f"  x{entry['speedup']}{'' if entry['identical'] else '  (セットが不一致)'}")
+        print(line)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            yaml.dump(report, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
+        print(f"\nレポートを保存しました: {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+タガーのベンチマーク
+再現可能な合成画像コーパス（サイズ・形式が混在）を生成し、エンジンの各モード
+（バッチサイズ・スレッド数・デコード方法）と各タガーの入口（tag_images など）を
+同じ条件で計測して、JSONのレポートにまとめる。
+
+各シナリオは別プロセスで実行するので、ピークメモリ（最大RSS）もシナリオごとに計測できる。
+画像数はどちらの種類のシナリオでもタグ付けに成功した画像の数（入口では実際に書き出された
+出力から数える）、レイテンシは1バッチ分の結果を受け取る間隔のp50/p95。
+--model_dir を省略すると小さなダミーのONNXモデルを生成して使う（オフラインで実行可能、onnx パッケージが必要）。
+
+使い方:
+    python benchmark_tagger.py --out benchmark_report.json
+    python benchmark_tagger.py --model_dir tagger_data --images 200 --scenario engine_b8 engine_b8_processes
+    python benchmark_tagger.py --list
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from benchmark_preprocess import synthetic_image
+from tagger_engine import TAG_CATEGORIES, TaggerEngine, find_images
+from tagger_farm import TaggerFarm
+from tag_store import STORE_FILENAME, TagStore
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# コーパスの画像サイズと形式（番号順に巡回するので、同じ枚数・シードなら常に同じコーパスになる）
+# 形式は tagger_engine.IMAGE_EXTENSIONS のうちスクレイプで多いもの
+CORPUS_SIZES = [(640, 480), (1024, 1024), (1200, 1800), (2400, 1600), (4000, 3000)]
+CORPUS_FORMATS = ['jpg', 'png', 'webp']
+
+# ダミーモデルのタグ数
+DUMMY_TAGS = 1000
+
+# エンジンのシナリオ（名前 → TaggerEngine の引数）
+ENGINE_SCENARIOS = {
+    'engine_b1': {'batch_size': 1},
+    'engine_b8': {'batch_size': 8},
+    'engine_b8_t1': {'batch_size': 8, 'threads': 1},
+    'engine_b8_worker': {'batch_size': 8, 'session_profile': 'worker'},
+    'engine_b8_processes': {'batch_size': 8, 'use_processes': True},
+    'engine_b8_stretch': {'batch_size': 8, 'preprocess': 'stretch'},
+}
+
+# 入口のシナリオ（名前 → (モジュール名, 引数)）。出力ファイルの書き込みまで含めて計測
+ENTRY_SCENARIOS = {
+    'eva02_tagger': ('eva02_tagger', {}),
+    'eva02_tagger_store': ('eva02_tagger', {'output_format': 'store'}),
+    'eva02_tagger_farm': ('eva02_tagger', {'workers': 2}),
+    'improved_eva02_tagger': ('improved_eva02_tagger', {'use_gpu': False}),
+    'eva02_tagger_categorized': ('eva02_tagger_categorized', {'categorize': True}),
+    'simple_tagger': ('simple_tagger', {}),
+}
+
+
+def make_corpus(out_dir, count, seed=0, sizes=CORPUS_SIZES, formats=CORPUS_FORMATS):
+    """
+    合成画像のコーパスを生成（同じ引数なら同じ内容）
+
+    Returns:
+        dict: 枚数・サイズ・形式ごとの枚数・合計バイト数
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    counts = {}
+    total_bytes = 0
+    for i in range(count):
+        width, height = sizes[i % len(sizes)]
+        fmt = formats[i % len(formats)]
+        path = os.path.join(out_dir, f"corpus_{i:05d}.{fmt}")
+        options = {'quality': 90} if fmt in ('jpg', 'webp') else {}
+        synthetic_image(width, height, rng).save(path, **options)
+        counts[fmt] = counts.get(fmt, 0) + 1
+        total_bytes += os.path.getsize(path)
+    return {'images': count, 'seed': seed, 'sizes': [list(size) for size in sizes],
+            'formats': counts, 'bytes': total_bytes}
+
+
+def make_dummy_model(model_dir, num_tags=DUMMY_TAGS, seed=0):
+    """
+    色の平均からタグ確率を出す小さなONNXモデル (N, 448, 448, 3) → (N, num_tags) と
+    selected_tags.csv を作成（general / character / rating のタグを含む）
+    """
+    import onnx
+    from onnx import TensorProto, helper
+
+    os.makedirs(model_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    weights = rng.normal(0, 4, size=(3, num_tags)).astype(np.float32)
+    bias = rng.normal(-2, 1, size=num_tags).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node('ReduceMean', ['input'], ['color'], axes=[1, 2], keepdims=0),
+            helper.make_node('MatMul', ['color', 'weights'], ['logits_raw']),
+            helper.make_node('Add', ['logits_raw', 'bias'], ['logits']),
+            helper.make_node('Sigmoid', ['logits'], ['output']),
+        ],
+        'benchmark_dummy_tagger',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['batch', 448, 448, 3])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, ['batch', num_tags])],
+        [helper.make_tensor('weights', TensorProto.FLOAT, weights.shape, weights.flatten()),
+         helper.make_tensor('bias', TensorProto.FLOAT, bias.shape, bias)],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, os.path.join(model_dir, 'model.onnx'))
+
+    with open(os.path.join(model_dir, 'selected_tags.csv'), 'w', encoding='utf-8') as f:
+        f.write('tag_id,name,category,count\n')
+        for i in range(num_tags):
+            if i < 4:
+                category = TAG_CATEGORIES['rating']
+            elif i % 10 == 0:
+                category = TAG_CATEGORIES['character']
+            else:
+                category = TAG_CATEGORIES['general']
+            f.write(f'{i},tag_{i:05d},{category},100\n')
+    return model_dir
+
+
+def _peak_rss_mb(who):
+    """
+    最大RSS（MB）
+
+    Linux の ru_maxrss は exec 後も起動元プロセスの値を引き継ぐため、自プロセスは
+    /proc/self/status の VmHWM を使う。子プロセスの値（最も大きい1つ）は起動時点の
+    RSS を含む上限値。ru_maxrss は Linux では KB、macOS ではバイト単位。
+    """
+    if who == 'self':
+        try:
+            with open('/proc/self/status', encoding='ascii') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _percentiles(values_ms):
+    if not values_ms:
+        return None
+    return {'p50': round(float(np.percentile(values_ms, 50)), 2),
+            'p95': round(float(np.percentile(values_ms, 95)), 2)}
+
+
+def _run_engine(image_files, model_dir, options):
+    """エンジンを直接使って計測（モデルのロードと1バッチ目のウォームアップは除く）"""
+    engine = TaggerEngine(model_dir, use_cache=False, **options)
+    list(engine.run(image_files[:engine.batch_size]))
+
+    latencies = []
+    images = 0
+    start_time = time.perf_counter()
+    last = start_time
+    for batch_paths, _, rows, _ in engine.run_batches(image_files):
+        now = time.perf_counter()
+        # 1バッチを受け取るまでの待ち時間（バッチ単位のレイテンシ）
+        latencies.append((now - last) * 1000)
+        last = now
+        images += sum(row is not None for row in rows)
+    return images, time.perf_counter() - start_time, latencies
+
+
+@contextlib.contextmanager
+def _batch_timer(latencies):
+    """
+    TaggerEngine.tag / TaggerFarm.tag を包み、batch_size 件の結果を受け取るごとの間隔を記録
+
+    入口は結果を受け取るたびに出力を書き込むので、間隔には前のバッチの書き込み時間も含まれる。
+    シナリオは専用のプロセスで実行するため、クラスの差し替えは他に影響しない。
+    """
+    originals = {cls: cls.tag for cls in (TaggerEngine, TaggerFarm)}
+
+    def timed(original):
+        def tag(self, image_paths, postprocessor):
+            last = time.perf_counter()
+            for count, result in enumerate(original(self, image_paths, postprocessor), 1):
+                yield result
+                if count % self.batch_size == 0 or count == len(image_paths):
+                    now = time.perf_counter()
+                    latencies.append((now - last) * 1000)
+                    last = now
+        return tag
+
+    for cls, original in originals.items():
+        cls.tag = timed(original)
+    try:
+        yield latencies
+    finally:
+        for cls, original in originals.items():
+            cls.tag = original
+
+
+def _count_outputs(image_files, output_dir):
+    """出力（画像ごとのtxt またはタグストアの行）が書き出された画像の数"""
+    store_path = os.path.join(output_dir, STORE_FILENAME)
+    stored = set(TagStore(store_path).paths()) if os.path.exists(store_path) else set()
+    return sum(1 for path in image_files
+               if path in stored or
+               os.path.exists(os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.txt')))
+
+
+def _run_entry(image_files, model_dir, module_name, options, corpus_dir, output_dir):
+    """タガーの入口を呼び出して計測（モデルのロードと出力の書き込みを含む）"""
+    module = __import__(module_name)
+    latencies = []
+    start_time = time.perf_counter()
+    with _batch_timer(latencies):
+        _call_entry(module, model_dir, options, corpus_dir, output_dir)
+    elapsed = time.perf_counter() - start_time
+    return _count_outputs(image_files, output_dir), elapsed, latencies
+
+
+def _call_entry(module, model_dir, options, corpus_dir, output_dir):
+    module_name = module.__name__
+    if module_name == 'simple_tagger':
+        args = Namespace(input=corpus_dir, output=output_dir, threshold=0.35, model_dir=model_dir,
+                         batch_size=8, threads=None, session_profile='default', int8=False,
+                         preprocess='pad', cache=None, cache_optimized=False, workers=None,
+                         output_format='files', retry_failed=False, restart=True)
+        module.tag_images_batch(args)
+    else:
+        options = dict(options)
+        if module_name == 'eva02_tagger_categorized':
+            options['restart'] = True
+        if not module.tag_images(corpus_dir, output_dir, model_dir, use_cache=False, **options):
+            raise RuntimeError(f"{module_name}.tag_images が失敗しました")
+
+
+def run_scenario(name, corpus_dir, model_dir, work_dir, quiet=True):
+    """
+    1つのシナリオを実行（別プロセスから呼ばれる）
+
+    Returns:
+        dict: 画像数・秒数・画像/秒・レイテンシ・最大RSS
+    """
+    image_files = find_images(corpus_dir)
+    sink = io.StringIO()
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(sink))
+            stack.enter_context(contextlib.redirect_stderr(sink))
+        if name in ENGINE_SCENARIOS:
+            kind, options = 'engine', ENGINE_SCENARIOS[name]
+            images, elapsed, latencies = _run_engine(image_files, model_dir, options)
+        else:
+            kind, (module_name, options) = 'entry', ENTRY_SCENARIOS[name]
+            output_dir = os.path.join(work_dir, name)
+            images, elapsed, latencies = _run_entry(image_files, model_dir, module_name, options,
+                                                    corpus_dir, output_dir)
+
+    return {
+        'name': name,
+        'kind': kind,
+        'options': options,
+        'images': images,
+        'seconds': round(elapsed, 3),
+        'images_per_second': round(images / elapsed, 2) if elapsed else None,
+        'latency_ms': _percentiles(latencies),
+        'peak_rss_mb': _peak_rss_mb('self'),
+        'peak_child_rss_mb': _peak_rss_mb('children'),
+    }
+
+
+def environment():
+    """レポートに含める実行環境"""
+    import onnxruntime
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'onnxruntime': onnxruntime.__version__,
+        'providers': onnxruntime.get_available_providers(),
+    }
+
+
+def run_benchmark(scenarios=None, images=48, seed=0, model_dir=None, work_dir=None,
+                  sizes=CORPUS_SIZES, quiet=True):
+    """
+    コーパスを生成して各シナリオを順に実行
+
+    Args:
+        scenarios (list): 実行するシナリオ名（省略時は全て）
+        images (int): コーパスの画像数
+        seed (int): コーパスの乱数シード
+        model_dir (str): モデルディレクトリ（省略時はダミーモデルを生成）
+        work_dir (str): コーパスと出力の作業ディレクトリ（省略時は一時ディレクトリ）
+        sizes (list): コーパスの画像サイズ
+
+    Returns:
+        dict: レポート（JSONにそのまま保存できる形式）
+    """
+    scenarios = scenarios or list(ENGINE_SCENARIOS) + list(ENTRY_SCENARIOS)
+    unknown = [name for name in scenarios if name not in ENGINE_SCENARIOS and name not in ENTRY_SCENARIOS]
+    if unknown:
+        raise ValueError(f"不明なシナリオ: {', '.join(unknown)}")
+
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        corpus_dir = os.path.join(work_dir, 'corpus')
+        corpus = make_corpus(corpus_dir, images, seed, sizes)
+
+        dummy = model_dir is None
+        if dummy:
+            model_dir = make_dummy_model(os.path.join(work_dir, 'model'))
+
+        results = []
+        context = multiprocessing.get_context('spawn')
+        for name in scenarios:
+            # シナリオごとに新しいプロセスで実行し、最大RSSを分けて計測
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    result = pool.submit(run_scenario, name, corpus_dir, model_dir, work_dir, quiet).result()
+                except Exception as e:
+                    result = {'name': name, 'error': f"{type(e).__name__}: {e}"}
+            results.append(result)
+            if not quiet:
+                print(json.dumps(result, ensure_ascii=False))
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'corpus': corpus,
+        'model': {'dummy': dummy, 'path': None if dummy else os.path.abspath(model_dir)},
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='タガーのベンチマーク（合成画像コーパス）')
+    parser.add_argument('--images', type=int, default=48, help='コーパスの画像数')
+    parser.add_argument('--seed', type=int, default=0, help='コーパスの乱数シード')
+    parser.add_argument('--model_dir', help='モデルディレクトリ（省略時はダミーモデルを生成）')
+    parser.add_argument('--scenario', nargs='+', help='実行するシナリオ（省略時は全て）')
+    parser.add_argument('--work_dir', help='コーパスと出力を残す作業ディレクトリ（省略時は一時ディレクトリ）')
+    parser.add_argument('--out', default='benchmark_report.json', help='レポートを保存するJSONファイル')
+    parser.add_argument('--list', action='store_true', help='シナリオの一覧を表示')
+    parser.add_argument('--verbose', action='store_true', help='各シナリオのログを表示')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, options in ENGINE_SCENARIOS.items():
+            print(f"{name:26s} TaggerEngine {options}")
+        for name, (module_name, options) in ENTRY_SCENARIOS.items():
+            print(f"{name:26s} {module_name} {options}")
+        return 0
+
+    print(f"コーパス {args.images} 枚（{' / '.join(CORPUS_FORMATS)} 混在）で計測します")
+    report = run_benchmark(args.scenario, args.images, args.seed, args.model_dir, args.work_dir,
+                           quiet=not args.verbose)
+
+    print(f"\n=== タガーベンチマーク（{report['corpus']['images']}枚） ===")
+    for result in report['results']:
+        if 'error' in result:
+            print(f"{result['name']:26s} エラー: {result['error']}")
+            continue
+        latency = result['latency_ms']
+        latency_text = f"  バッチ p50 {latency['p50']:.1f}ms / p95 {latency['p95']:.1f}ms" if latency else ''
+        rss_text = f"  RSS {result['peak_rss_mb']}MB" if result['peak_rss_mb'] is not None else ''
+        print(f"{result['name']:26s} {result['images_per_second']:8.2f}画像/秒{latency_text}{rss_text}")
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nレポートを保存しました: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
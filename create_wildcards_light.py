@@ -6,6 +6,7 @@ import yaml
 import argparse
 from datetime import datetime
 from collections import defaultdict
+from tag_reader import exclusion_set, read_tag_names
 
 # カテゴリー定義
 CATEGORIES = {
@@ -27,32 +28,13 @@ EXCLUDE_TAGS = [
     "pixelated", "mosaic censoring", "censored", "copyright notice", "censored nipples", "blur censor",
     "sunlight", "identity censor", "1", "small breasts", "milestone celebration", "thank you", "glitch"
 ]
+EXCLUDED_TAGS = exclusion_set(EXCLUDE_TAGS)
 
 def read_tags_from_file(file_path):
-    """ファイルからタグを読み込む"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            # コンマ区切りのタグを処理
-            tags = []
-            if ',' in content:
-                for tag in content.split(','):
-                    tag = tag.strip()
-                    if tag and tag.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                        tags.append(tag)
-                    else:
-                        print(f"タグが除外されました: {tag}")
-            else:
-                # コンマがない場合は単一のタグとして扱う
-                if content.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                    tags.append(content)
-                else:
-                    print(f"タグが除外されました: {content}")
-            print(f"ファイル {file_path} から読み込んだタグ: {tags}")
-            return tags
-    except Exception as e:
-        print(f"ファイル読み込みエラー {file_path}: {e}")
-        return []
+    """ファイルからタグを読み込む（除外タグを除く）"""
+    tags = read_tag_names(file_path, exclude=EXCLUDED_TAGS)
+    print(f"ファイル {file_path} から読み込んだタグ: {tags}")
+    return tags
 
 def categorize_tags(tags):
     """タグをカテゴリ別に分類（単純らいと式）"""
@@ -5,9 +5,14 @@ import os
 import yaml
 import argparse
 from pathlib import Path
-from collections import defaultdict, Counter
 import random
 from datetime import datetime
+from tag_store import is_tag_store
+from tag_records import TagRecords
+from tag_reader import read_tag_names
+from tag_scan import scan_files
+from tag_cooccurrence import TagCooccurrence
+from tag_set_builder import greedy_sets
 
 def parse_arguments():
     """コマンドライン引数のパース"""
@@ -16,9 +21,12 @@ def parse_arguments():
     default_output = f'wildcards_all_{today}.yaml'
 
     parser = argparse.ArgumentParser(description='タグファイルをワイルドカードYAML形式に変換 (セット形式・すべてのタグ)')
-    parser.add_argument('--input', '-i', type=str, required=True, help='入力タグディレクトリ')
+    parser.add_argument('--input', '-i', type=str, required=True, help='入力タグディレクトリまたはタグストア')
     parser.add_argument('--output', '-o', type=str, default=default_output, help='出力YAMLファイル')
     parser.add_argument('--sets', '-s', type=int, default=50, help='各カテゴリのセット数')
+    parser.add_argument('--min_score', type=float, default=0.0, help='タグを含める最小スコア（スコアのないタグは1.0）')
+    parser.add_argument('--seed', type=int, help='乱数のシード（指定すると同じ入力から同じセットを作成）')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='タグファイルを並列に読み込むプロセス数（0でCPUコア数）')
     return parser.parse_args()
 
 def get_tag_files(input_dir):
@@ -28,154 +36,45 @@ def get_tag_files(input_dir):
     return sorted(files)
 
 def read_tags_from_file(file_path):
-    """タグファイルからタグを読み取り（カンマ区切り、改行＋カンマ＋スコア形式をサポート）"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            tags = []
-
-            # 改行ごとに処理
-            if '\n' in content:
-                for line in content.split('\n'):
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    # 「tag, score」形式の場合
-                    if ',' in line:
-                        tag_part = line.split(',')[0].strip()
-                        if tag_part:
-                            tags.append(tag_part)
-                    # 「tag: score」形式の場合
-                    elif ':' in line:
-                        tag_part = line.split(':', 1)[0].strip()
-                        if tag_part:
-                            tags.append(tag_part)
-                    else:
-                        # 単独タグ
-                        tags.append(line)
-            else:
-                # 改行がない場合はコンマ区切りとして処理
-                for token in content.split(','):
-                    token = token.strip()
-                    if token:
-                        # スコア値（数字）のみは除外
-                        if token.replace('.', '', 1).isdigit():
-                            continue
-                        tags.append(token)
-
-            return tags
-    except Exception as e:
-        print(f"ファイル読み込みエラー {file_path}: {e}")
-        return []
-
-def analyze_files(tag_files):
-    """タグファイルを分析してタグの出現頻度をカウント"""
-    all_tags = Counter()
-    file_tags = []  # 各ファイルのタグリストを保存
-    file_count = 0
-    total_tags = 0
-
-    print(f"処理するファイル数: {len(tag_files)}")
-    for file_path in tag_files:
-        tags = read_tags_from_file(file_path)
-        if not tags:
-            continue
-
-        total_tags += len(tags)
-        file_tag_list = []
-        for tag in tags:
-            tag = tag.strip()
-            if tag:
-                all_tags[tag] += 1
-                file_tag_list.append(tag)
+    """タグファイルからタグを読み取り（形式は tag_reader が行ごとに判定）"""
+    return read_tag_names(file_path)
+
+def analyze_records(records, min_score=0.0):
+    """
+    タグレコードを分析してタグの出現頻度をカウント
+
+    Returns:
+        tuple: (タグ → 出現ファイル数, ファイルごとのタグリスト, ファイル数,
+                タグ → スコアの合計（信頼度で重み付けした出現数）)
+    """
+    records = records.filter(min_score=min_score)
+    all_tags = records.tag_counter()
+    confidence = records.tag_counter(weighted=True)
+    file_tags = records.file_tags()
+
+    print(f"合計 {len(file_tags)} ファイル処理完了")
+    print(f"タグの総数: {len(records)}")
+    print(f"一意なタグの数: {len(all_tags)}")
 
-        if file_tag_list:
-            file_tags.append(file_tag_list)
+    return all_tags, file_tags, len(file_tags), confidence
 
-        file_count += 1
-        if file_count % 20 == 0:
-            print(f"{file_count} ファイル処理済み...")
+def analyze_store(store_path, min_score=0.0):
+    """タグストアを分析してタグの出現頻度をカウント（analyze_records と同じ戻り値）"""
+    return analyze_records(TagRecords.from_store(store_path), min_score)
 
-    print(f"合計 {file_count} ファイル処理完了")
-    print(f"タグの総数: {total_tags}")
-    print(f"一意なタグの数: {len(all_tags)}")
-
-    return all_tags, file_tags, file_count
+def analyze_files(tag_files, min_score=0.0, workers=1):
+    """タグファイルを（workers 個のプロセスで並列に）分析してタグの出現頻度をカウント（analyze_records と同じ戻り値）"""
+    print(f"処理するファイル数: {len(tag_files)}")
+    records, _ = scan_files(tag_files, workers)
+    return analyze_records(records, min_score)
 
 def create_co_occurrence_matrix(file_tags):
     """タグの共起行列を作成"""
-    co_occurrence = defaultdict(Counter)
-
-    for tags in file_tags:
-        for i, tag1 in enumerate(tags):
-            for tag2 in tags[i:]:
-                if tag1 != tag2:
-                    co_occurrence[tag1][tag2] += 1
-                    co_occurrence[tag2][tag1] += 1
-
-    return co_occurrence
-
-def create_sets_from_co_occurrence(co_occurrence, category_tags, num_sets=50, set_size=3):
-    """共起行列からセットを作成"""
-    sets = []
-    category_tags_list = list(category_tags)
-
-    # タグ数が少ない場合のエラー処理
-    if len(category_tags_list) < set_size:
-        if category_tags_list:  # 少なくとも1つはタグがある
-            return [", ".join(category_tags_list)]
-        return []
-
-    # 最大セット数の調整
-    max_possible_sets = len(category_tags_list) // set_size
-    effective_num_sets = min(num_sets, max_possible_sets)
-
-    # 共起度の高いタグからセットを構築
-    for _ in range(effective_num_sets):
-        if not category_tags_list or len(category_tags_list) < set_size:
-            break
-
-        # ランダムなシードタグから開始
-        seed_tag = random.choice(category_tags_list)
-        category_tags_list.remove(seed_tag)
-        tag_set = [seed_tag]
-
-        # 最も共起度の高いタグを追加
-        for _ in range(set_size - 1):
-            # seed_tagと共起度の高いタグを探す
-            candidates = []
-            for tag in category_tags_list:
-                # 共起度を取得（存在しない場合は0）
-                co_occur_count = co_occurrence[seed_tag][tag]
-                candidates.append((tag, co_occur_count))
-
-            # 候補がなければ終了
-            if not candidates:
-                break
-
-            # 共起度の高い順にソート
-            candidates.sort(key=lambda x: x[1], reverse=True)
-
-            # 最も共起度の高いタグを追加
-            next_tag = candidates[0][0]
-            tag_set.append(next_tag)
-            category_tags_list.remove(next_tag)
-
-        if tag_set:
-            sets.append(", ".join(tag_set))
-
-    # 残りのタグも追加（単一タグのセットも可）
-    while category_tags_list:
-        remaining_set = []
-        for _ in range(min(set_size, len(category_tags_list))):
-            if category_tags_list:
-                remaining_set.append(category_tags_list.pop(0))
-
-        if remaining_set:
-            sets.append(", ".join(remaining_set))
-
-    return sets
+    return TagCooccurrence.from_file_tags(file_tags)
+
+def create_sets_from_co_occurrence(co_occurrence, category_tags, num_sets=50, set_size=3, rng=None):
+    """共起行列からセットを作成（ランダムなシードタグに共起度の高いタグを加え、残りのタグもセットにする）"""
+    return [", ".join(tag_set) for tag_set in greedy_sets(co_occurrence, category_tags, num_sets, set_size, rng)]
 
 def categorize_tags(all_tags):
     """タグをカテゴリに分類"""
@@ -381,10 +280,22 @@ def categorize_tags(all_tags):
         "other": other_tags
     }
 
-def create_yaml_structure(all_tags, file_tags, categorized_tags, num_sets=50):
-    """セット形式のYAML構造を作成"""
+def rank_categories(categorized_tags, confidence):
+    """各カテゴリのタグを信頼度で重み付けした出現数の多い順に並べる（同じ値はタグ名順）"""
+    return {category: sorted(tags, key=lambda tag: (-confidence.get(tag, 0.0), tag))
+            for category, tags in categorized_tags.items()}
+
+def create_yaml_structure(all_tags, file_tags, categorized_tags, num_sets=50, confidence=None, seed=None):
+    """
+    セット形式のYAML構造を作成
+
+    confidence を指定するとカテゴリ内を信頼度順、省略時はタグ名順に扱う。
+    seed を指定すると同じ入力から同じセットを作る。
+    """
+    rng = random.Random(seed)
     print("\n共起行列を作成中...")
     co_occurrence = create_co_occurrence_matrix(file_tags)
+    categorized_tags = rank_categories(categorized_tags, confidence or {})
 
     # メインテンプレート
     charactermain = ["1girl,__characterface__,__characterbody__,__clothing__,__poseemotion__,__angle__,__backgrounds__,__style__,__sexual__"]
@@ -392,15 +303,15 @@ def create_yaml_structure(all_tags, file_tags, categorized_tags, num_sets=50):
     # 各カテゴリからセットを作成
     print("\n顔の特徴セットを生成中...")
     characterface_sets = create_sets_from_co_occurrence(
-        co_occurrence, categorized_tags["character_face"], num_sets, 3)
+        co_occurrence, categorized_tags["character_face"], num_sets, 3, rng)
 
     print("\n体の特徴セットを生成中...")
     characterbody_sets = create_sets_from_co_occurrence(
-        co_occurrence, categorized_tags["character_body"], num_sets, 3)
+        co_occurrence, categorized_tags["character_body"], num_sets, 3, rng)
 
     print("\n衣装セットを生成中...")
     clothing_sets = create_sets_from_co_occurrence(
-        co_occurrence, categorized_tags["clothing"], num_sets, 3)
+        co_occurrence, categorized_tags["clothing"], num_sets, 3, rng)
 
     # ポーズと感情を組み合わせたセット
     print("\nポーズと感情のセットを生成中...")
@@ -409,12 +320,14 @@ def create_yaml_structure(all_tags, file_tags, categorized_tags, num_sets=50):
     # ポーズと感情が十分にある場合
     if categorized_tags["pose"] and categorized_tags["emotion"]:
         # ポーズごとに感情を組み合わせる
-        for pose in sorted(categorized_tags["pose"]):
+        emotion_tags = set(categorized_tags["emotion"])
+        for pose in categorized_tags["pose"]:
             # ポーズに対応する共起感情を見つける
             emotions = []
-            if pose in co_occurrence:
-                for emotion, count in co_occurrence[pose].items():
-                    if emotion in categorized_tags["emotion"]:
+            neighbors = co_occurrence.neighbor_counts(pose)
+            if neighbors:
+                for emotion, count in neighbors.items():
+                    if emotion in emotion_tags:
                         emotions.append((emotion, count))
 
                 # 共起度の高い順にソート
@@ -425,37 +338,37 @@ def create_yaml_structure(all_tags, file_tags, categorized_tags, num_sets=50):
 
                 # 感情が見つからない場合はランダムに選択
                 if not top_emotions and categorized_tags["emotion"]:
-                    top_emotions = random.sample(categorized_tags["emotion"],
+                    top_emotions = rng.sample(categorized_tags["emotion"],
                                                min(2, len(categorized_tags["emotion"])))
 
                 if top_emotions:
                     poseemotion_sets.append(f"{pose}, {', '.join(top_emotions)}")
 
     # 十分なセットができなかった場合、残りをランダムに作成
-    poses_list = sorted(categorized_tags["pose"])
-    emotions_list = sorted(categorized_tags["emotion"])
+    poses_list = categorized_tags["pose"]
+    emotions_list = categorized_tags["emotion"]
     while len(poseemotion_sets) < num_sets and poses_list and emotions_list:
-        pose = random.choice(poses_list)
-        emotions = random.sample(emotions_list, min(2, len(emotions_list)))
+        pose = rng.choice(poses_list)
+        emotions = rng.sample(emotions_list, min(2, len(emotions_list)))
         poseemotion_sets.append(f"{pose}, {', '.join(emotions)}")
 
     print(f"生成されたポーズ感情セット数: {len(poseemotion_sets)}")
 
     print("\nアングルセットを生成中...")
-    angle_sets = sorted(categorized_tags["angle"])
+    angle_sets = list(categorized_tags["angle"])
 
     print("\n背景セットを生成中...")
     backgrounds_sets = create_sets_from_co_occurrence(
-        co_occurrence, categorized_tags["background"], num_sets, 2)
+        co_occurrence, categorized_tags["background"], num_sets, 2, rng)
 
     # スタイルセット
     print("\nスタイルセットを生成中...")
-    style_sets = sorted(categorized_tags["style"])
+    style_sets = list(categorized_tags["style"])
 
     # 性的タグセット（共起2語セット）
     print("\n性的タグセットを生成中...")
     sexual_sets = create_sets_from_co_occurrence(
-        co_occurrence, categorized_tags["sexual"], num_sets, 2)
+        co_occurrence, categorized_tags["sexual"], num_sets, 2, rng)
 
     # YAML構造を作成
     yaml_structure = {
@@ -492,15 +405,19 @@ def main():
     args = parse_arguments()
     print(f"=== タグファイルからワイルドカードYAML生成（セット形式・すべてのタグ） ===")
 
-    # タグファイル取得
-    tag_files = get_tag_files(args.input)
-    if not tag_files:
-        print(f"エラー: ディレクトリ '{args.input}' にタグファイルが見つかりません。")
-        return
+    if is_tag_store(args.input):
+        print("\nタグストアを分析中...")
+        all_tags, file_tags, file_count, confidence = analyze_store(args.input, args.min_score)
+    else:
+        # タグファイル取得
+        tag_files = get_tag_files(args.input)
+        if not tag_files:
+            print(f"エラー: ディレクトリ '{args.input}' にタグファイルが見つかりません。")
+            return
 
-    # タグ分析
-    print("\nタグを分析中...")
-    all_tags, file_tags, file_count = analyze_files(tag_files)
+        # タグ分析
+        print("\nタグを分析中...")
+        all_tags, file_tags, file_count, confidence = analyze_files(tag_files, args.min_score, args.workers)
 
     # タグをカテゴリに分類
     print("\nタグをカテゴリに分類中...")
@@ -508,7 +425,7 @@ def main():
 
     # YAML構造作成
     print("\nYAML構造を作成中...")
-    yaml_structure = create_yaml_structure(all_tags, file_tags, categorized_tags, args.sets)
+    yaml_structure = create_yaml_structure(all_tags, file_tags, categorized_tags, args.sets, confidence, args.seed)
 
     # 出力ファイルのフルパスを取得（絶対パス）
     output_path = os.path.abspath(args.output)
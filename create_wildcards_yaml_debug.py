@@ -5,8 +5,9 @@ import os
 import yaml
 import argparse
 from pathlib import Path
-from collections import defaultdict, Counter
+from collections import Counter
 import random
+from tag_cooccurrence import TagCooccurrence
 
 def parse_arguments():
     """コマンドライン引数のパース"""
@@ -99,16 +100,7 @@ def analyze_files(tag_files, threshold=0.6):
 
 def create_co_occurrence_matrix(file_tags):
     """タグの共起行列を作成"""
-    co_occurrence = defaultdict(Counter)
-
-    for tags in file_tags:
-        for i, tag1 in enumerate(tags):
-            for tag2 in tags[i:]:
-                if tag1 != tag2:
-                    co_occurrence[tag1][tag2] += 1
-                    co_occurrence[tag2][tag1] += 1
-
-    return co_occurrence
+    return TagCooccurrence.from_file_tags(file_tags)
 
 def create_sets_from_co_occurrence(co_occurrence, category_tags, num_sets=30, set_size=3):
     """共起行列からセットを作成"""
@@ -131,11 +123,8 @@ def create_sets_from_co_occurrence(co_occurrence, category_tags, num_sets=30, se
 
         # セットサイズになるまでタグを追加
         for _ in range(set_size - 1):
-            if current_tag not in co_occurrence or not co_occurrence[current_tag]:
-                break
-
             # 最も共起度の高いタグを選択
-            most_common = co_occurrence[current_tag].most_common(10)
+            most_common = co_occurrence.most_common(current_tag, 10)
             if not most_common:
                 break
 
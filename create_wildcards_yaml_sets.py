@@ -8,10 +8,13 @@ from pathlib import Path
 from collections import defaultdict, Counter
 import datetime
 from typing import List, Dict, Set, Tuple, Counter as CounterType, Optional, Any, Union
-import itertools
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+from tag_reader import exclusion_set, read_scored_tags
+from tag_scan import scan_files
+from tag_cooccurrence import TagCooccurrence
+from tag_clustering import CLUSTER_BACKENDS, cluster_tags
 
 # カテゴリ定義
 TAG_CATEGORIES = {
@@ -60,6 +63,7 @@ EXCLUDE_TAGS = [
     "chinese text", "character name", "character profile", "fake screenshot", "stats",
     "pixelated", "mosaic censoring", "censored", "copyright notice"
 ]
+EXCLUDED_TAGS = exclusion_set(EXCLUDE_TAGS)
 
 def parse_arguments():
     """コマンドライン引数のパース"""
@@ -75,6 +79,9 @@ def parse_arguments():
     parser.add_argument('--similarity', '-s', type=float, default=0.5, help='共起性の類似度しきい値')
     parser.add_argument('--min-set-size', '-m', type=int, default=3, help='セットの最小サイズ')
     parser.add_argument('--max-set-size', '-x', type=int, default=10, help='セットの最大サイズ')
+    parser.add_argument('--backend', '-b', choices=['jaccard', *CLUSTER_BACKENDS], default='jaccard',
+                        help='セットの作り方（jaccard: 類似度の高い組から集める、その他: tag_clustering のクラスタリング）')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='タグファイルを並列に読み込むプロセス数（0でCPUコア数）')
     return parser.parse_args()
 
 def get_tag_files(input_dir: str) -> List[Path]:
@@ -83,73 +90,18 @@ def get_tag_files(input_dir: str) -> List[Path]:
     return sorted(files)
 
 def read_tags_from_file(file_path: Union[str, Path]) -> List[Tuple[str, float]]:
-    """タグファイルからタグを読み取り"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            # コンマ区切りのタグを処理
-            tags: List[Tuple[str, float]] = []
-            if ',' in content:
-                for tag in content.split(','):
-                    tag = tag.strip()
-                    if tag and tag.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                        tags.append((tag, 1.0))  # デフォルトスコア1.0
-            # コロン区切りのタグを処理（スコア付き）
-            elif '\n' in content:
-                for line in content.split('\n'):
-                    if ':' in line:
-                        tag, score_str = line.split(':', 1)
-                        tag = tag.strip()
-                        if tag and tag.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                            try:
-                                score = float(score_str.strip())
-                                tags.append((tag, score))
-                            except ValueError:
-                                # スコア変換エラーの場合はスキップ
-                                continue
-                    else:
-                        # スコアがない場合はデフォルトスコア1.0を使用
-                        tag = line.strip()
-                        if tag and tag.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                            tags.append((tag, 1.0))
-            else:
-                # 単一行の場合
-                if content and content.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                    tags.append((content, 1.0))
-
-            return tags
-    except Exception as e:
-        print(f"ファイル読み込みエラー {file_path}: {e}")
-        return []
-
-def analyze_files(tag_files: List[Union[str, Path]], threshold: float = 0.6) -> Tuple[Dict[str, List[Tuple[str, int]]], int]:
-    """タグファイルを分析してタグの出現頻度と共起関係をカウント"""
-    all_tags: CounterType[str] = Counter()
-    file_count = 0
-    tag_sets = []  # 各ファイルのタグセット
+    """タグファイルからタグをスコア付きで読み取り（スコアのないタグは1.0）"""
+    return read_scored_tags(file_path, exclude=EXCLUDED_TAGS)
 
+def analyze_files(tag_files: List[Union[str, Path]], threshold: float = 0.6,
+                  workers: int = 1) -> Tuple[Dict[str, List[Tuple[str, int]]], List[List[str]], int]:
+    """タグファイルを（workers 個のプロセスで並列に）分析してタグの出現頻度と共起関係をカウント"""
     print(f"処理するファイル数: {len(tag_files)}")
 
-    # 各ファイルからタグを抽出し、タグセットリストを作成
-    for file_path in tag_files:
-        tags_with_scores = read_tags_from_file(file_path)
-        if not tags_with_scores:
-            continue
-
-        # しきい値以上のタグのみを追加
-        valid_tags = []
-        for tag, score in tags_with_scores:
-            if score >= threshold:
-                tag = tag.strip()
-                valid_tags.append(tag)
-                all_tags[tag] += 1
-
-        if valid_tags:
-            tag_sets.append(valid_tags)
-
-        file_count += 1
-        if file_count % 100 == 0:
-            print(f"{file_count} ファイル処理済み...")
+    # しきい値以上のタグのみを残す
+    records, all_tags = scan_files(tag_files, workers, exclude=EXCLUDED_TAGS, min_score=threshold)
+    tag_sets = records.file_tags()  # 各ファイルのタグセット
+    file_count = len(tag_sets)
 
     print(f"合計 {file_count} ファイル処理完了")
     print(f"一意なタグ数: {len(all_tags)}")
@@ -157,8 +109,9 @@ def analyze_files(tag_files: List[Union[str, Path]], threshold: float = 0.6) ->
     # カテゴリごとにタグを分類
     categorized_tags = defaultdict(list)
 
-    # 出現回数が1以上のタグとその出現回数をカテゴリごとにグループ化
-    for tag, count in all_tags.items():
+    # 出現回数が1以上のタグとその出現回数を、信頼度で重み付けした出現数の多い順にカテゴリごとにグループ化
+    for tag in records.ranked():
+        count = all_tags[tag]
         if count > 0:
             # キャラクター数判定
             if "1girl" in tag or "solo" in tag:
@@ -221,8 +174,14 @@ def analyze_files(tag_files: List[Union[str, Path]], threshold: float = 0.6) ->
     return categorized_tags, tag_sets, file_count
 
 def create_tag_sets(categorized_tags: Dict[str, List[Tuple[str, int]]], tag_sets: List[List[str]],
-                   min_set_size: int = 3, max_set_size: int = 10, similarity_threshold: float = 0.5) -> Dict[str, List[str]]:
-    """カテゴリごとにタグのセットを作成"""
+                   min_set_size: int = 3, max_set_size: int = 10, similarity_threshold: float = 0.5,
+                   backend: str = 'jaccard') -> Dict[str, List[str]]:
+    """
+    カテゴリごとにタグのセットを作成
+
+    backend が 'jaccard' 以外の場合は tag_clustering のバックエンドでカテゴリのタグを
+    クラスタリングし、まとまりの強い順にセットにする。
+    """
     result_sets = {}
 
     # character_mainは特別に処理
@@ -248,36 +207,25 @@ def create_tag_sets(categorized_tags: Dict[str, List[Tuple[str, int]]], tag_sets
             result_sets[category] = []
             continue
 
-        # タグの共起行列を作成
-        tag_occurrence = defaultdict(set)
-
-        # 各タグがどのファイルに出現するかを記録
-        for i, tag_set in enumerate(tag_sets):
-            for tag in tag_set:
-                if tag in tags:
-                    tag_occurrence[tag].add(i)
-
-        # タグの共起性を計算
-        cooccurrence = defaultdict(float)
-        for tag1, tag2 in itertools.combinations(tags, 2):
-            # 両方のタグが出現するファイルの集合
-            common_files = tag_occurrence[tag1].intersection(tag_occurrence[tag2])
-
-            # いずれかのタグが出現するファイルの集合
-            all_files = tag_occurrence[tag1].union(tag_occurrence[tag2])
-
-            # Jaccard類似度を計算
-            if all_files:
-                similarity = len(common_files) / len(all_files)
-                if similarity >= similarity_threshold:
-                    cooccurrence[(tag1, tag2)] = similarity
+        # カテゴリのタグだけで共起行列を作成
+        cooccurrence = TagCooccurrence.from_file_tags(tag_sets, tags)
 
         # タグをグループ化してセットを作成
         used_tags = set()
         tag_sets_result = []
 
-        # 最も共起性の高いペアから順にセットを形成
-        for (tag1, tag2), sim in sorted(cooccurrence.items(), key=lambda x: x[1], reverse=True):
+        if backend != 'jaccard':
+            # まとまりの強い順のタグセット
+            for cluster, _ in cluster_tags(cooccurrence, backend, min_set_size, max_set_size):
+                used_tags.update(cluster)
+                tag_sets_result.append(f"セット{len(tag_sets_result)+1}: {', '.join(sorted(cluster))}")
+            similar_pairs = {}
+        else:
+            # Jaccard類似度がしきい値以上の組
+            similar_pairs = cooccurrence.similar_pairs('jaccard', similarity_threshold)
+
+        # 最も共起性の高いペアから順にセットを形成（similar_pairs は類似度の高い順）
+        for (tag1, tag2), sim in similar_pairs.items():
             if tag1 in used_tags or tag2 in used_tags:
                 continue
 
@@ -294,7 +242,7 @@ def create_tag_sets(categorized_tags: Dict[str, List[Tuple[str, int]]], tag_sets
                 # 現在のセット内のタグとの類似度を確認
                 is_related = True
                 for existing_tag in current_set:
-                    if (tag, existing_tag) in cooccurrence or (existing_tag, tag) in cooccurrence:
+                    if (tag, existing_tag) in similar_pairs or (existing_tag, tag) in similar_pairs:
                         continue
                     else:
                         is_related = False
@@ -358,11 +306,12 @@ def main():
 
     # タグ分析
     print("タグを分析中...")
-    categorized_tags, tag_sets, file_count = analyze_files(tag_files, args.threshold)
+    categorized_tags, tag_sets, file_count = analyze_files(tag_files, args.threshold, args.workers)
 
     # タグセット作成
     print("タグセットを作成中...")
-    yaml_structure = create_tag_sets(categorized_tags, tag_sets, args.min_set_size, args.max_set_size, args.similarity)
+    yaml_structure = create_tag_sets(categorized_tags, tag_sets, args.min_set_size, args.max_set_size, args.similarity,
+                                     args.backend)
 
     # YAML保存
     print(f"ワイルドカードYAML保存中... {args.output}")
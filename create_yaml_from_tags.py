@@ -6,6 +6,7 @@ import yaml
 import argparse
 from pathlib import Path
 from collections import defaultdict, Counter
+from tag_reader import read_tag_names
 
 # カテゴリ定義
 TAG_CATEGORIES = {
@@ -56,16 +57,8 @@ def get_tag_files(input_dir, max_files=100):
     return sorted(files)[:max_files]  # 最大ファイル数まで
 
 def read_tags_from_file(file_path):
-    """タグファイルからタグを読み取り"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            # コンマで区切られたタグのリスト
-            tags = [tag.strip() for tag in content.split(',')]
-            return tags
-    except Exception as e:
-        print(f"ファイル読み込みエラー {file_path}: {e}")
-        return []
+    """タグファイルからタグを読み取り（形式は tag_reader が行ごとに判定）"""
+    return read_tag_names(file_path)
 
 def categorize_tags(tags):
     """タグをカテゴリごとに分類"""
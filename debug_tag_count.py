@@ -5,10 +5,12 @@ import os
 import argparse
 from pathlib import Path
 from collections import Counter
+from tag_store import TagStore, is_tag_store
+from tag_reader import read_tag_names
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='タグファイルの統計情報を出力')
-    parser.add_argument('--input', '-i', type=str, required=True, help='入力タグディレクトリ')
+    parser.add_argument('--input', '-i', type=str, required=True, help='入力タグディレクトリまたはタグストア')
     return parser.parse_args()
 
 def get_tag_files(input_dir):
@@ -16,44 +18,31 @@ def get_tag_files(input_dir):
     return sorted(files)
 
 def read_tags_from_file(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            tags = []
-            if ',' in content:
-                for tag in content.split(','):
-                    tag = tag.strip()
-                    if tag:
-                        tags.append(tag)
-            elif '\n' in content:
-                for line in content.split('\n'):
-                    if ':' in line:
-                        tag = line.split(':', 1)[0].strip()
-                        if tag:
-                            tags.append(tag)
-            return tags
-    except Exception as e:
-        print(f"ファイル読み込みエラー {file_path}: {e}")
-        return []
+    return read_tag_names(file_path)
 
 def main():
     args = parse_arguments()
     print(f"=== タグファイルの統計情報 ===")
 
-    tag_files = get_tag_files(args.input)
-    print(f"ディレクトリ内のtxtファイル総数: {len(tag_files)}")
+    if is_tag_store(args.input):
+        # タグストアは1画像分のタグを1ファイル分として扱う
+        tag_lists = [[tag for tag, _ in tags] for _, tags in TagStore(args.input).iter_tags()]
+        print(f"タグストア内の画像数: {len(tag_lists)}")
+    else:
+        tag_files = get_tag_files(args.input)
+        print(f"ディレクトリ内のtxtファイル総数: {len(tag_files)}")
+        tag_lists = map(read_tags_from_file, tag_files)
 
-    if not tag_files:
-        print(f"エラー: ディレクトリ '{args.input}' にタグファイルが見つかりません。")
-        return
+        if not tag_files:
+            print(f"エラー: ディレクトリ '{args.input}' にタグファイルが見つかりません。")
+            return
 
     all_tags = Counter()
     file_count = 0
     total_tags = 0
 
     print("タグを集計中...")
-    for file_path in tag_files:
-        tags = read_tags_from_file(file_path)
+    for tags in tag_lists:
         if tags:
             total_tags += len(tags)
             for tag in tags:
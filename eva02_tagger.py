@@ -2,15 +2,16 @@
 
 import os
 import sys
+import time
+import contextlib
 import argparse
-import glob
-import numpy as np
-from PIL import Image
-import onnxruntime as ort
 from tqdm import tqdm
-import pandas as pd
 import requests
-from pathlib import Path
+from tagging_cache import CACHE_FILENAME
+from tagger_engine import PREPROCESS_MODES, TaggerEngine, find_images
+from tagger_farm import TaggerFarm
+from tag_store import OUTPUT_FORMATS, STORE_FILENAME, TagStoreWriter
+from onnx_session import SESSION_PROFILES
 
 def download_model(model_dir):
     """モデルとCSVファイルをダウンロードする"""
@@ -59,8 +60,17 @@ def download_model(model_dir):
 
     return True
 
-def tag_images(img_dir, output_dir, model_dir, threshold=0.35):
-    """画像にタグを付ける"""
+def tag_images(img_dir, output_dir, model_dir, threshold=0.35, batch_size=8,
+               character_threshold=None, rating_threshold=None, top_k=None, use_cache=False,
+               output_format='files', session_profile='default', threads=None, precision='fp32',
+               preprocess='pad', workers=None, cache_path=None, cache_optimized=False):
+    """
+    画像にタグを付ける（character / rating の閾値は省略時 threshold と同じ）
+
+    workers を2以上にすると、その数のワーカープロセスで推論する（タガーファーム）。
+    この場合 threads はワーカー1つあたりのスレッド数（省略時は1）で、キャッシュは使わない。
+    キャッシュは use_cache=True の場合だけ使い、cache_path 省略時は出力ディレクトリ内に作成する。
+    """
     # モデルとタグ定義の確認
     model_path = os.path.join(model_dir, "model.onnx")
     csv_path = os.path.join(model_dir, "selected_tags.csv")
@@ -73,66 +83,68 @@ def tag_images(img_dir, output_dir, model_dir, threshold=0.35):
     # 出力ディレクトリを作成
     os.makedirs(output_dir, exist_ok=True)
 
-    # タグ情報を読み込む
-    print("タグ定義を読み込み中...")
-    df = pd.read_csv(csv_path)
-    labels = df['name'].tolist()
-
-    # モデルをロード
-    print("モデルをロード中...")
-    session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
-
-    # 画像ファイルの検索
-    extensions = ['jpg', 'jpeg', 'png', 'webp', 'bmp']
-    image_files = []
-    for ext in extensions:
-        image_files.extend(glob.glob(os.path.join(img_dir, f"*.{ext}")))
-        image_files.extend(glob.glob(os.path.join(img_dir, f"*.{ext.upper()}")))
-
-    if not image_files:
-        print(f"ディレクトリ {img_dir} に画像ファイルが見つかりません")
-        return False
-
-    print(f"合計 {len(image_files)} 個の画像ファイルを処理します")
-
-    # 各画像を処理
-    for img_path in tqdm(image_files, desc="タグ付け中"):
-        try:
-            # 画像の読み込み
-            img = Image.open(img_path).convert('RGB')
-
-            # リサイズ
-            img = img.resize((448, 448))
-
-            # 前処理
-            img_array = np.array(img).astype(np.float32) / 255.0
-            img_array = np.transpose(img_array, (2, 0, 1))  # HWC to CHW
-            img_array = np.expand_dims(img_array, axis=0)
+    category_thresholds = {'character': character_threshold, 'rating': rating_threshold}
+    if workers and workers > 1:
+        # モデルは各ワーカーでロードし、このプロセスはタグ定義だけを使って結果を書き込む
+        tagger = TaggerFarm(model_dir, workers=workers, batch_size=batch_size, threads=threads or 1,
+                            precision=precision, preprocess=preprocess, cache_optimized=cache_optimized)
+    else:
+        # モデルとタグ定義をロード
+        tagger = TaggerEngine(model_dir, batch_size=batch_size, use_cache=use_cache,
+                              cache_path=cache_path or os.path.join(output_dir, CACHE_FILENAME),
+                              session_profile=session_profile, threads=threads, precision=precision,
+                              preprocess=preprocess, cache_optimized=cache_optimized)
+
+    # 途中で例外が起きてもキャッシュとタグストアを閉じる
+    with tagger, contextlib.ExitStack() as stack:
+        labels = tagger.labels
+        postprocessor = tagger.postprocessor(threshold, category_thresholds, top_k)
+
+        # 画像ファイルの検索
+        image_files = find_images(img_dir)
+
+        if not image_files:
+            print(f"ディレクトリ {img_dir} に画像ファイルが見つかりません")
+            return False
 
-            # 推論
-            input_name = session.get_inputs()[0].name
-            output_name = session.get_outputs()[0].name
-            probs = session.run([output_name], {input_name: img_array})[0]
+        print(f"合計 {len(image_files)} 個の画像ファイルを処理します")
+
+        # 結果をタグストアにまとめる場合
+        writer = None
+        if output_format != 'files':
+            writer = stack.enter_context(TagStoreWriter(os.path.join(output_dir, STORE_FILENAME)))
+            label_ids = writer.intern(labels)
+
+        # バッチ推論
+        start_time = time.perf_counter()
+        tagged = 0
+        for img_path, indices, scores, error in tqdm(tagger.tag(image_files, postprocessor),
+                                                     total=len(image_files), desc="タグ付け中"):
+            if error is not None:
+                print(f"エラー ({img_path}): {error}")
+                continue
+            tagged += 1
+
+            if writer is not None:
+                writer.append(img_path, label_ids[indices], scores)
+            if output_format == 'store':
+                continue
 
             # 結果の保存
             base_name = os.path.splitext(os.path.basename(img_path))[0]
             out_path = os.path.join(output_dir, f"{base_name}.txt")
 
             with open(out_path, 'w', encoding='utf-8') as f:
-                # 確率と対応するラベルを組み合わせてソート
-                results = list(zip(labels, probs[0]))
-                results.sort(key=lambda x: x[1], reverse=True)
-
-                # 閾値以上の結果を保存
-                for tag, prob in results:
-                    if prob >= threshold:
-                        f.write(f"{tag}, {prob:.6f}\n")
+                # 閾値以上の結果を確率の高い順に保存
+                for tag, prob in postprocessor.tags(indices, scores):
+                    f.write(f"{tag}, {prob:.6f}\n")
 
-        except Exception as e:
-            print(f"エラー ({img_path}): {e}")
-
-    print("タグ付けが完了しました")
-    return True
+        elapsed = time.perf_counter() - start_time
+        if elapsed > 0:
+            note = f"（ワーカー {tagger.workers} プロセス）" if isinstance(tagger, TaggerFarm) else ""
+            print(f"処理速度: {tagged / elapsed:.2f} 画像/秒{note}")
+        print("タグ付けが完了しました")
+        return True
 
 def main():
     parser = argparse.ArgumentParser(description='EVA02-Large-v3でタグ付け')
@@ -140,13 +152,39 @@ def main():
     parser.add_argument('--out', required=True, help='出力ディレクトリ')
     parser.add_argument('--model_dir', default='tagger_data', help='モデルディレクトリ')
     parser.add_argument('--threshold', type=float, default=0.35, help='タグの閾値')
+    parser.add_argument('--batch_size', type=int, default=8, help='1回の推論にまとめる画像数')
+    parser.add_argument('--character_threshold', type=float, help='キャラクタータグの閾値（省略時は --threshold）')
+    parser.add_argument('--rating_threshold', type=float, help='レーティングタグの閾値（省略時は --threshold）')
+    parser.add_argument('--top_k', type=int, help='1画像あたりの最大タグ数')
+    parser.add_argument('--output_format', choices=OUTPUT_FORMATS, default='files',
+                        help='files: 画像ごとのファイル / store: tags.tagstore に集約 / both: 両方')
+    parser.add_argument('--threads', type=int, help='推論スレッド数（複数のタガーを並べて動かす場合に指定）')
+    parser.add_argument('--workers', type=int, help='ワーカープロセス数（2以上でタガーファームとして並列実行）')
+    parser.add_argument('--session_profile', choices=sorted(SESSION_PROFILES), default='default',
+                        help='ONNXセッション設定（worker: 1スレッド・スピン待ちなし）')
+    parser.add_argument('--int8', action='store_true', help='INT8量子化モデル（quantize_model.py で作成）を使う')
+    parser.add_argument('--preprocess', choices=PREPROCESS_MODES, default='pad',
+                        help='pad: 縦横比を保って余白を白で埋める（WDタガーの学習時と同じ） / stretch: 引き伸ばす（従来）')
+    parser.add_argument('--cache_optimized', action='store_true',
+                        help='最適化済みモデルをモデルディレクトリの .onnx_optimized/ に保存し、次回のロードを速くする'
+                             '（モデルとほぼ同じサイズ、EVA02-Large では約1.2GBのファイルが増える）')
+    parser.add_argument('--cache', nargs='?', const='', metavar='PATH',
+                        help='推論結果を画像の内容ハッシュでキャッシュし、再実行時の推論を省く'
+                             '（PATH省略時は出力ディレクトリの .tagging_cache.sqlite）。確率は float16 に丸め、'
+                             '0.01 未満は 0 として保存するため、閾値付近のタグが変わることがある')
     args = parser.parse_args()
 
     # モデルディレクトリの確認と作成
     os.makedirs(args.model_dir, exist_ok=True)
 
     # 画像にタグを付ける
-    success = tag_images(args.dir, args.out, args.model_dir, args.threshold)
+    success = tag_images(args.dir, args.out, args.model_dir, args.threshold, args.batch_size,
+                         args.character_threshold, args.rating_threshold, args.top_k,
+                         use_cache=args.cache is not None, cache_path=args.cache or None,
+                         output_format=args.output_format,
+                         session_profile=args.session_profile, threads=args.threads,
+                         precision='int8' if args.int8 else 'fp32', preprocess=args.preprocess,
+                         workers=args.workers, cache_optimized=args.cache_optimized)
 
     if success:
         print(f"処理が完了しました。タグは {args.out} に保存されました。")
@@ -3,15 +3,17 @@
 import os
 import sys
 import argparse
-import glob
 import json
-import numpy as np
+import contextlib
 from PIL import Image
-import onnxruntime as ort
 from tqdm import tqdm
-import pandas as pd
 import requests
-from pathlib import Path
+from tagging_cache import CACHE_FILENAME
+from tagger_engine import PREPROCESS_MODES, TaggerEngine, find_images, preprocess_image
+from tagger_farm import TaggerFarm
+from tag_store import OUTPUT_FORMATS, STORE_FILENAME, TagStoreWriter
+from job_manifest import JobManifest
+from onnx_session import SESSION_PROFILES
 
 # タグのカテゴリ分類定義
 TAG_CATEGORIES = {
@@ -247,8 +249,30 @@ def categorize_tags(tags_with_scores):
 
     return categorized
 
-def tag_images(img_dir, output_dir, model_dir, threshold=0.35, categorize=False):
-    """画像にタグを付ける"""
+def save_debug_image(img_path, output_dir, target_size, preprocess='pad'):
+    """画像の品質確認のため、モデルに入力する前処理後の画像をデバッグ用に保存"""
+    with Image.open(img_path) as img:
+        print(f"処理中の画像: {img_path}, サイズ: {img.size}, モード: {img.mode}")
+        img = preprocess_image(img, target_size, preprocess)
+
+    debug_dir = os.path.join(output_dir, "debug")
+    os.makedirs(debug_dir, exist_ok=True)
+    base_debug = os.path.splitext(os.path.basename(img_path))[0]
+    img.save(os.path.join(debug_dir, f"{base_debug}_resized.jpg"))
+
+def tag_images(img_dir, output_dir, model_dir, threshold=0.35, categorize=False, batch_size=8, use_cache=False,
+               output_format='files', session_profile='default', threads=None, precision='fp32',
+               retry_failed=False, restart=False, preprocess='pad', cache_path=None, cache_optimized=False,
+               workers=None):
+    """
+    画像にタグを付ける
+
+    進捗は出力ディレクトリのジョブマニフェストに記録し、再実行時は続きから処理する。
+    retry_failed=True の場合は前回失敗した画像だけを処理し、restart=True の場合は記録を破棄して最初から処理する。
+    workers を2以上にすると、その数のワーカープロセスで推論する（タガーファーム）。
+    この場合 threads はワーカー1つあたりのスレッド数（省略時は1）で、キャッシュは使わず、デバッグ用のリサイズ画像も保存しない。
+    キャッシュは use_cache=True の場合だけ使い、cache_path 省略時は出力ディレクトリ内に作成する。
+    """
     # モデルとタグ定義の確認
     model_path = os.path.join(model_dir, "model.onnx")
     csv_path = os.path.join(model_dir, "selected_tags.csv")
@@ -261,134 +285,143 @@ def tag_images(img_dir, output_dir, model_dir, threshold=0.35, categorize=False)
     # 出力ディレクトリを作成
     os.makedirs(output_dir, exist_ok=True)
 
-    # タグ情報を読み込む
-    print("タグ定義を読み込み中...")
-    df = pd.read_csv(csv_path)
-    labels = df['name'].tolist()
-
-    # モデルをロード
-    print("モデルをロード中...")
+    # モデルとタグ定義をロード
     try:
-        session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        if workers and workers > 1:
+            # モデルは各ワーカーでロードし、このプロセスはタグ定義だけを使って結果を書き込む
+            engine = TaggerFarm(model_dir, workers=workers, batch_size=batch_size, threads=threads or 1,
+                                precision=precision, preprocess=preprocess, cache_optimized=cache_optimized)
+        else:
+            engine = TaggerEngine(model_dir, batch_size=batch_size, use_cache=use_cache,
+                                  cache_path=cache_path or os.path.join(output_dir, CACHE_FILENAME),
+                                  session_profile=session_profile, threads=threads, precision=precision,
+                                  preprocess=preprocess, cache_optimized=cache_optimized)
     except Exception as e:
         print(f"モデルのロード中にエラーが発生しました: {e}")
         return False
 
-    # 画像ファイルを検索
-    print("画像ファイルを検索中...")
-    extensions = ['jpg', 'jpeg', 'png', 'webp', 'bmp']
-    image_files = []
-    for ext in extensions:
-        image_files.extend(glob.glob(os.path.join(img_dir, f"*.{ext}")))
-        image_files.extend(glob.glob(os.path.join(img_dir, f"*.{ext.upper()}")))
+    # 途中で例外が起きてもキャッシュ・タグストア・ジョブマニフェストを閉じる
+    with engine, contextlib.ExitStack() as stack:
+        postprocessor = engine.postprocessor(threshold)
+        if isinstance(engine, TaggerFarm):
+            print(f"ワーカープロセス数: {engine.workers}")
+        else:
+            print(f"モデルの期待する入力形状: {engine.input_shape}")
 
-    if not image_files:
-        print(f"ディレクトリ {img_dir} に画像ファイルが見つかりません")
-        return False
+        # 画像ファイルを検索
+        print("画像ファイルを検索中...")
+        image_files = find_images(img_dir)
 
-    print(f"合計 {len(image_files)} 個の画像ファイルを処理します")
-
-    # 各画像を処理
-    for img_path in tqdm(image_files, desc="タグ付け中"):
-        try:
-            # 画像の読み込み
-            img = Image.open(img_path).convert('RGB')
-
-            # デバッグ情報（処理前）
-            print(f"処理中の画像: {img_path}, サイズ: {img.size}, モード: {img.mode}")
-
-            # リサイズ - LANCZOSを使用して高品質なリサイズ
-            img = img.resize((448, 448), resample=Image.LANCZOS)
-
-            # 画像の品質確認のため、最初の画像はデバッグ用に保存
-            if os.path.basename(img_path) == os.path.basename(image_files[0]):
-                debug_dir = os.path.join(output_dir, "debug")
-                os.makedirs(debug_dir, exist_ok=True)
-                base_debug = os.path.splitext(os.path.basename(img_path))[0]
-                img.save(os.path.join(debug_dir, f"{base_debug}_resized.jpg"))
-
-            # 前処理
-            img_array = np.array(img).astype(np.float32) / 255.0
-            # モデルに合わせた入力形式に変換
-            img_array = np.expand_dims(img_array, axis=0)  # (H,W,C) -> (1,H,W,C)
-
-            # モデルのインプット形状を確認して必要があれば調整
-            input_shape = session.get_inputs()[0].shape
-            # 最初の画像のみ形状をデバッグ出力
-            if os.path.basename(img_path) == os.path.basename(image_files[0]):
-                print(f"入力配列の形状: {img_array.shape}")
-                print(f"モデルの期待する入力形状: {input_shape}")
-
-            # 必要に応じて形状を調整
-            if len(input_shape) == 4 and input_shape[1] == 448 and input_shape[3] == 3:
-                # これは (batch_size, 448, 448, 3) の形状を期待しています - 既に正しい形状
-                pass
-            elif len(input_shape) == 4 and input_shape[1] == 3 and input_shape[2] == 448 and input_shape[3] == 448:
-                # これは (batch_size, 3, 448, 448) の形状を期待しています - CHW形式に変換
-                img_array = np.transpose(img_array, (0, 3, 1, 2))  # (1,H,W,C) -> (1,C,H,W)
-                if os.path.basename(img_path) == os.path.basename(image_files[0]):
-                    print(f"形状を変換: {img_array.shape}")
-            else:
-                print(f"警告: 未知の入力形状 {input_shape}、デフォルト処理を試みます")
-
-            # 推論
-            input_name = session.get_inputs()[0].name
-            output_name = session.get_outputs()[0].name
-            probs = session.run([output_name], {input_name: img_array})[0]
-
-            # 結果をタグと確率のペアにする
-            tags_with_scores = [(labels[i], float(probs[0][i])) for i in range(len(labels)) if probs[0][i] >= threshold]
-            tags_with_scores.sort(key=lambda x: x[1], reverse=True)
-
-            # ベースネーム取得
-            base_name = os.path.splitext(os.path.basename(img_path))[0]
-
-            # タグをカテゴリ分類するかどうか
-            if categorize:
-                # カテゴリ分類
-                categorized_tags = categorize_tags(tags_with_scores)
-
-                # JSONとして保存
-                json_path = os.path.join(output_dir, f"{base_name}_categorized.json")
-                with open(json_path, 'w', encoding='utf-8') as f:
-                    json.dump(categorized_tags, f, ensure_ascii=False, indent=2)
-
-                # 読みやすいテキスト形式でも保存
-                txt_path = os.path.join(output_dir, f"{base_name}.txt")
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    # まず未分類の全タグを出力
-                    for tag, score in tags_with_scores:
-                        f.write(f"{tag}, {score:.6f}\n")
-
-                    f.write("\n--- カテゴリ別タグ ---\n\n")
-
-                    # カテゴリごとに出力
-                    for main_cat, sub_cats in categorized_tags.items():
-                        if main_cat == "uncategorized":
-                            if categorized_tags["uncategorized"]:
-                                f.write(f"■ 未分類:\n")
-                                for tag, score in categorized_tags["uncategorized"]:
-                                    f.write(f"  - {tag}, {score:.6f}\n")
-                            continue
-
-                        f.write(f"■ {main_cat}:\n")
-                        for sub_cat, tags in sub_cats.items():
-                            if tags:
-                                f.write(f"  ● {sub_cat}:\n")
-                                for tag, score in tags:
-                                    f.write(f"    - {tag}, {score:.6f}\n")
-            else:
-                # 通常のテキスト形式で保存
-                txt_path = os.path.join(output_dir, f"{base_name}.txt")
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    for tag, score in tags_with_scores:
-                        f.write(f"{tag}, {score:.6f}\n")
-
-        except Exception as e:
-            print(f"エラー ({img_path}): {e}")
-
-    print("タグ付けが完了しました")
-    return True
+        if not image_files:
+            print(f"ディレクトリ {img_dir} に画像ファイルが見つかりません")
+            return False
+
+        # 設定が同じジョブの記録があれば、処理済みの画像を飛ばす
+        manifest = stack.enter_context(JobManifest(output_dir, restart=restart, job={
+            'model': os.path.abspath(engine.model_path), 'threshold': threshold,
+            'categorize': categorize, 'output_format': output_format, 'preprocess': preprocess}))
+        total = len(image_files)
+        image_files = manifest.pending(image_files, retry_failed)
+        if retry_failed:
+            print(f"前回失敗した {len(image_files)} 個の画像ファイルを再処理します")
+        elif len(image_files) < total:
+            print(f"処理済みの {total - len(image_files)} 個を飛ばし、残り {len(image_files)} 個の画像ファイルを処理します")
+        else:
+            print(f"合計 {len(image_files)} 個の画像ファイルを処理します")
+
+        # 最初の画像はデバッグ用にリサイズ結果を保存（入力サイズはモデルをロードしたプロセスだけが知っている）
+        if image_files and isinstance(engine, TaggerEngine):
+            try:
+                save_debug_image(image_files[0], output_dir, engine.target_size, preprocess)
+            except Exception as e:
+                print(f"エラー ({image_files[0]}): {e}")
+
+        # 結果をタグストアにまとめる場合
+        writer = None
+        if output_format != 'files':
+            store_path = os.path.join(output_dir, STORE_FILENAME)
+            writer = stack.enter_context(TagStoreWriter(store_path))
+            label_ids = writer.intern(engine.labels)
+
+        # バッチ推論
+        for img_path, indices, scores, error in tqdm(engine.tag(image_files, postprocessor),
+                                                     total=len(image_files), desc="タグ付け中"):
+            if error is not None:
+                print(f"エラー ({img_path}): {error}")
+                manifest.mark_failed(img_path, error)
+                continue
+
+            outputs = []
+            if writer is not None:
+                writer.append(img_path, label_ids[indices], scores)
+                # マニフェストに記録する前にストアへ書き出す
+                writer.flush()
+                outputs.append(store_path)
+            if output_format == 'store':
+                manifest.mark_done(img_path, outputs)
+                continue
+
+            try:
+                # 結果をタグと確率のペアにする
+                tags_with_scores = postprocessor.tags(indices, scores)
+
+                # ベースネーム取得
+                base_name = os.path.splitext(os.path.basename(img_path))[0]
+
+                # タグをカテゴリ分類するかどうか
+                if categorize:
+                    # カテゴリ分類
+                    categorized_tags = categorize_tags(tags_with_scores)
+
+                    # JSONとして保存
+                    json_path = os.path.join(output_dir, f"{base_name}_categorized.json")
+                    with open(json_path, 'w', encoding='utf-8') as f:
+                        json.dump(categorized_tags, f, ensure_ascii=False, indent=2)
+                    outputs.append(json_path)
+
+                    # 読みやすいテキスト形式でも保存
+                    txt_path = os.path.join(output_dir, f"{base_name}.txt")
+                    with open(txt_path, 'w', encoding='utf-8') as f:
+                        # まず未分類の全タグを出力
+                        for tag, score in tags_with_scores:
+                            f.write(f"{tag}, {score:.6f}\n")
+
+                        f.write("\n--- カテゴリ別タグ ---\n\n")
+
+                        # カテゴリごとに出力
+                        for main_cat, sub_cats in categorized_tags.items():
+                            if main_cat == "uncategorized":
+                                if categorized_tags["uncategorized"]:
+                                    f.write(f"■ 未分類:\n")
+                                    for tag, score in categorized_tags["uncategorized"]:
+                                        f.write(f"  - {tag}, {score:.6f}\n")
+                                continue
+
+                            f.write(f"■ {main_cat}:\n")
+                            for sub_cat, tags in sub_cats.items():
+                                if tags:
+                                    f.write(f"  ● {sub_cat}:\n")
+                                    for tag, score in tags:
+                                        f.write(f"    - {tag}, {score:.6f}\n")
+                else:
+                    # 通常のテキスト形式で保存
+                    txt_path = os.path.join(output_dir, f"{base_name}.txt")
+                    with open(txt_path, 'w', encoding='utf-8') as f:
+                        for tag, score in tags_with_scores:
+                            f.write(f"{tag}, {score:.6f}\n")
+                outputs.append(txt_path)
+                manifest.mark_done(img_path, outputs)
+
+            except Exception as e:
+                print(f"エラー ({img_path}): {e}")
+                manifest.mark_failed(img_path, e)
+
+        failed = manifest.failed()
+        if failed:
+            print(f"{len(failed)} 個の画像でエラーが発生しました（--retry_failed で再処理できます）: {manifest.path}")
+
+        print("タグ付けが完了しました")
+        return True
 
 def main():
     parser = argparse.ArgumentParser(description='EVA02モデルを使用して画像にタグを付け、カテゴリ分類する')
@@ -397,10 +430,35 @@ def main():
     parser.add_argument('--model_dir', default='./tagger_data', help='モデルファイルのディレクトリ')
     parser.add_argument('--threshold', type=float, default=0.35, help='タグ検出の閾値')
     parser.add_argument('--categorize', action='store_true', help='タグをカテゴリ分類するかどうか')
+    parser.add_argument('--batch_size', type=int, default=8, help='1回の推論にまとめる画像数')
+    parser.add_argument('--output_format', choices=OUTPUT_FORMATS, default='files',
+                        help='files: 画像ごとのファイル / store: tags.tagstore に集約 / both: 両方')
+    parser.add_argument('--threads', type=int, help='推論スレッド数（複数のタガーを並べて動かす場合に指定）')
+    parser.add_argument('--workers', type=int, help='ワーカープロセス数（2以上でタガーファームとして並列実行）')
+    parser.add_argument('--session_profile', choices=sorted(SESSION_PROFILES), default='default',
+                        help='ONNXセッション設定（worker: 1スレッド・スピン待ちなし）')
+    parser.add_argument('--int8', action='store_true', help='INT8量子化モデル（quantize_model.py で作成）を使う')
+    parser.add_argument('--preprocess', choices=PREPROCESS_MODES, default='pad',
+                        help='pad: 縦横比を保って余白を白で埋める（WDタガーの学習時と同じ） / stretch: 引き伸ばす（従来）')
+    parser.add_argument('--cache_optimized', action='store_true',
+                        help='最適化済みモデルをモデルディレクトリの .onnx_optimized/ に保存し、次回のロードを速くする'
+                             '（モデルとほぼ同じサイズ、EVA02-Large では約1.2GBのファイルが増える）')
+    parser.add_argument('--cache', nargs='?', const='', metavar='PATH',
+                        help='推論結果を画像の内容ハッシュでキャッシュし、再実行時の推論を省く'
+                             '（PATH省略時は出力ディレクトリの .tagging_cache.sqlite）。確率は float16 に丸め、'
+                             '0.01 未満は 0 として保存するため、閾値付近のタグが変わることがある')
+    parser.add_argument('--retry_failed', action='store_true', help='前回エラーになった画像だけを再処理する')
+    parser.add_argument('--restart', action='store_true', help='前回の進捗記録を破棄して最初から処理する')
     args = parser.parse_args()
 
     # 画像にタグを付ける
-    success = tag_images(args.dir, args.out, args.model_dir, args.threshold, args.categorize)
+    success = tag_images(args.dir, args.out, args.model_dir, args.threshold, args.categorize, args.batch_size,
+                         use_cache=args.cache is not None, cache_path=args.cache or None,
+                         output_format=args.output_format,
+                         session_profile=args.session_profile, threads=args.threads,
+                         precision='int8' if args.int8 else 'fp32',
+                         retry_failed=args.retry_failed, restart=args.restart, preprocess=args.preprocess,
+                         cache_optimized=args.cache_optimized, workers=args.workers)
 
     if success:
         print(f"処理が完了しました。タグは {args.out} に保存されました。")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+テキスト抽出キャッシュ
+フォルダごとにSQLiteのキャッシュファイルへ各txtファイルの分類結果を保存し、
+変更のないファイルの再読み込み・再分類を省略する
+
+キャッシュファイルは入力フォルダではなくユーザーのキャッシュディレクトリ
+（Windows: %LOCALAPPDATA%、それ以外: $XDG_CACHE_HOME または ~/.cache）に
+フォルダごとに作成する（入力フォルダが読み取り専用・共有でもよいように）。
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+from prompt_classifier import KEYWORD_DATABASE_HASH
+
+# キャッシュファイル名（cache_path で入力フォルダ内などを指定する場合の名前）
+CACHE_FILENAME = '.prompt_classifier_cache.sqlite'
+
+# ユーザーのキャッシュディレクトリ内のサブディレクトリ名
+CACHE_DIRNAME = 'prompt_classifier'
+
+# 分類結果をまとめて保存するファイル数（途中で止めてもここまでの結果は残る）
+FLUSH_FILES = 500
+
+# キャッシュ形式のバージョン（保存形式を変えたら上げる）
+CACHE_VERSION = '1'
+
+
+def user_cache_dir():
+    """ユーザーのキャッシュディレクトリ"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(r'~\AppData\Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, CACHE_DIRNAME)
+
+
+def default_cache_path(folder_path):
+    """フォルダのキャッシュファイルの既定のパス（フォルダの絶対パスごとに別のファイル）"""
+    key = hashlib.sha1(os.path.abspath(folder_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(user_cache_dir(), f"extraction_{key}.sqlite")
+
+
+class ExtractionCache:
+    """
+    txtファイルの分類結果キャッシュ
+
+    キーはファイル名・更新時刻(ns)・サイズ。キーワード辞書のハッシュが
+    変わった場合はキャッシュ全体を破棄する。
+    値は全カテゴリの分類結果（カテゴリIDをインデックスとするタグリスト）なので、
+    抽出カテゴリを切り替えても再分類は不要。
+    """
+
+    def __init__(self, folder_path, cache_path=None, database_hash=KEYWORD_DATABASE_HASH):
+        self.cache_path = cache_path or default_cache_path(folder_path)
+        self.database_hash = database_hash
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.cache_path)
+        self._init_schema()
+
+    def _init_schema(self):
+        """テーブル作成と、辞書・形式が変わっていれば全エントリ破棄"""
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                ' filename TEXT PRIMARY KEY,'
+                ' mtime_ns INTEGER NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' classified TEXT)')
+
+            stamp = f'{CACHE_VERSION}:{self.database_hash}'
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+            if row is None or row[0] != stamp:
+                self.conn.execute('DELETE FROM files')
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('stamp', ?)", (stamp,))
+
+    def load(self):
+        """
+        全エントリを一括読み込み
+
+        Returns:
+            dict: filename → (mtime_ns, size, classified)
+                classified は空ファイルの場合 None
+        """
+        entries = {}
+        for filename, mtime_ns, size, classified in self.conn.execute(
+                'SELECT filename, mtime_ns, size, classified FROM files'):
+            entries[filename] = (mtime_ns, size,
+                                 None if classified is None else json.loads(classified))
+        return entries
+
+    def store(self, records):
+        """
+        分類結果をまとめて保存（1トランザクション）
+
+        Args:
+            records (iterable): (filename, mtime_ns, size, classified) のイテラブル
+        """
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO files (filename, mtime_ns, size, classified) '
+                'VALUES (?, ?, ?, ?)',
+                ((filename, mtime_ns, size,
+                  None if classified is None else json.dumps(classified, ensure_ascii=False))
+                 for filename, mtime_ns, size, classified in records))
+
+    def prune(self, filenames):
+        """フォルダから消えたファイルのエントリを削除"""
+        keep = set(filenames)
+        stale = [(filename,) for (filename,) in self.conn.execute('SELECT filename FROM files')
+                 if filename not in keep]
+        if stale:
+            with self.conn:
+                self.conn.executemany('DELETE FROM files WHERE filename = ?', stale)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -9,12 +9,55 @@
 """
 
 import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
+from tkinter import ttk, filedialog, messagebox
 from datetime import datetime
 import yaml
-from prompt_classifier import PromptClassifier
-from text_extractor import TextExtractor
+from prompt_classifier import PromptClassifier, CATEGORIES
+from text_extractor import TextExtractor, PreviewBuffer
+from virtual_preview import VirtualTextView, FileLines, ListLines
+
+
+# ワーカースレッドのイベントをポーリングする間隔（ミリ秒）
+POLL_INTERVAL_MS = 100
+
+# 進捗イベントを送る最短間隔（秒）
+PROGRESS_INTERVAL_SEC = 0.05
+
+# ウィンドウを閉じるとき、キャンセルしたワーカーの終了を待つ最長時間（秒）
+CLOSE_WAIT_SEC = 5.0
+
+
+class OperationCancelled(Exception):
+    """キャンセルボタンで処理が中断された"""
+
+
+class StreamingPreview(PreviewBuffer):
+    """先頭部分の行をまとめてGUIへ送り、処理中にプレビューを更新するバッファ"""
+
+    def __init__(self, events, batch_size=100, **kwargs):
+        super().__init__(**kwargs)
+        self.events = events
+        self.batch_size = batch_size
+        self.pending = []
+
+    def append(self, line):
+        super().append(line)
+        if self.count <= self.head_size:
+            self.pending.append(line)
+            if len(self.pending) >= self.batch_size or self.count == self.head_size:
+                self.flush()
+
+    def flush(self):
+        """未送信の行をイベントキューへ送る"""
+        if self.pending:
+            self.events.put(('preview', self.pending))
+            self.pending = []
 
 
 class PromptClassifierGUI:
@@ -44,12 +87,20 @@ class PromptClassifierGUI:
         # 選択されたパス
         self.selected_path = ""
 
-        # 保存用コンテンツ（統計情報を含まない）
-        self.save_content = ""
+        # 処理結果を書き込んだ一時ファイル（保存・コピー・プレビューの元データ）
+        self.spool_path = None
+
+        # ワーカースレッドとの通信
+        self.worker = None
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
 
         # GUI構築
         self.create_widgets()
 
+        # 閉じるときはTkが生きているうちにワーカーを止めて一時ファイルを片付ける
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+
     def create_widgets(self):
         """GUI要素を作成"""
         # メインフレーム
@@ -112,9 +163,10 @@ class PromptClassifierGUI:
         preview_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         main_frame.rowconfigure(3, weight=1)
 
-        self.preview_text = scrolledtext.ScrolledText(preview_frame, wrap=tk.WORD,
-                                                      width=80, height=20)
-        self.preview_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        # 見えている行だけを描画する仮想化ビュー
+        self.preview_view = VirtualTextView(preview_frame, wrap=tk.NONE,
+                                            width=80, height=20)
+        self.preview_view.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         preview_frame.columnconfigure(0, weight=1)
         preview_frame.rowconfigure(0, weight=1)
 
@@ -135,6 +187,22 @@ class PromptClassifierGUI:
         ttk.Button(button_frame, text="クリア",
                   command=self.clear_preview).pack(side=tk.LEFT, padx=5)
 
+        self.cancel_button = ttk.Button(button_frame, text="キャンセル",
+                                       command=self.cancel, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        # ========== 進捗エリア ==========
+        progress_frame = ttk.Frame(main_frame)
+        progress_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        progress_frame.columnconfigure(0, weight=1)
+
+        self.progress_var = tk.DoubleVar(value=0)
+        ttk.Progressbar(progress_frame, variable=self.progress_var,
+                        maximum=100).grid(row=0, column=0, sticky=(tk.W, tk.E), padx=5)
+
+        self.status_label = ttk.Label(progress_frame, text="", foreground="gray")
+        self.status_label.grid(row=0, column=1, sticky=tk.E, padx=5)
+
         # 初期状態設定
         self.on_mode_change()
 
@@ -183,7 +251,10 @@ class PromptClassifierGUI:
         return [key for key, var in self.category_vars.items() if var.get()]
 
     def execute(self):
-        """実行ボタン押下時の処理"""
+        """実行ボタン押下時の処理（重い処理はワーカースレッドで実行）"""
+        if self.worker is not None:
+            return
+
         if not self.selected_path:
             messagebox.showwarning("警告", "ファイルまたはフォルダを選択してください")
             return
@@ -193,49 +264,121 @@ class PromptClassifierGUI:
             messagebox.showwarning("警告", "少なくとも1つのカテゴリを選択してください")
             return
 
+        if self.mode.get() == "yaml":
+            # 複数ファイル対応
+            file_paths = self.selected_path if isinstance(self.selected_path, list) else [self.selected_path]
+            self.start_job(lambda: self.generate_yaml(file_paths))
+        else:
+            folder_path = self.selected_path
+            self.start_job(lambda: self.extract_text(folder_path, selected_categories))
+
+    def start_job(self, job):
+        """ワーカースレッドを起動し、イベントキューのポーリングを開始"""
+        self.events = queue.Queue()
+        self.cancel_event.clear()
+
+        # 前回の結果は破棄し、処理中の途中経過をメモリ上の行で表示
+        self.discard_spool_file()
+        self.preview_view.set_source(ListLines())
+        self.progress_var.set(0)
+        self.status_label.config(text="処理中...")
+        self.execute_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+
+        self.worker = threading.Thread(target=self.run_job, args=(job,), daemon=True)
+        self.worker.start()
+        self.root.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def run_job(self, job):
+        """ワーカースレッド本体（Tkには触れず、結果はキュー経由で返す）"""
         try:
-            if self.mode.get() == "yaml":
-                self.generate_yaml()
-            else:
-                self.extract_text()
+            self.events.put(('done', job()))
+        except OperationCancelled:
+            self.events.put(('cancelled',))
         except Exception as e:
-            messagebox.showerror("エラー", f"処理中にエラーが発生しました:\n{str(e)}")
-
-    def generate_yaml(self):
-        """YAML生成モードの実行"""
-        # 複数ファイル対応
-        file_paths = self.selected_path if isinstance(self.selected_path, list) else [self.selected_path]
-
-        # 初期化
-        categorized_lines = {
-            'characterface': [],
-            'clothing': [],
-            'poseemotion': [],
-            'backgrounds': [],
-            'characterbody': [],
-            'uncategorized': []
-        }
-
-        total_lines = 0
-        # 複数ファイルから全行を読み込んで分類
-        for file_path in file_paths:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-
-                total_lines += 1
-                # 1行を分類
-                classified = self.classifier.classify_prompt(line)
-
-                # 各カテゴリについて、タグをカンマ区切り文字列として追加
-                for category, tags in classified.items():
-                    if tags:
-                        tag_string = ', '.join(tags)
-                        categorized_lines[category].append(tag_string)
+            self.events.put(('error', e))
+
+    def cancel(self):
+        """キャンセルボタン押下時の処理"""
+        if self.worker is not None:
+            self.cancel_event.set()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status_label.config(text="キャンセル中...")
+
+    def poll_events(self):
+        """ワーカーからのイベントを処理（root.afterで定期実行）"""
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            kind = event[0]
+            if kind == 'progress':
+                _, index, total, label = event
+                self.progress_var.set(100.0 * index / total if total else 100.0)
+                self.status_label.config(text=f"{index}/{total} {label}")
+            elif kind == 'preview':
+                self.preview_view.append_lines(event[1])
+            elif kind == 'done':
+                self.finish_job()
+                self.show_result(event[1])
+                return
+            elif kind == 'cancelled':
+                self.finish_job()
+                self.status_label.config(text="キャンセルしました")
+                return
+            elif kind == 'error':
+                self.finish_job()
+                self.status_label.config(text="エラー")
+                messagebox.showerror("エラー", f"処理中にエラーが発生しました:\n{str(event[1])}")
+                return
+
+        self.root.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def finish_job(self):
+        """ワーカー終了後にボタン状態を戻す"""
+        self.worker = None
+        self.execute_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def make_progress_callback(self):
+        """
+        ワーカー用の進捗callbackを作成
+
+        キャンセル要求があれば OperationCancelled を送出し、
+        進捗イベントは一定間隔に間引いてキューへ送る。
+        """
+        last_sent = [0.0]
+
+        def progress_callback(index, total, label, *_):
+            if self.cancel_event.is_set():
+                raise OperationCancelled()
+
+            now = time.monotonic()
+            if index == total or now - last_sent[0] >= PROGRESS_INTERVAL_SEC:
+                last_sent[0] = now
+                self.events.put(('progress', index, total, os.path.basename(label)))
+
+        return progress_callback
+
+    def show_result(self, result):
+        """ワーカーの処理結果をプレビューに表示（メインスレッド）"""
+        # 結果ファイルをmmapしてプレビュー（統計情報はフッターとして表示のみ）
+        self.discard_spool_file()
+        self.spool_path = result['spool_path']
+        self.preview_view.set_source(FileLines(self.spool_path),
+                                     footer=result['stats'].split('\n'))
+
+        self.progress_var.set(100)
+        self.status_label.config(text="完了")
+        messagebox.showinfo("成功", result['message'])
+
+    def generate_yaml(self, file_paths):
+        """YAML生成モードの実行（ワーカースレッド）"""
+        # 複数ファイルを1行ずつストリーム分類（キャンセル・進捗はファイルの途中でも一定行数ごとに確認）
+        categorized_lines, total_lines = self.classifier.classify_files_for_yaml(
+            file_paths, progress_callback=self.make_progress_callback())
 
         # YAMLテキスト手動生成（StabilityMatrix互換形式）
         yaml_lines = []
@@ -246,22 +389,18 @@ class PromptClassifierGUI:
         yaml_lines.append('')
 
         # 各カテゴリのセクション
-        for category in ['characterface', 'clothing', 'poseemotion', 'backgrounds', 'characterbody', 'uncategorized']:
+        for category in CATEGORIES:
             yaml_lines.append(f'{category}:')
             for tag_string in categorized_lines[category]:
                 yaml_lines.append(f'  - "{tag_string}"')
             yaml_lines.append('')
 
-        yaml_text = '\n'.join(yaml_lines)
-
-        # 保存用コンテンツを保持（統計情報を含まない）
-        self.save_content = yaml_text
-
-        # プレビュー表示
-        self.preview_text.delete('1.0', tk.END)
-        self.preview_text.insert('1.0', yaml_text)
+        # 結果は一時ファイルへ書き出し、プレビュー・保存はそこから行う
+        spool_path = self.new_spool_file(suffix='.yaml')
+        with open(spool_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(yaml_lines))
 
-        # 統計情報表示
+        # 統計情報
         stats = "\n\n===== 分類結果 =====\n"
         stats += f"処理ファイル数: {len(file_paths)}\n"
         stats += f"処理行数: {total_lines}\n"
@@ -269,41 +408,66 @@ class PromptClassifierGUI:
         for category, tags in categorized_lines.items():
             stats += f"{category}: {len(tags)} エントリー\n"
 
-        self.preview_text.insert(tk.END, stats)
-
-        messagebox.showinfo("成功", f"{len(file_paths)}ファイル・{total_lines}行からYAML生成が完了しました")
-
-    def extract_text(self):
-        """テキスト抽出モードの実行"""
-        selected_categories = self.get_selected_categories()
-
-        # フォルダから抽出
-        extracted_lines = self.extractor.extract_from_folder(
-            self.selected_path,
-            selected_categories
-        )
-
-        # プレビュー表示
-        preview_text = "\n".join(extracted_lines)
-
-        # 保存用コンテンツを保持（統計情報を含まない）
-        self.save_content = preview_text
+        return {
+            'spool_path': spool_path,
+            'stats': stats,
+            'message': f"{len(file_paths)}ファイル・{total_lines}行からYAML生成が完了しました",
+        }
 
-        self.preview_text.delete('1.0', tk.END)
-        self.preview_text.insert('1.0', preview_text)
+    def extract_text(self, folder_path, selected_categories):
+        """テキスト抽出モードの実行（ワーカースレッド）"""
+        # 抽出結果は一時ファイルへ直接書き込み、プレビューは先頭・末尾のみ保持
+        spool_path = self.new_spool_file()
+        preview = StreamingPreview(self.events)
+        try:
+            self.extractor.extract_to_file(
+                folder_path,
+                selected_categories,
+                spool_path,
+                preview=preview,
+                progress_callback=self.make_progress_callback(),
+                use_cache=True
+            )
+        except BaseException:
+            # 途中までの結果を保存できないように破棄
+            os.remove(spool_path)
+            raise
+        preview.flush()
 
         # 統計情報
         stats = f"\n\n===== 抽出結果 =====\n"
-        stats += f"処理ファイル数: {len(extracted_lines)}\n"
+        stats += f"処理ファイル数: {preview.count}\n"
         stats += f"選択カテゴリ: {', '.join(selected_categories)}\n"
 
-        self.preview_text.insert(tk.END, stats)
+        return {
+            'spool_path': spool_path,
+            'stats': stats,
+            'message': f"{preview.count}ファイルからテキスト抽出が完了しました",
+        }
 
-        messagebox.showinfo("成功", f"{len(extracted_lines)}ファイルからテキスト抽出が完了しました")
+    def new_spool_file(self, suffix='.txt'):
+        """処理結果を書き込む一時ファイルを作成"""
+        fd, spool_path = tempfile.mkstemp(prefix='prompt_classifier_', suffix=suffix)
+        os.close(fd)
+        return spool_path
+
+    def discard_spool_file(self):
+        """一時ファイルを削除（プレビューのmmapを先に閉じる）"""
+        self.preview_view.clear()
+        if self.spool_path and os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+        self.spool_path = None
+
+    def get_result_content(self):
+        """保存・コピー対象の全内容（統計情報を含まない）"""
+        if not self.spool_path:
+            return ""
+        with open(self.spool_path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
 
     def copy_to_clipboard(self):
         """クリップボードにコピー"""
-        content = self.preview_text.get('1.0', tk.END).strip()
+        content = self.get_result_content()
         if not content:
             messagebox.showwarning("警告", "コピーする内容がありません")
             return
@@ -314,9 +478,8 @@ class PromptClassifierGUI:
 
     def save_to_file(self):
         """ファイルに保存"""
-        # 保存用コンテンツを使用（統計情報を除外）
-        content = self.save_content.strip() if self.save_content else ""
-        if not content:
+        # 結果ファイルを使用（統計情報を除外）
+        if not self.spool_path or os.path.getsize(self.spool_path) == 0:
             messagebox.showwarning("警告", "保存する内容がありません")
             return
 
@@ -341,14 +504,29 @@ class PromptClassifierGUI:
         )
 
         if filepath:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
+            # 結果ファイルをそのままコピー（メモリに読み込まない）
+            shutil.copyfile(self.spool_path, filepath)
             messagebox.showinfo("成功", f"ファイルを保存しました:\n{filepath}")
 
     def clear_preview(self):
         """プレビューをクリア"""
-        self.preview_text.delete('1.0', tk.END)
-        self.save_content = ""
+        self.discard_spool_file()
+
+    def on_close(self):
+        """ウィンドウを閉じる（処理中ならキャンセルして終了を待ち、一時ファイルを削除してから破棄）"""
+        if self.worker is not None:
+            self.cancel_event.set()
+            self.worker.join(CLOSE_WAIT_SEC)
+            # キャンセル前に完了していた結果の一時ファイルも削除
+            while True:
+                try:
+                    event = self.events.get_nowait()
+                except queue.Empty:
+                    break
+                if event[0] == 'done' and os.path.exists(event[1]['spool_path']):
+                    os.remove(event[1]['spool_path'])
+        self.discard_spool_file()
+        self.root.destroy()
 
 
 def main():
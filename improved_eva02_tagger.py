@@ -3,16 +3,16 @@
 
 import os
 import sys
-import glob
 import argparse
 import json
-import numpy as np
-import pandas as pd
-from PIL import Image
-import onnxruntime as ort
+import contextlib
 from tqdm import tqdm
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from tagging_cache import CACHE_FILENAME
+from tagger_engine import PREPROCESS_MODES, TaggerEngine, find_images
+from tagger_farm import TaggerFarm
+from tag_store import OUTPUT_FORMATS, STORE_FILENAME, TagStoreWriter
+from onnx_session import SESSION_PROFILES
 
 # タグカテゴリ定義（タグのグループ分け）
 TAG_CATEGORIES = {
@@ -126,48 +126,6 @@ def download_model(model_dir="tagger_data"):
 
     return True
 
-def preprocess_image(img_path, target_size=(448, 448)):
-    """画像を読み込み、前処理を行う"""
-    # 画像の読み込み
-    img = Image.open(img_path).convert('RGB')
-
-    # 高品質なリサイズ（LANCZOS法を使用）
-    img_resized = img.resize(target_size, resample=Image.LANCZOS)
-
-    # NumPy配列に変換
-    img_array = np.array(img_resized).astype(np.float32) / 255.0
-
-    # バッチ次元を追加 (1, H, W, C)
-    img_array = np.expand_dims(img_array, axis=0)
-
-    return img_array, img.size
-
-def batch_preprocess_images(image_paths, target_size=(448, 448), batch_size=8):
-    """画像のバッチを前処理する"""
-    batch_arrays = []
-    original_sizes = []
-
-    for i in range(0, len(image_paths), batch_size):
-        batch_paths = image_paths[i:i+batch_size]
-        batch_data = []
-        batch_sizes = []
-
-        # 各画像を並列で処理
-        with ThreadPoolExecutor(max_workers=min(8, len(batch_paths))) as executor:
-            futures = {executor.submit(preprocess_image, path, target_size): path for path in batch_paths}
-            for future in as_completed(futures):
-                img_array, original_size = future.result()
-                batch_data.append(img_array[0])  # バッチ次元を削除して追加
-                batch_sizes.append(original_size)
-
-        # バッチに積み重ねる
-        if batch_data:
-            batch_array = np.stack(batch_data)
-            batch_arrays.append(batch_array)
-            original_sizes.extend(batch_sizes)
-
-    return batch_arrays, original_sizes
-
 def categorize_tags(tags_with_scores):
     """タグをカテゴリ分類する"""
     categorized = {
@@ -211,8 +169,17 @@ def categorize_tags(tags_with_scores):
 
     return categorized
 
-def tag_images(img_dir, output_dir, model_dir="tagger_data", threshold=0.35, categorize=True, batch_size=8, use_gpu=True):
-    """画像にタグを付ける"""
+def tag_images(img_dir, output_dir, model_dir="tagger_data", threshold=0.35, categorize=True, batch_size=8, use_gpu=True,
+               decode_processes=False, character_threshold=None, rating_threshold=None, top_k=None,
+               use_cache=False, output_format='files', session_profile='default', threads=None, precision='fp32',
+               preprocess='pad', cache_path=None, cache_optimized=False, workers=None):
+    """
+    画像にタグを付ける（character / rating の閾値は省略時 threshold と同じ）
+
+    workers を2以上にすると、その数のワーカープロセスで推論する（タガーファーム）。
+    この場合 threads はワーカー1つあたりのスレッド数（省略時は1）で、キャッシュは使わない。
+    キャッシュは use_cache=True の場合だけ使い、cache_path 省略時は出力ディレクトリ内に作成する。
+    """
     # 出力ディレクトリを作成
     os.makedirs(output_dir, exist_ok=True)
 
@@ -225,119 +192,105 @@ def tag_images(img_dir, output_dir, model_dir="tagger_data", threshold=0.35, cat
         if not download_model(model_dir):
             return False
 
-    # タグ情報を読み込む
-    print(f"タグ定義を読み込み中... {csv_path}")
-    df = pd.read_csv(csv_path)
-    labels = df['name'].tolist()
-    print(f"タグ数: {len(labels)}")
-
-    # ONNXランタイムセッションの作成
-    providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
-    session_options = ort.SessionOptions()
-    session_options.enable_profiling = False
-    session_options.enable_mem_pattern = True
-    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-
-    print(f"モデルをロード中... {model_path}")
-    try:
-        session = ort.InferenceSession(model_path, sess_options=session_options, providers=providers)
-    except Exception as e:
-        print(f"モデルのロード中にエラーが発生しました。CPUモードで再試行します: {e}")
-        session = ort.InferenceSession(model_path, sess_options=session_options, providers=['CPUExecutionProvider'])
-
-    input_name = session.get_inputs()[0].name
-    output_name = session.get_outputs()[0].name
-    input_shape = session.get_inputs()[0].shape
-    print(f"モデルの入力形状: {input_shape}")
-
-    # 画像ファイルの検索
-    extensions = ["jpg", "jpeg", "png", "webp", "bmp"]
-    image_files = []
-
-    for ext in extensions:
-        image_files.extend(glob.glob(os.path.join(img_dir, f"*.{ext}")))
-        image_files.extend(glob.glob(os.path.join(img_dir, f"*.{ext.upper()}")))
-
-    if not image_files:
-        print(f"ディレクトリ {img_dir} に画像ファイルが見つかりません")
-        return False
-
-    print(f"合計 {len(image_files)} 個の画像ファイルを処理します")
-
-    # バッチ処理の準備
-    batch_arrays, original_sizes = batch_preprocess_images(image_files, batch_size=batch_size)
-
-    # 各バッチを処理
-    results = []
-    start_time = time.time()
-
-    for i, batch_array in enumerate(tqdm(batch_arrays, desc="バッチ処理中")):
-        batch_paths = image_files[i*batch_size:(i+1)*batch_size]
-
-        # 入力形状の調整（NCHW形式に変換が必要な場合）
-        if len(input_shape) == 4 and input_shape[1] == 3:
-            # NHWC -> NCHW
-            batch_array = np.transpose(batch_array, (0, 3, 1, 2))
-
-        # バッチ推論
-        try:
-            probs = session.run([output_name], {input_name: batch_array})[0]
-
-            # 各画像の結果を処理
-            for j, (img_path, prob) in enumerate(zip(batch_paths, probs)):
-                # タグと確率をペアにする
-                tags_with_scores = [(labels[k], float(prob[k])) for k in range(len(labels)) if prob[k] >= threshold]
-                tags_with_scores.sort(key=lambda x: x[1], reverse=True)
-
-                # ベースネーム取得
-                base_name = os.path.splitext(os.path.basename(img_path))[0]
-
-                # タグをカテゴリ分類するかどうか
-                if categorize:
-                    # カテゴリ分類
-                    categorized_tags = categorize_tags(tags_with_scores)
-
-                    # JSONとして保存
-                    json_path = os.path.join(output_dir, f"{base_name}_categorized.json")
-                    with open(json_path, 'w', encoding='utf-8') as f:
-                        json.dump(categorized_tags, f, ensure_ascii=False, indent=2)
-
-                    # 読みやすいテキスト形式でも保存
-                    txt_path = os.path.join(output_dir, f"{base_name}.txt")
-                    with open(txt_path, 'w', encoding='utf-8') as f:
-                        # まず未分類の全タグを出力
-                        for tag, score in tags_with_scores:
-                            f.write(f"{tag}, {score:.6f}\n")
-
-                        f.write("\n--- カテゴリ別タグ ---\n\n")
-
-                        # カテゴリごとに出力
-                        for main_cat, sub_cats in categorized_tags.items():
-                            if main_cat == "uncategorized":
-                                if categorized_tags["uncategorized"]:
-                                    f.write(f"■ 未分類:\n")
-                                    for tag, score in categorized_tags["uncategorized"]:
-                                        f.write(f"  - {tag}, {score:.6f}\n")
-                                continue
-
-                            if isinstance(sub_cats, dict) and sub_cats:  # サブカテゴリが存在し空でない場合
-                                f.write(f"■ {main_cat}:\n")
-                                for sub_cat, tags in sub_cats.items():
-                                    if tags:
-                                        f.write(f"  ● {sub_cat}:\n")
-                                        for tag, score in tags:
-                                            f.write(f"    - {tag}, {score:.6f}\n")
-                else:
-                    # 通常のテキスト形式で保存
-                    txt_path = os.path.join(output_dir, f"{base_name}.txt")
-                    with open(txt_path, 'w', encoding='utf-8') as f:
-                        for tag, score in tags_with_scores:
-                            f.write(f"{tag}, {score:.6f}\n")
-
-                results.append((img_path, len(tags_with_scores)))
+    if workers and workers > 1:
+        # モデルは各ワーカーでロードし、このプロセスはタグ定義だけを使って結果を書き込む
+        engine = TaggerFarm(model_dir, workers=workers, batch_size=batch_size, threads=threads or 1,
+                            use_gpu=use_gpu, precision=precision, preprocess=preprocess,
+                            cache_optimized=cache_optimized)
+        print(f"ワーカープロセス数: {engine.workers}")
+    else:
+        # ONNXランタイムセッションとタグ定義をロード
+        engine = TaggerEngine(model_dir, batch_size=batch_size, use_gpu=use_gpu, use_processes=decode_processes,
+                              use_cache=use_cache, cache_path=cache_path or os.path.join(output_dir, CACHE_FILENAME),
+                              session_profile=session_profile, threads=threads,
+                              precision=precision, preprocess=preprocess, cache_optimized=cache_optimized)
+        print(f"モデルの入力形状: {engine.input_shape}")
+
+    # 途中で例外が起きてもキャッシュとタグストアを閉じる
+    with engine, contextlib.ExitStack() as stack:
+        labels = engine.labels
+        postprocessor = engine.postprocessor(
+            threshold, {'character': character_threshold, 'rating': rating_threshold}, top_k)
+        print(f"タグ数: {len(labels)}")
+
+        # 画像ファイルの検索
+        image_files = find_images(img_dir)
+
+        if not image_files:
+            print(f"ディレクトリ {img_dir} に画像ファイルが見つかりません")
+            return False
 
-        except Exception as e:
-            print(f"バッチ処理中にエラーが発生しました: {e}")
+        print(f"合計 {len(image_files)} 個の画像ファイルを処理します")
+
+        # 結果をタグストアにまとめる場合
+        writer = None
+        if output_format != 'files':
+            writer = stack.enter_context(TagStoreWriter(os.path.join(output_dir, STORE_FILENAME)))
+            label_ids = writer.intern(labels)
+
+        # バッチ推論（デコードは先読みプールで並行実行、結果は入力順）
+        results = []
+        start_time = time.time()
+
+        for img_path, indices, scores, error in tqdm(engine.tag(image_files, postprocessor),
+                                                     total=len(image_files), desc="バッチ処理中"):
+            if error is not None:
+                print(f"処理中にエラーが発生しました ({img_path}): {error}")
+                continue
+
+            results.append((img_path, len(indices)))
+            if writer is not None:
+                writer.append(img_path, label_ids[indices], scores)
+            if output_format == 'store':
+                continue
+
+            # 書き出し用にタグ名と確率のペアにする
+            tags_with_scores = postprocessor.tags(indices, scores)
+
+            # ベースネーム取得
+            base_name = os.path.splitext(os.path.basename(img_path))[0]
+
+            # タグをカテゴリ分類するかどうか
+            if categorize:
+                # カテゴリ分類
+                categorized_tags = categorize_tags(tags_with_scores)
+
+                # JSONとして保存
+                json_path = os.path.join(output_dir, f"{base_name}_categorized.json")
+                with open(json_path, 'w', encoding='utf-8') as f:
+                    json.dump(categorized_tags, f, ensure_ascii=False, indent=2)
+
+                # 読みやすいテキスト形式でも保存
+                txt_path = os.path.join(output_dir, f"{base_name}.txt")
+                with open(txt_path, 'w', encoding='utf-8') as f:
+                    # まず未分類の全タグを出力
+                    for tag, score in tags_with_scores:
+                        f.write(f"{tag}, {score:.6f}\n")
+
+                    f.write("\n--- カテゴリ別タグ ---\n\n")
+
+                    # カテゴリごとに出力
+                    for main_cat, sub_cats in categorized_tags.items():
+                        if main_cat == "uncategorized":
+                            if categorized_tags["uncategorized"]:
+                                f.write(f"■ 未分類:\n")
+                                for tag, score in categorized_tags["uncategorized"]:
+                                    f.write(f"  - {tag}, {score:.6f}\n")
+                            continue
+
+                        if isinstance(sub_cats, dict) and sub_cats:  # サブカテゴリが存在し空でない場合
+                            f.write(f"■ {main_cat}:\n")
+                            for sub_cat, tags in sub_cats.items():
+                                if tags:
+                                    f.write(f"  ● {sub_cat}:\n")
+                                    for tag, score in tags:
+                                        f.write(f"    - {tag}, {score:.6f}\n")
+            else:
+                # 通常のテキスト形式で保存
+                txt_path = os.path.join(output_dir, f"{base_name}.txt")
+                with open(txt_path, 'w', encoding='utf-8') as f:
+                    for tag, score in tags_with_scores:
+                        f.write(f"{tag}, {score:.6f}\n")
 
     # 処理統計の表示
     elapsed_time = time.time() - start_time
@@ -369,8 +322,28 @@ def main():
     parser.add_argument('--model_dir', default='tagger_data', help='モデルファイルのディレクトリ')
     parser.add_argument('--threshold', type=float, default=0.35, help='タグ検出の閾値')
     parser.add_argument('--categorize', action='store_true', help='タグをカテゴリ分類するかどうか', default=True)
-    parser.add_argument('--batch_size', type=int, default=1, help='バッチサイズ（GPUメモリに注意）')
+    parser.add_argument('--batch_size', type=int, default=8, help='バッチサイズ（GPUメモリに注意）')
     parser.add_argument('--cpu', action='store_true', help='CPUのみを使用する')
+    parser.add_argument('--processes', action='store_true', help='画像のデコードをプロセスプールで並列化する')
+    parser.add_argument('--character_threshold', type=float, help='キャラクタータグの閾値（省略時は --threshold）')
+    parser.add_argument('--rating_threshold', type=float, help='レーティングタグの閾値（省略時は --threshold）')
+    parser.add_argument('--top_k', type=int, help='1画像あたりの最大タグ数')
+    parser.add_argument('--output_format', choices=OUTPUT_FORMATS, default='files',
+                        help='files: 画像ごとのファイル / store: tags.tagstore に集約 / both: 両方')
+    parser.add_argument('--threads', type=int, help='推論スレッド数（複数のタガーを並べて動かす場合に指定）')
+    parser.add_argument('--workers', type=int, help='ワーカープロセス数（2以上でタガーファームとして並列実行）')
+    parser.add_argument('--session_profile', choices=sorted(SESSION_PROFILES), default='default',
+                        help='ONNXセッション設定（worker: 1スレッド・スピン待ちなし）')
+    parser.add_argument('--int8', action='store_true', help='INT8量子化モデル（quantize_model.py で作成）を使う')
+    parser.add_argument('--preprocess', choices=PREPROCESS_MODES, default='pad',
+                        help='pad: 縦横比を保って余白を白で埋める（WDタガーの学習時と同じ） / stretch: 引き伸ばす（従来）')
+    parser.add_argument('--cache_optimized', action='store_true',
+                        help='最適化済みモデルをモデルディレクトリの .onnx_optimized/ に保存し、次回のロードを速くする'
+                             '（モデルとほぼ同じサイズ、EVA02-Large では約1.2GBのファイルが増える）')
+    parser.add_argument('--cache', nargs='?', const='', metavar='PATH',
+                        help='推論結果を画像の内容ハッシュでキャッシュし、再実行時の推論を省く'
+                             '（PATH省略時は出力ディレクトリの .tagging_cache.sqlite）。確率は float16 に丸め、'
+                             '0.01 未満は 0 として保存するため、閾値付近のタグが変わることがある')
     args = parser.parse_args()
 
     # 画像にタグを付ける
@@ -381,7 +354,20 @@ def main():
         args.threshold,
         args.categorize,
         args.batch_size,
-        use_gpu=not args.cpu
+        use_gpu=not args.cpu,
+        decode_processes=args.processes,
+        character_threshold=args.character_threshold,
+        rating_threshold=args.rating_threshold,
+        top_k=args.top_k,
+        use_cache=args.cache is not None,
+        cache_path=args.cache or None,
+        output_format=args.output_format,
+        session_profile=args.session_profile,
+        threads=args.threads,
+        precision='int8' if args.int8 else 'fp32',
+        preprocess=args.preprocess,
+        cache_optimized=args.cache_optimized,
+        workers=args.workers
     )
 
     if success:
@@ -11,7 +11,10 @@ from typing import List, Dict, Set, Tuple, Counter as CounterType, Optional, Any
 import numpy as np
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from tqdm import tqdm
+from tag_reader import exclusion_set, read_tag_names
+from tag_scan import scan_files
+from tag_cooccurrence import TagCooccurrence
+from tag_clustering import CLUSTER_BACKENDS, cluster_tags
 
 # カテゴリ定義
 TAG_CATEGORIES = {
@@ -63,6 +66,7 @@ EXCLUDE_TAGS = [
     "chinese text", "character name", "character profile", "fake screenshot", "stats",
     "pixelated", "mosaic censoring", "censored", "copyright notice"
 ]
+EXCLUDED_TAGS = exclusion_set(EXCLUDE_TAGS)
 
 def parse_arguments():
     """コマンドライン引数のパース"""
@@ -78,6 +82,10 @@ def parse_arguments():
     parser.add_argument('--similarity', '-s', type=float, default=0.5, help='共起性の類似度しきい値')
     parser.add_argument('--min-set-size', '-m', type=int, default=3, help='セットの最小サイズ')
     parser.add_argument('--max-set-size', '-x', type=int, default=10, help='セットの最大サイズ')
+    parser.add_argument('--backend', '-b', choices=['jaccard', *CLUSTER_BACKENDS], default='jaccard',
+                        help='セットの作り方（jaccard: 人気のタグから順に共起相手の類似度で集める、その他: tag_clustering のクラスタリング）')
+    parser.add_argument('--max-sets', type=int, default=10, help='カテゴリごとの共起によるセットの最大数（0で無制限）')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='タグファイルを並列に読み込むプロセス数（0でCPUコア数）')
     return parser.parse_args()
 
 def get_tag_files(input_dir: str) -> List[Path]:
@@ -86,44 +94,8 @@ def get_tag_files(input_dir: str) -> List[Path]:
     return sorted(files)
 
 def read_tags_from_file(file_path: Union[str, Path], threshold: float = 0.6) -> List[str]:
-    """タグファイルからタグを読み取り"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            # コンマ区切りのタグを処理
-            tags = []
-            if ',' in content:
-                for tag in content.split(','):
-                    tag = tag.strip()
-                    if tag and tag.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                        tags.append(tag)
-            # コロン区切りのタグを処理（スコア付き）
-            elif '\n' in content:
-                for line in content.split('\n'):
-                    if ':' in line:
-                        tag, score_str = line.split(':', 1)
-                        tag = tag.strip()
-                        if tag and tag.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                            try:
-                                score = float(score_str.strip())
-                                if score >= threshold:
-                                    tags.append(tag)
-                            except ValueError:
-                                # スコア変換エラーの場合はスキップ
-                                continue
-                    else:
-                        # スコアがない場合は追加
-                        tag = line.strip()
-                        if tag and tag.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                            tags.append(tag)
-            else:
-                # 単一行の場合
-                if content and content.lower() not in [t.lower() for t in EXCLUDE_TAGS]:
-                    tags.append(content)
-            return tags
-    except Exception as e:
-        print(f"ファイル読み込みエラー {file_path}: {e}")
-        return []
+    """タグファイルからしきい値以上のタグを読み取り（スコアのないタグは1.0）"""
+    return read_tag_names(file_path, exclude=EXCLUDED_TAGS, min_score=threshold)
 
 def categorize_tags(tags: List[str]) -> Dict[str, List[str]]:
     """タグをカテゴリ別に分類"""
@@ -201,8 +173,15 @@ def categorize_tags(tags: List[str]) -> Dict[str, List[str]]:
     return {k: v for k, v in categorized.items() if v}
 
 def create_tag_sets(tag_files: List[Path], min_set_size: int = 3, max_set_size: int = 10,
-                    threshold: float = 0.6, similarity_threshold: float = 0.5) -> Dict[str, List[str]]:
-    """タグファイルからカテゴリごとのセットを作成"""
+                    threshold: float = 0.6, similarity_threshold: float = 0.5,
+                    backend: str = 'jaccard', max_sets: int = 10, workers: int = 1) -> Dict[str, List[str]]:
+    """
+    タグファイルからカテゴリごとのセットを作成
+
+    backend が 'jaccard' 以外の場合は tag_clustering のバックエンドでカテゴリのタグを
+    クラスタリングし、まとまりの強い順にセットにする。max_sets は共起によるセットの
+    カテゴリごとの最大数（0 で無制限）。タグファイルは workers 個のプロセスで並列に読み込む。
+    """
     print(f"処理するファイル数: {len(tag_files)}")
 
     # 各ファイルごとの処理結果とカテゴリごとのタグを保持
@@ -220,11 +199,11 @@ def create_tag_sets(tag_files: List[Path], min_set_size: int = 3, max_set_size:
     # ファイルごとのカテゴリ別タグリストを収集
     file_categorized_tags = []
 
-    for file_path in tqdm(tag_files, desc="ファイル処理中"):
-        tags = read_tags_from_file(file_path, threshold)
-        if not tags:
-            continue
+    # しきい値以上のタグのみを残す
+    records, _ = scan_files(tag_files, workers, exclude=EXCLUDED_TAGS, min_score=threshold)
+    confidence = records.tag_counter(weighted=True)
 
+    for tags in records.file_tags():
         categorized = categorize_tags(tags)
         file_categorized_tags.append(categorized)
 
@@ -258,44 +237,47 @@ def create_tag_sets(tag_files: List[Path], min_set_size: int = 3, max_set_size:
             if popular_tags:
                 category_sets.append(", ".join(popular_tags))
         else:
-            # 共起解析のためのデータ準備
-            tag_cooccurrence = defaultdict(set)
-
-            # ファイルごとの共起情報を収集
-            for file_data in file_categorized_tags:
-                if category in file_data and len(file_data[category]) > 1:
-                    file_tags = set(file_data[category])
-                    # 各タグの共起情報を更新
-                    for tag in file_tags:
-                        tag_cooccurrence[tag].update(file_tags - {tag})
+            # カテゴリ内の共起行列（ファイルごとのカテゴリ別タグから作成）
+            category_files = [file_data[category] for file_data in file_categorized_tags if category in file_data]
 
             # 共起性に基づいてセットを生成
             remaining_tags = set(popular_tags)
 
-            while remaining_tags and len(category_sets) < 10:  # 最大10セットまで
-                # 最も人気のあるタグから開始
-                if not remaining_tags:
-                    break
+            if backend != 'jaccard':
+                # まとまりの強い順のタグセット
+                cooccurrence = TagCooccurrence.from_file_tags(category_files, popular_tags)
+                for cluster, _ in cluster_tags(cooccurrence, backend, min_set_size, max_set_size)[:max_sets or None]:
+                    category_sets.append(", ".join(sorted(cluster)))
+                    remaining_tags.difference_update(cluster)
+            else:
+                cooccurrence = TagCooccurrence.from_file_tags(category_files)
+                while remaining_tags and (not max_sets or len(category_sets) < max_sets):
+                    # 最も人気のあるタグから開始
+                    if not remaining_tags:
+                        break
+
+                    # 同じ出現回数なら信頼度で重み付けした出現数の多いタグ
+                    seed_tag = max(remaining_tags, key=lambda t: (counts[t], confidence[t]))
+                    remaining_tags.remove(seed_tag)
 
-                seed_tag = max(remaining_tags, key=lambda t: counts[t])
-                remaining_tags.remove(seed_tag)
+                    current_set = {seed_tag}
+                    current_tags = list(remaining_tags)
 
-                current_set = {seed_tag}
-                current_tags = list(remaining_tags)
+                    # 共起するタグの集合どうしの Jaccard 係数（全タグ分を一度に計算）
+                    neighbor_scores = cooccurrence.neighbor_jaccard(seed_tag)
 
-                # 関連性の高いタグを追加
-                for tag in current_tags:
-                    # タグの共起スコアを計算
-                    cooccur_score = len(tag_cooccurrence[seed_tag].intersection(tag_cooccurrence[tag])) / \
-                                   max(1, len(tag_cooccurrence[seed_tag].union(tag_cooccurrence[tag])))
+                    # 関連性の高いタグを追加
+                    for tag in current_tags:
+                        # タグの共起スコア
+                        cooccur_score = neighbor_scores[cooccurrence.index[tag]]
 
-                    if cooccur_score >= similarity_threshold and len(current_set) < max_set_size:
-                        current_set.add(tag)
-                        remaining_tags.remove(tag)
+                        if cooccur_score >= similarity_threshold and len(current_set) < max_set_size:
+                            current_set.add(tag)
+                            remaining_tags.remove(tag)
 
-                # 最小サイズ以上のセットのみ追加
-                if len(current_set) >= min_set_size:
-                    category_sets.append(", ".join(sorted(current_set)))
+                    # 最小サイズ以上のセットのみ追加
+                    if len(current_set) >= min_set_size:
+                        category_sets.append(", ".join(sorted(current_set)))
 
             # 残りのタグをその他セットとして追加
             if remaining_tags and len(remaining_tags) >= min_set_size:
@@ -340,13 +322,16 @@ def main():
         return
 
     # タグセット作成
-    print(f"タグセットを作成中... 類似度しきい値: {args.similarity}, 最小セットサイズ: {args.min_set_size}")
+    print(f"タグセットを作成中... 方法: {args.backend}, 類似度しきい値: {args.similarity}, 最小セットサイズ: {args.min_set_size}")
     tag_sets = create_tag_sets(
         tag_files,
         min_set_size=args.min_set_size,
         max_set_size=args.max_set_size,
         threshold=args.threshold,
-        similarity_threshold=args.similarity
+        similarity_threshold=args.similarity,
+        backend=args.backend,
+        max_sets=args.max_sets,
+        workers=args.workers
     )
 
     # メインYAML保存
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+タグ付けジョブのマニフェスト（再開用のジャーナル）
+処理が終わった画像・失敗した画像を1件ずつ出力ディレクトリの
+.tagging_job.jsonl に追記する。同じコマンドを再実行すると記録済みの画像を
+飛ばして続きから処理し、retry_failed の場合は失敗した画像だけを処理し直す。
+
+ファイル形式（JSON Lines）:
+    1行目: {"job": {...}}  閾値・モデルなどの設定。設定が変わった場合は記録を破棄して最初から
+    以降 : {"path": ..., "size": ..., "mtime_ns": ..., "status": "done", "outputs": [...]}
+           {"path": ..., "size": ..., "mtime_ns": ..., "status": "error", "error": "..."}
+
+同じ画像の記録が複数ある場合は後の行が有効。画像のサイズか更新時刻が
+変わっていれば未処理として扱う。書き込み途中で終了した末尾の行は
+読み込み時に無視し、次の書き込み時に切り詰める。
+"""
+
+import os
+import json
+
+# 出力ディレクトリ内に作成するマニフェストのファイル名
+MANIFEST_FILENAME = '.tagging_job.jsonl'
+
+DONE = 'done'
+ERROR = 'error'
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_records(path):
+    """
+    マニフェストの記録を読み込む
+
+    Returns:
+        tuple: (ジョブ設定 または None, 画像パス → 最新の記録, 完全な行の終端位置)
+    """
+    job = None
+    records = {}
+    end = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            end += len(line)
+            if 'job' in record:
+                job = record['job']
+            else:
+                records[record['path']] = record
+    return job, records, end
+
+
+class JobManifest:
+    """
+    タグ付けジョブの進捗記録
+
+    使い方:
+        with JobManifest(output_dir, job={'threshold': 0.35}) as manifest:
+            for img_path in manifest.pending(image_files):
+                ...
+                manifest.mark_done(img_path, [txt_path])   # 失敗時は manifest.mark_failed(img_path, e)
+    """
+
+    def __init__(self, output_dir, job=None, restart=False):
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.job = job or {}
+        self.records = {}
+
+        if os.path.exists(self.path) and not restart:
+            job, records, end = _read_records(self.path)
+            if job == self.job:
+                self.records = records
+                with open(self.path, 'r+b') as f:
+                    f.truncate(end)
+                self.file = open(self.path, 'a', encoding='utf-8')
+                return
+            print(f"ジョブの設定が前回と異なるため、最初から処理します: {self.path}")
+
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self._write({'job': self.job})
+
+    def _write(self, record):
+        # 1行ずつ書き出す（異常終了しても書き込み済みの行は残る）
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def status(self, image_path):
+        """画像の状態（DONE / ERROR / 未処理なら None）"""
+        record = self.records.get(image_path)
+        if record is None:
+            return None
+        try:
+            if (record['size'], record['mtime_ns']) != _stat_key(image_path):
+                return None
+        except OSError:
+            pass
+        return record['status']
+
+    def pending(self, image_files, retry_failed=False):
+        """
+        処理が必要な画像のリスト
+
+        通常は未記録の画像（前回の続き）、retry_failed の場合は前回失敗した画像のみ。
+        """
+        if retry_failed:
+            # 失敗後に画像を差し替えた場合も再処理の対象にする
+            return [path for path in image_files
+                    if path in self.records and self.records[path]['status'] == ERROR]
+        return [path for path in image_files if self.status(path) is None]
+
+    def failed(self):
+        """失敗として記録されている画像パスとエラーメッセージ"""
+        return {path: record['error'] for path, record in self.records.items() if record['status'] == ERROR}
+
+    def _mark(self, image_path, status, **fields):
+        try:
+            size, mtime_ns = _stat_key(image_path)
+        except OSError:
+            size, mtime_ns = None, None
+        record = {'path': image_path, 'size': size, 'mtime_ns': mtime_ns, 'status': status, **fields}
+        self.records[image_path] = record
+        self._write(record)
+
+    def mark_done(self, image_path, outputs):
+        """処理済みとして記録（outputs は出力先のパスのリスト）"""
+        self._mark(image_path, DONE, outputs=list(outputs))
+
+    def mark_failed(self, image_path, error):
+        """失敗として記録"""
+        self._mark(image_path, ERROR, error=f"{type(error).__name__}: {error}")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ONNXランタイムのセッション作成
+タガー共通のセッション設定（スレッド数・実行モード）、最適化済みモデルの
+保存と再利用、プロセス内でのセッション使い回しをまとめる。
+
+cache_optimized=True の場合、最適化済みモデルをモデルと同じディレクトリの
+.onnx_optimized/ に保存する。2回目以降はグラフ最適化を省略して読み込むため、大きなモデルの
+ロードが速くなるが、モデルとほぼ同じサイズ（EVA02-Large では約1.2GB）のファイルが
+モデル・実行プロバイダの組ごとに1つ増えるため、既定では保存しない。
+"""
+
+import os
+import re
+import time
+import hashlib
+import onnxruntime as ort
+
+# 最適化済みモデルを保存するサブディレクトリ名
+OPTIMIZED_DIRNAME = '.onnx_optimized'
+
+# セッション設定のプロファイル
+#   default : ORTの既定（全コアを1つの推論で使う）
+#   parallel: 分岐のあるグラフでノードを並列実行
+#   worker  : 複数のタガーを並べて動かす場合。1スレッドでスピン待ちもしない
+SESSION_PROFILES = {
+    'default': {},
+    'parallel': {'execution_mode': 'parallel'},
+    'worker': {'intra_op_threads': 1, 'inter_op_threads': 1, 'allow_spinning': False},
+}
+
+EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL,
+}
+
+# プロセス内で作成済みのセッション（キー → InferenceSession）
+_sessions = {}
+
+
+def session_settings(profile='default', **overrides):
+    """
+    プロファイルに個別指定を上書きした設定を返す（None の指定は無視）
+
+    Returns:
+        dict: intra_op_threads, inter_op_threads, execution_mode, allow_spinning
+    """
+    if profile not in SESSION_PROFILES:
+        raise ValueError(f"不明なセッションプロファイル: {profile}（{', '.join(SESSION_PROFILES)}）")
+    settings = {'intra_op_threads': 0, 'inter_op_threads': 0,
+                'execution_mode': 'sequential', 'allow_spinning': True}
+    settings.update(SESSION_PROFILES[profile])
+    unknown = set(overrides) - set(settings)
+    if unknown:
+        raise ValueError(f"不明なセッション設定: {', '.join(sorted(unknown))}")
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    return settings
+
+
+def _session_options(settings, optimization_level):
+    options = ort.SessionOptions()
+    options.enable_mem_pattern = True
+    options.graph_optimization_level = optimization_level
+    options.intra_op_num_threads = settings['intra_op_threads']
+    options.inter_op_num_threads = settings['inter_op_threads']
+    options.execution_mode = EXECUTION_MODES[settings['execution_mode']]
+    if not settings['allow_spinning']:
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        options.add_session_config_entry('session.inter_op.allow_spinning', '0')
+    return options
+
+
+def _provider_tag(providers):
+    """実行プロバイダの組をファイル名用の文字列にする（例: cuda-cpu）"""
+    return '-'.join(provider.replace('ExecutionProvider', '').lower() for provider in providers)
+
+
+def _optimized_name_pattern(model_path, providers):
+    """同じモデル・実行プロバイダの最適化済みモデルのファイル名（キーの部分は問わない）"""
+    base_name = os.path.splitext(os.path.basename(model_path))[0]
+    return re.compile(rf'^{re.escape(base_name)}\.{re.escape(_provider_tag(providers))}\.[0-9a-f]{{16}}\.onnx$')
+
+
+def optimized_model_path(model_path, providers):
+    """
+    最適化済みモデルの保存先（{モデル名}.{実行プロバイダ}.{キー}.onnx）
+
+    キーはモデルのパス・更新時刻・サイズ、ORTのバージョン、実行プロバイダから作る
+    （最適化結果はプロバイダに依存するため）。ファイルはモデル・実行プロバイダの組ごとに1つで、
+    キーが変わったときはその組の古いファイルだけを置き換える。
+    """
+    model_path = os.path.abspath(model_path)
+    stat = os.stat(model_path)
+    key_source = ':'.join([model_path, str(stat.st_mtime_ns), str(stat.st_size),
+                           ort.__version__, ','.join(providers)])
+    key = hashlib.sha1(key_source.encode('utf-8')).hexdigest()[:16]
+    base_name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(os.path.dirname(model_path), OPTIMIZED_DIRNAME,
+                        f"{base_name}.{_provider_tag(providers)}.{key}.onnx")
+
+
+def _create(model_path, providers, settings, cache_optimized):
+    """セッションを作成（可能なら最適化済みモデルを保存・再利用）"""
+    level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if not cache_optimized:
+        return ort.InferenceSession(model_path, sess_options=_session_options(settings, level),
+                                    providers=providers)
+
+    optimized_path = optimized_model_path(model_path, providers)
+    if os.path.exists(optimized_path):
+        try:
+            # 最適化済みなのでグラフ最適化は行わない
+            return ort.InferenceSession(
+                optimized_path,
+                sess_options=_session_options(settings, ort.GraphOptimizationLevel.ORT_DISABLE_ALL),
+                providers=providers)
+        except Exception as e:
+            print(f"最適化済みモデルを読み込めません（元のモデルから作り直します）: {e}")
+
+    options = _session_options(settings, level)
+    try:
+        os.makedirs(os.path.dirname(optimized_path), exist_ok=True)
+        # 同じモデル・実行プロバイダの古い最適化結果だけを削除（別のモデルやプロバイダの分は残す）
+        optimized_dir = os.path.dirname(optimized_path)
+        pattern = _optimized_name_pattern(model_path, providers)
+        for name in os.listdir(optimized_dir):
+            if pattern.match(name) and name != os.path.basename(optimized_path):
+                os.remove(os.path.join(optimized_dir, name))
+        options.optimized_model_filepath = optimized_path
+        return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    except OSError as e:
+        # 読み取り専用のディレクトリなどでは保存せずに作成
+        print(f"最適化済みモデルを保存できません（保存せずに続行）: {e}")
+        return ort.InferenceSession(model_path, sess_options=_session_options(settings, level),
+                                    providers=providers)
+
+
+def create_session(model_path, use_gpu=False, profile='default', cache_optimized=False, **overrides):
+    """
+    ONNXランタイムセッションを作成
+
+    use_gpu=True の場合はCUDAを優先し、失敗したらCPUで作り直す。
+
+    Args:
+        model_path (str): ONNXモデルのパス
+        use_gpu (bool): CUDAを優先して使う
+        profile (str): SESSION_PROFILES のキー
+        cache_optimized (bool): 最適化済みモデルを .onnx_optimized/ に保存し、次回以降再利用する
+        **overrides: intra_op_threads / inter_op_threads / execution_mode / allow_spinning
+    """
+    settings = session_settings(profile, **overrides)
+    providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
+
+    start_time = time.time()
+    try:
+        session = _create(model_path, providers, settings, cache_optimized)
+    except Exception as e:
+        if not use_gpu:
+            raise
+        print(f"モデルのロード中にエラーが発生しました。CPUモードで再試行します: {e}")
+        session = _create(model_path, ['CPUExecutionProvider'], settings, cache_optimized)
+    print(f"モデルのロード時間: {time.time() - start_time:.2f}秒")
+    return session
+
+
+def get_session(model_path, use_gpu=False, profile='default', cache_optimized=False, **overrides):
+    """
+    プロセス内で共有するセッションを取得（同じモデル・設定なら作成済みのものを返す）
+
+    引数は create_session と同じ。GUIや常駐ワーカーのように1プロセスで
+    何度もタグ付けする場合に、モデルのロードを1回で済ませる。
+    """
+    settings = session_settings(profile, **overrides)
+    model_path = os.path.abspath(model_path)
+    stat = os.stat(model_path)
+    key = (model_path, stat.st_mtime_ns, stat.st_size, use_gpu, cache_optimized,
+           tuple(sorted(settings.items())))
+
+    session = _sessions.get(key)
+    if session is None:
+        session = _sessions[key] = create_session(model_path, use_gpu, profile, cache_optimized, **overrides)
+    return session
+
+
+def clear_sessions():
+    """共有セッションを破棄"""
+    _sessions.clear()
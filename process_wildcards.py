@@ -9,6 +9,8 @@ from collections import defaultdict, Counter
 import shutil
 import datetime
 from typing import List, Dict, Set, Tuple, Counter as CounterType, Optional, Any, Union
+from tag_reader import read_scored_tags
+from tag_scan import count_tags
 
 # カテゴリ定義
 TAG_CATEGORIES = {
@@ -67,63 +69,21 @@ def get_tag_files(input_dir: str, max_files: int = 100) -> List[Path]:
     return sorted(files)[:max_files]  # 最大ファイル数まで
 
 def read_tags_from_file(file_path: Union[str, Path]) -> List[Tuple[str, float]]:
-    """タグファイルからタグを読み取り"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            # コンマ区切りのタグを処理
-            tags: List[Tuple[str, float]] = []
-            if ',' in content:
-                for tag in content.split(','):
-                    tag = tag.strip()
-                    if tag:
-                        tags.append((tag, 1.0))  # デフォルトスコア1.0
-            # コロン区切りのタグを処理（スコア付き）
-            elif '\n' in content:
-                for line in content.split('\n'):
-                    if ':' in line:
-                        tag, score_str = line.split(':', 1)
-                        try:
-                            score = float(score_str.strip())
-                            tags.append((tag.strip(), score))
-                        except ValueError:
-                            # スコア変換エラーの場合はスキップ
-                            continue
-                    else:
-                        # スコアがない場合はデフォルトスコア1.0を使用
-                        tag = line.strip()
-                        if tag:
-                            tags.append((tag, 1.0))
-            else:
-                # 単一行の場合
-                if content:
-                    tags.append((content, 1.0))
-
-            return tags
-    except Exception as e:
-        print(f"ファイル読み込みエラー {file_path}: {e}")
-        return []
+    """タグファイルからタグをスコア付きで読み取り（スコアのないタグは1.0）"""
+    return read_scored_tags(file_path)
 
-def analyze_files(tag_files: List[Union[str, Path]], threshold: float = 0.6) -> Tuple[CounterType[str], int]:
-    """タグファイルを分析してタグの出現頻度をカウント"""
-    all_tags: CounterType[str] = Counter()
-    file_count = 0
+def analyze_files(tag_files: List[Union[str, Path]], threshold: float = 0.6,
+                  workers: int = 1) -> Tuple[CounterType[str], int]:
+    """
+    タグファイルを（workers 個のプロセスで並列に）分析してタグの出現頻度をカウント
 
+    タグはしきい値以上のものを出現回数で数え（1ファイル内の重複も数える）、
+    ファイル数はしきい値に関係なくタグが1つ以上あるファイルを数える。
+    """
     print(f"処理するファイル数: {len(tag_files)}")
 
-    for file_path in tag_files:
-        tags_with_scores = read_tags_from_file(file_path)
-        if not tags_with_scores:
-            continue
-
-        # しきい値以上のタグのみを追加
-        for tag, score in tags_with_scores:
-            if score >= threshold:
-                all_tags[tag.strip()] += 1
-
-        file_count += 1
-        if file_count % 10 == 0:
-            print(f"{file_count} ファイル処理済み...")
+    # しきい値以上のタグのみを追加
+    all_tags, file_count = count_tags(tag_files, workers, min_score=threshold)
 
     print(f"合計 {file_count} ファイル処理完了")
     print(f"一意なタグ数: {len(all_tags)}")
@@ -288,6 +248,7 @@ def main() -> None:
     parser.add_argument('--output', '-o', type=str, default=default_output, help='出力YAMLファイル')
 
     parser.add_argument('--threshold', '-t', type=float, default=0.6, help='タグを含めるしきい値')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='タグファイルを並列に読み込むプロセス数（0でCPUコア数）')
     args = parser.parse_args()
 
     print(f"=== 外部ディレクトリからタグファイルをコピーしてワイルドカードYAML生成 ===")
@@ -307,7 +268,7 @@ def main() -> None:
 
     # タグ分析
     print("タグを分析中...")
-    all_tags, file_count = analyze_files(copied_files, args.threshold)
+    all_tags, file_count = analyze_files(copied_files, args.threshold, args.workers)
 
     # YAML構造作成
     print("ワイルドカードYAML構造を作成中...")
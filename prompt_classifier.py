@@ -7,15 +7,133 @@ txtファイルからプロンプトを読み込み、カテゴリ別に分類
 """
 
 import re
+import hashlib
+from functools import lru_cache
+from types import MappingProxyType
 from keyword_database import CATEGORY_KEYWORDS
 
+# 正規化テーブル（アンダースコア→空白）
+NORMALIZE_TABLE = str.maketrans({'_': ' '})
+
+# エスケープ括弧 → 通常の括弧
+ESCAPED_PARENS = (('\\(', '('), ('\\)', ')'))
+
+# 強調・重み構文の括弧ペア: (tag), [tag], {tag}
+EMPHASIS_BRACKETS = {'(': ')', '[': ']', '{': '}'}
+
+# 末尾の重み指定 (tag:1.2) の ":1.2" 部分
+WEIGHT_PATTERN = re.compile(r':\s*-?\d*\.?\d+$')
+
+
+def _strip_emphasis(tag):
+    """外側の強調括弧と重み指定を取り除く（エスケープされた括弧は残す）"""
+    while len(tag) >= 2:
+        closing = EMPHASIS_BRACKETS.get(tag[0])
+        if closing is None or tag[-1] != closing or tag[-2] == '\\':
+            break
+        tag = WEIGHT_PATTERN.sub('', tag[1:-1]).strip()
+    return tag
+
+
+@lru_cache(maxsize=65536)
+def canonical_tag(tag):
+    """
+    タグを正規形に変換
+
+    例: "Blue_Eyes" / "blue eyes" / "(blue eyes:1.2)" → "blue eyes"
+        "bat \\(animal\\)" → "bat (animal)"
+
+    Args:
+        tag (str): プロンプトタグ
+
+    Returns:
+        str: 正規化済みタグ（小文字・空白区切り・重み/強調なし）
+    """
+    normalized = _strip_emphasis(tag.strip().lower())
+    for escaped, plain in ESCAPED_PARENS:
+        normalized = normalized.replace(escaped, plain)
+    return ' '.join(normalized.translate(NORMALIZE_TABLE).split())
+
+
+def build_tag_index(category_keywords):
+    """
+    キーワード辞書から「正規形タグ → カテゴリ」の索引を構築
+
+    同じ正規形が複数カテゴリにある場合は、元から正規形で書かれたキーワード
+    （例: 'against wall'）を優先し、その中ではカテゴリ定義順で先勝ち。
+
+    Args:
+        category_keywords (dict): カテゴリ名 → キーワードset
+
+    Returns:
+        MappingProxyType: 読み取り専用の索引
+    """
+    index = {}
+    variants = []
+    for category, keywords in category_keywords.items():
+        for keyword in keywords:
+            canonical = canonical_tag(keyword)
+            if canonical == keyword:
+                index.setdefault(canonical, category)
+            else:
+                variants.append((canonical, category))
+
+    for canonical, category in variants:
+        index.setdefault(canonical, category)
+
+    return MappingProxyType(index)
+
+
+# カテゴリ名（タプル内の位置がカテゴリID）
+CATEGORIES = ('characterface', 'clothing', 'poseemotion',
+              'backgrounds', 'characterbody', 'uncategorized')
+CATEGORY_IDS = MappingProxyType({name: i for i, name in enumerate(CATEGORIES)})
+UNCATEGORIZED_ID = CATEGORY_IDS['uncategorized']
+
+# モジュール読み込み時に一度だけ構築
+TAG_INDEX = build_tag_index(CATEGORY_KEYWORDS)
+CATEGORY_ID_INDEX = MappingProxyType(
+    {tag: CATEGORY_IDS[category] for tag, category in TAG_INDEX.items()}
+)
+
+# キーワード辞書（と正規化規則）のハッシュ。辞書が変わればキャッシュを無効化するのに使う
+KEYWORD_DATABASE_HASH = hashlib.sha256(
+    '\n'.join(f'{tag}\t{category}' for tag, category in sorted(TAG_INDEX.items())).encode('utf-8')
+).hexdigest()
+
+# classify_files_for_yaml() でファイルの途中でも進捗callbackを呼ぶ間隔（行数）
+LINE_PROGRESS_INTERVAL = 10000
+
+
+def iter_file_lines(file_paths, progress_callback=None):
+    """
+    複数txtファイルの行を順に1行ずつ返す（readlines()で全体を読み込まない）
+
+    Args:
+        file_paths (list): 入力txtファイルのパス
+        progress_callback (callable): 1ファイル読み終えるごとに
+            callback(index, total, file_path) を呼ぶ
+
+    Yields:
+        str: 各行
+    """
+    total = len(file_paths)
+    for index, file_path in enumerate(file_paths, 1):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            yield from f
+
+        if progress_callback is not None:
+            progress_callback(index, total, file_path)
+
+
 class PromptClassifier:
     def __init__(self):
         self.category_keywords = CATEGORY_KEYWORDS
+        self.tag_index = TAG_INDEX
 
     def normalize_tag(self, tag):
-        """タグを正規化（小文字化、前後の空白除去）"""
-        return tag.strip().lower()
+        """タグを正規化（小文字化、アンダースコア・重み・エスケープ括弧の除去）"""
+        return canonical_tag(tag)
 
     def classify_tag(self, tag):
         """
@@ -27,15 +145,62 @@ class PromptClassifier:
         Returns:
             str: カテゴリ名（characterface, clothing, poseemotion, backgrounds, characterbody, uncategorized）
         """
-        normalized_tag = self.normalize_tag(tag)
+        # 正規形で索引を1回引くだけ（マッチしない場合はuncategorized）
+        return self.tag_index.get(canonical_tag(tag), 'uncategorized')
+
+    def classify_tag_id(self, tag):
+        """
+        単一タグを分類（カテゴリID版）
+
+        Args:
+            tag (str): プロンプトタグ
+
+        Returns:
+            int: カテゴリID（CATEGORIES のインデックス）
+        """
+        return CATEGORY_ID_INDEX.get(canonical_tag(tag), UNCATEGORIZED_ID)
+
+    def classify_stream(self, lines):
+        """
+        プロンプト行のイテラブルを遅延分類（空行はスキップ）
+
+        ファイルオブジェクトやジェネレータをそのまま渡せるため、
+        巨大なファイルでもメモリ使用量は1行分で一定。
+
+        Args:
+            lines (iterable): プロンプト行（str）のイテラブル
+
+        Yields:
+            tuple: カテゴリIDをインデックスとするタグリストのタプル
+                例: (['long hair'], [], ['smile'], [], [], [])
+        """
+        classify_tag_id = self.classify_tag_id
+        category_count = len(CATEGORIES)
 
-        # 各カテゴリのキーワードとマッチング
-        for category, keywords in self.category_keywords.items():
-            if normalized_tag in keywords:
-                return category
+        for line in lines:
+            if not line.strip():
+                continue
 
-        # マッチしない場合はuncategorized
-        return 'uncategorized'
+            classified = tuple([] for _ in range(category_count))
+            for tag in line.split(','):
+                tag = tag.strip()
+                if tag:
+                    classified[classify_tag_id(tag)].append(tag)
+
+            yield classified
+
+    def classify_many(self, lines):
+        """
+        複数行を遅延分類（classify_prompt() と同じdict形式で返す）
+
+        Args:
+            lines (iterable): プロンプト行（str）のイテラブル
+
+        Yields:
+            dict: カテゴリ名 → タグリスト
+        """
+        for classified in self.classify_stream(lines):
+            yield dict(zip(CATEGORIES, classified))
 
     def classify_prompt(self, prompt_line):
         """
@@ -56,25 +221,11 @@ class PromptClassifier:
                     'uncategorized': []
                 }
         """
-        # 初期化
-        classified = {
-            'characterface': [],
-            'clothing': [],
-            'poseemotion': [],
-            'backgrounds': [],
-            'characterbody': [],
-            'uncategorized': []
-        }
-
-        # タグ分割
-        tags = [tag.strip() for tag in prompt_line.split(',') if tag.strip()]
-
-        # 各タグを分類
-        for tag in tags:
-            category = self.classify_tag(tag)
-            classified[category].append(tag)
+        for classified in self.classify_many([prompt_line]):
+            return classified
 
-        return classified
+        # 空行
+        return {category: [] for category in CATEGORIES}
 
     def classify_file(self, file_path):
         """
@@ -92,33 +243,14 @@ class PromptClassifier:
                 }
         """
         # 初期化（setで重複除去）
-        aggregated = {
-            'characterface': set(),
-            'clothing': set(),
-            'poseemotion': set(),
-            'backgrounds': set(),
-            'characterbody': set(),
-            'uncategorized': set()
-        }
-
-        # ファイル読み込み
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        aggregated = tuple(set() for _ in CATEGORIES)
 
-        # 各行を処理
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-
-            # 1行を分類
-            classified = self.classify_prompt(line)
+        # 1行ずつ読みながら分類・集約
+        for classified in self.classify_stream(iter_file_lines([file_path])):
+            for category_id, tags in enumerate(classified):
+                aggregated[category_id].update(tags)
 
-            # 集約（重複除去）
-            for category, tags in classified.items():
-                aggregated[category].update(tags)
-
-        return aggregated
+        return dict(zip(CATEGORIES, aggregated))
 
     def classify_file_for_yaml(self, file_path):
         """
@@ -135,36 +267,48 @@ class PromptClassifier:
                     ...
                 }
         """
-        # 初期化
-        categorized_lines = {
-            'characterface': [],
-            'clothing': [],
-            'poseemotion': [],
-            'backgrounds': [],
-            'characterbody': [],
-            'uncategorized': []
-        }
-
-        # ファイル読み込み
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        categorized_lines, _ = self.classify_files_for_yaml([file_path])
+        return categorized_lines
 
-        # 各行を処理
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+    def classify_files_for_yaml(self, file_paths, progress_callback=None):
+        """
+        複数txtファイルをまとめて分類（YAML形式用：行ごとにグループ化）
 
-            # 1行を分類
-            classified = self.classify_prompt(line)
+        Args:
+            file_paths (list): 入力txtファイルのパスリスト
+            progress_callback (callable): 1ファイル処理するごとに
+                callback(index, total, file_path) を呼ぶ。巨大なファイルでもキャンセル・
+                進捗表示が止まらないよう、ファイルの途中でも LINE_PROGRESS_INTERVAL 行ごとに
+                callback(処理済みファイル数, total, 処理中のfile_path, 処理済み行数) を呼ぶ
 
+        Returns:
+            tuple: (categorized_lines, total_lines)
+                categorized_lines: classify_file_for_yaml() と同じ形式のdict
+                total_lines: 処理した行数（空行を除く）
+        """
+        categorized_lines = tuple([] for _ in CATEGORIES)
+        total_lines = 0
+
+        # 読み終えたファイル数と処理中のファイル（行ごとの進捗callback用）
+        position = [0, file_paths[0] if file_paths else '']
+
+        def file_done(index, total, file_path):
+            position[0] = index
+            if index < total:
+                position[1] = file_paths[index]
+            progress_callback(index, total, file_path)
+
+        lines = iter_file_lines(file_paths, file_done if progress_callback is not None else None)
+        for classified in self.classify_stream(lines):
+            total_lines += 1
+            if progress_callback is not None and total_lines % LINE_PROGRESS_INTERVAL == 0:
+                progress_callback(position[0], len(file_paths), position[1], total_lines)
             # 各カテゴリについて、タグをカンマ区切り文字列として追加
-            for category, tags in classified.items():
+            for category_id, tags in enumerate(classified):
                 if tags:  # タグが存在する場合のみ
-                    tag_string = ', '.join(tags)
-                    categorized_lines[category].append(tag_string)
+                    categorized_lines[category_id].append(', '.join(tags))
 
-        return categorized_lines
+        return dict(zip(CATEGORIES, categorized_lines)), total_lines
 
     def to_yaml_dict(self, aggregated):
         """
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+EVA02モデルのINT8動的量子化と精度評価
+
+使い方:
+    # tagger_data/model.onnx から tagger_data/model.int8.onnx を作成
+    python quantize_model.py quantize --model_dir tagger_data
+
+    # サンプル画像で fp32 と int8 の出力を比較（fp32 の結果を正解とみなす）
+    python quantize_model.py evaluate --model_dir tagger_data --dir sample_images --report int8_report.yaml
+
+量子化したモデルはタガーの --int8 で使用できる。
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import yaml
+from tagger_engine import MODEL_FILENAMES, TaggerEngine, find_images
+
+# 量子化する演算（EVA02の計算量の大半を占めるAttention/MLPの行列積）
+QUANTIZE_OP_TYPES = ['MatMul', 'Gemm']
+
+
+def quantize_model(model_dir, per_channel=False, external_data=False):
+    """
+    model.onnx を動的量子化して model.int8.onnx を作成
+
+    重みはINT8で保存し、活性値は推論時に量子化する（キャリブレーション不要）。
+
+    Returns:
+        str: 作成したモデルのパス
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    model_path = os.path.join(model_dir, MODEL_FILENAMES['fp32'])
+    output_path = os.path.join(model_dir, MODEL_FILENAMES['int8'])
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"モデルがありません: {model_path}（download_eva02.py でダウンロードしてください）")
+
+    print(f"量子化中... {model_path} → {output_path}")
+    start_time = time.time()
+    quantize_dynamic(model_path, output_path,
+                     op_types_to_quantize=QUANTIZE_OP_TYPES,
+                     per_channel=per_channel,
+                     weight_type=QuantType.QInt8,
+                     use_external_data_format=external_data)
+
+    fp32_size = os.path.getsize(model_path) / (1024 * 1024)
+    int8_size = os.path.getsize(output_path) / (1024 * 1024)
+    print(f"完了 ({time.time() - start_time:.1f}秒): {fp32_size:.1f}MB → {int8_size:.1f}MB")
+    return output_path
+
+
+def collect_probs(engine, image_files):
+    """
+    全画像の確率を (画像数, タグ数) の配列にまとめる
+
+    Returns:
+        tuple: (確率配列, 成功した画像のパスのリスト, 秒数)
+    """
+    rows = []
+    paths = []
+    start_time = time.time()
+    for img_path, probs, error in engine.run(image_files):
+        if error is not None:
+            print(f"エラー ({img_path}): {error}")
+            continue
+        rows.append(probs)
+        paths.append(img_path)
+    elapsed = time.time() - start_time
+    probs = np.stack(rows) if rows else np.zeros((0, len(engine.labels)), dtype=np.float32)
+    return probs, paths, elapsed
+
+
+def compare_outputs(reference, candidate, thresholds):
+    """
+    基準（fp32）の閾値判定を正解として、候補（int8）のタグごとの適合率・再現率を計算
+
+    Args:
+        reference (np.ndarray): (画像数, タグ数) の基準の確率
+        candidate (np.ndarray): 同じ形の比較対象の確率
+        thresholds (np.ndarray): タグごとの閾値
+
+    Returns:
+        dict: タグごとの配列 tp / fp / fn / precision / recall / f1 と、
+              全体の micro_precision / micro_recall / micro_f1 / mean_abs_diff / max_abs_diff
+    """
+    expected = reference >= thresholds
+    predicted = candidate >= thresholds
+
+    tp = np.count_nonzero(expected & predicted, axis=0)
+    fp = np.count_nonzero(~expected & predicted, axis=0)
+    fn = np.count_nonzero(expected & ~predicted, axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 該当なし（0/0）は誤りもないので 1.0 とする
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 1.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    total_tp, total_fp, total_fn = int(tp.sum()), int(fp.sum()), int(fn.sum())
+    micro_precision = total_tp / (total_tp + total_fp) if total_tp + total_fp else 1.0
+    micro_recall = total_tp / (total_tp + total_fn) if total_tp + total_fn else 1.0
+    micro_f1 = (2 * micro_precision * micro_recall / (micro_precision + micro_recall)
+                if micro_precision + micro_recall else 0.0)
+    diff = np.abs(reference - candidate)
+
+    return {
+        'tp': tp, 'fp': fp, 'fn': fn,
+        'precision': precision, 'recall': recall, 'f1': f1,
+        'micro_precision': micro_precision,
+        'micro_recall': micro_recall,
+        'micro_f1': micro_f1,
+        'mean_abs_diff': float(diff.mean()) if diff.size else 0.0,
+        'max_abs_diff': float(diff.max()) if diff.size else 0.0,
+    }
+
+
+def evaluate(model_dir, img_dir, threshold=0.35, batch_size=8, limit=None, worst=30, min_support=2):
+    """
+    fp32 と int8 のモデルで同じ画像をタグ付けし、速度と精度を比較
+
+    Returns:
+        dict: レポート（YAMLにそのまま保存できる形式）
+    """
+    image_files = find_images(img_dir)
+    if limit:
+        image_files = image_files[:limit]
+    if not image_files:
+        raise FileNotFoundError(f"ディレクトリ {img_dir} に画像ファイルが見つかりません")
+
+    results = {}
+    for precision in ('fp32', 'int8'):
+        engine = TaggerEngine(model_dir, batch_size=batch_size, precision=precision)
+        # 速度比較のため、1バッチ目のウォームアップを計測から除く
+        list(engine.run(image_files[:batch_size]))
+        probs, paths, elapsed = collect_probs(engine, image_files)
+        results[precision] = (engine, probs, paths, elapsed)
+
+    engine, reference, ref_paths, fp32_time = results['fp32']
+    _, candidate, int8_paths, int8_time = results['int8']
+    if ref_paths != int8_paths:
+        # 片方だけ失敗した画像は比較から除く
+        common = sorted(set(ref_paths) & set(int8_paths))
+        ref_rows = {path: i for i, path in enumerate(ref_paths)}
+        int8_rows = {path: i for i, path in enumerate(int8_paths)}
+        reference = reference[[ref_rows[path] for path in common]]
+        candidate = candidate[[int8_rows[path] for path in common]]
+        ref_paths = common
+
+    thresholds = engine.postprocessor(threshold).thresholds
+    metrics = compare_outputs(reference, candidate, thresholds)
+
+    support = metrics['tp'] + metrics['fn']
+    ranked = [i for i in np.argsort(metrics['f1'], kind='stable') if support[i] >= min_support]
+    worst_tags = [
+        {
+            'tag': engine.labels[i],
+            'support': int(support[i]),
+            'precision': round(float(metrics['precision'][i]), 4),
+            'recall': round(float(metrics['recall'][i]), 4),
+            'f1': round(float(metrics['f1'][i]), 4),
+        }
+        for i in ranked[:worst] if metrics['f1'][i] < 1.0
+    ]
+
+    count = len(ref_paths)
+    return {
+        'images': count,
+        'threshold': threshold,
+        'fp32_images_per_second': round(count / fp32_time, 2) if fp32_time else None,
+        'int8_images_per_second': round(count / int8_time, 2) if int8_time else None,
+        'speedup': round(fp32_time / int8_time, 2) if int8_time else None,
+        'micro_precision': round(metrics['micro_precision'], 4),
+        'micro_recall': round(metrics['micro_recall'], 4),
+        'micro_f1': round(metrics['micro_f1'], 4),
+        'mean_abs_prob_diff': round(metrics['mean_abs_diff'], 6),
+        'max_abs_prob_diff': round(metrics['max_abs_diff'], 6),
+        'worst_tags': worst_tags,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EVA02モデルのINT8動的量子化と精度評価')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    quantize_parser = subparsers.add_parser('quantize', help='model.int8.onnx を作成')
+    quantize_parser.add_argument('--model_dir', default='tagger_data', help='モデルディレクトリ')
+    quantize_parser.add_argument('--per_channel', action='store_true', help='チャネルごとに量子化（精度向上、サイズ微増）')
+    quantize_parser.add_argument('--external_data', action='store_true', help='重みを外部ファイルに保存（2GB超のモデル用）')
+
+    evaluate_parser = subparsers.add_parser('evaluate', help='fp32 と int8 の出力を比較')
+    evaluate_parser.add_argument('--model_dir', default='tagger_data', help='モデルディレクトリ')
+    evaluate_parser.add_argument('--dir', required=True, help='サンプル画像ディレクトリ')
+    evaluate_parser.add_argument('--threshold', type=float, default=0.35, help='タグの閾値')
+    evaluate_parser.add_argument('--batch_size', type=int, default=8, help='1回の推論にまとめる画像数')
+    evaluate_parser.add_argument('--limit', type=int, help='評価に使う画像数の上限')
+    evaluate_parser.add_argument('--report', help='レポートを保存するYAMLファイル')
+    args = parser.parse_args()
+
+    if args.command == 'quantize':
+        quantize_model(args.model_dir, args.per_channel, args.external_data)
+        return 0
+
+    report = evaluate(args.model_dir, args.dir, args.threshold, args.batch_size, args.limit)
+
+    print("\n=== fp32 / int8 比較 ===")
+    print(f"画像数: {report['images']}")
+    print(f"速度: fp32 {report['fp32_images_per_second']}画像/秒, "
+          f"int8 {report['int8_images_per_second']}画像/秒 (x{report['speedup']})")
+    print(f"適合率: {report['micro_precision']:.4f}  再現率: {report['micro_recall']:.4f}  "
+          f"F1: {report['micro_f1']:.4f}")
+    print(f"確率の差: 平均 {report['mean_abs_prob_diff']:.6f}, 最大 {report['max_abs_prob_diff']:.6f}")
+    if report['worst_tags']:
+        print("\nF1の低いタグ:")
+        for item in report['worst_tags'][:10]:
+            print(f"  {item['tag']}: 適合率 {item['precision']:.3f}, 再現率 {item['recall']:.3f} "
+                  f"(出現 {item['support']})")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            yaml.dump(report, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
+        print(f"\nレポートを保存しました: {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,13 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import os
-import glob
-import numpy as np
-from PIL import Image
-import onnxruntime as ort
-import pandas as pd
 import argparse
+import contextlib
 from tqdm import tqdm
+from tagging_cache import CACHE_FILENAME
+from tagger_engine import PREPROCESS_MODES, TaggerEngine, find_images
+from tagger_farm import TaggerFarm
+from tag_store import OUTPUT_FORMATS, STORE_FILENAME, TagStoreWriter
+from onnx_session import SESSION_PROFILES
+from job_manifest import JobManifest
 
 # カテゴリ定義
 TAG_CATEGORIES = {
@@ -38,53 +40,28 @@ def parse_arguments():
     parser.add_argument('--output', '-o', type=str, required=True, help='出力ディレクトリ')
     parser.add_argument('--threshold', '-t', type=float, default=0.05, help='タグの閾値 (0.0-1.0)')
     parser.add_argument('--model-dir', '-m', type=str, default='tagger_data', help='モデルディレクトリ')
+    parser.add_argument('--batch-size', '-b', type=int, default=8, help='1回の推論にまとめる画像数')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='files',
+                        help='files: 画像ごとのファイル / store: tags.tagstore に集約 / both: 両方')
+    parser.add_argument('--threads', type=int, help='推論スレッド数（複数のタガーを並べて動かす場合に指定）')
+    parser.add_argument('--workers', type=int,
+                        help='ワーカープロセス数（2以上でタガーファームとして並列実行、キャッシュは使わない）')
+    parser.add_argument('--session-profile', choices=sorted(SESSION_PROFILES), default='default',
+                        help='ONNXセッション設定（worker: 1スレッド・スピン待ちなし）')
+    parser.add_argument('--int8', action='store_true', help='INT8量子化モデル（quantize_model.py で作成）を使う')
+    parser.add_argument('--preprocess', choices=PREPROCESS_MODES, default='pad',
+                        help='pad: 縦横比を保って余白を白で埋める（WDタガーの学習時と同じ） / stretch: 引き伸ばす（従来）')
+    parser.add_argument('--cache-optimized', action='store_true',
+                        help='最適化済みモデルをモデルディレクトリの .onnx_optimized/ に保存し、次回のロードを速くする'
+                             '（モデルとほぼ同じサイズ、EVA02-Large では約1.2GBのファイルが増える）')
+    parser.add_argument('--cache', nargs='?', const='', metavar='PATH',
+                        help='推論結果を画像の内容ハッシュでキャッシュし、再実行時の推論を省く'
+                             '（PATH省略時は出力ディレクトリの .tagging_cache.sqlite）。確率は float16 に丸め、'
+                             '0.01 未満は 0 として保存するため、閾値付近のタグが変わることがある')
+    parser.add_argument('--retry-failed', action='store_true', help='前回エラーになった画像だけを再処理する')
+    parser.add_argument('--restart', action='store_true', help='前回の進捗記録を破棄して最初から処理する')
     return parser.parse_args()
 
-def get_image_files(input_dir):
-    """指定ディレクトリから画像ファイルのリストを取得"""
-    extensions = ['*.jpg', '*.jpeg', '*.png', '*.webp', '*.bmp']
-    files = []
-
-    for ext in extensions:
-        files.extend(glob.glob(os.path.join(input_dir, ext)))
-        files.extend(glob.glob(os.path.join(input_dir, ext.upper())))
-
-    return sorted(files)
-
-def preprocess_image(img_path):
-    """画像を読み込み、前処理する"""
-    try:
-        img = Image.open(img_path).convert('RGB')
-
-        # リサイズ (448x448)
-        img_resized = img.resize((448, 448), resample=Image.LANCZOS)
-
-        # NumPy配列に変換 & 正規化
-        img_array = np.array(img_resized).astype(np.float32) / 255.0
-
-        # バッチ次元を追加
-        img_array = np.expand_dims(img_array, axis=0)
-
-        return img_array
-    except Exception as e:
-        print(f"画像前処理エラー {img_path}: {e}")
-        return None
-
-def load_model_and_tags(model_dir):
-    """モデルとタグリストを読み込む"""
-    model_path = os.path.join(model_dir, "model.onnx")
-    csv_path = os.path.join(model_dir, "selected_tags.csv")
-
-    # タグリストを読み込む
-    df = pd.read_csv(csv_path)
-    labels = df['name'].tolist()
-
-    # モデルをロード
-    providers = ['CPUExecutionProvider']
-    session = ort.InferenceSession(model_path, providers=providers)
-
-    return session, labels
-
 def categorize_tags(tags_with_scores):
     """タグをカテゴリごとに分類"""
     categorized = {}
@@ -155,61 +132,97 @@ def tag_images_batch(args):
 
     # モデルとタグリストの読み込み
     print(f"モデルとタグ定義を読み込んでいます: {args.model_dir}")
+    precision = 'int8' if args.int8 else 'fp32'
     try:
-        session, labels = load_model_and_tags(args.model_dir)
-
-        # 入出力の情報取得
-        input_name = session.get_inputs()[0].name
-        output_name = session.get_outputs()[0].name
-        input_shape = session.get_inputs()[0].shape
-        print(f"モデル入力形状: {input_shape}")
-        print(f"利用可能なタグ数: {len(labels)}")
+        if args.workers and args.workers > 1:
+            # モデルは各ワーカーでロードし、このプロセスはタグ定義だけを使って結果を書き込む
+            engine = TaggerFarm(args.model_dir, workers=args.workers, batch_size=args.batch_size,
+                                threads=args.threads or 1, precision=precision, preprocess=args.preprocess,
+                                cache_optimized=args.cache_optimized)
+            print(f"ワーカープロセス数: {engine.workers}")
+        else:
+            engine = TaggerEngine(args.model_dir, batch_size=args.batch_size, use_cache=args.cache is not None,
+                                  cache_path=args.cache or os.path.join(args.output, CACHE_FILENAME),
+                                  session_profile=args.session_profile, threads=args.threads,
+                                  precision=precision, preprocess=args.preprocess,
+                                  cache_optimized=args.cache_optimized)
+            print(f"モデル入力形状: {engine.input_shape}")
+        print(f"利用可能なタグ数: {len(engine.labels)}")
     except Exception as e:
         print(f"モデル読み込みエラー: {e}")
         return
 
-    # 画像ファイルのリスト取得
-    image_files = get_image_files(args.input)
-    if not image_files:
-        print(f"エラー: ディレクトリ '{args.input}' に画像ファイルが見つかりません。")
-        return
-
-    print(f"処理する画像数: {len(image_files)}")
-    print(f"タグ閾値: {args.threshold}")
-
-    # 画像処理
-    results = []
-    for image_file in tqdm(image_files, desc="画像処理"):
-        try:
-            # 画像の前処理
-            img_array = preprocess_image(image_file)
-            if img_array is None:
+    # 途中で例外が起きてもキャッシュ・タグストア・ジョブマニフェストを閉じる
+    with engine, contextlib.ExitStack() as stack:
+        # 画像ファイルのリスト取得
+        image_files = find_images(args.input)
+        if not image_files:
+            print(f"エラー: ディレクトリ '{args.input}' に画像ファイルが見つかりません。")
+            return
+
+        # 前回の続きから処理（同じ設定のジョブで処理済みの画像は飛ばす）
+        manifest = stack.enter_context(JobManifest(args.output, restart=args.restart, job={
+            'model': os.path.abspath(engine.model_path), 'threshold': args.threshold,
+            'output_format': args.output_format, 'preprocess': args.preprocess}))
+        total = len(image_files)
+        image_files = manifest.pending(image_files, args.retry_failed)
+        if args.retry_failed:
+            print(f"前回失敗した画像を再処理します: {len(image_files)}")
+        elif len(image_files) < total:
+            print(f"処理済みの画像を飛ばします: {total - len(image_files)}")
+
+        print(f"処理する画像数: {len(image_files)}")
+        print(f"タグ閾値: {args.threshold}")
+
+        # 結果をタグストアにまとめる場合
+        writer = None
+        if args.output_format != 'files':
+            store_path = os.path.join(args.output, STORE_FILENAME)
+            writer = stack.enter_context(TagStoreWriter(store_path))
+            label_ids = writer.intern(engine.labels)
+
+        # 画像処理（バッチ推論）
+        results = []
+        postprocessor = engine.postprocessor(args.threshold)
+        for image_file, indices, scores, error in tqdm(engine.tag(image_files, postprocessor),
+                                                       total=len(image_files), desc="画像処理"):
+            if error is not None:
+                print(f"処理エラー {image_file}: {error}")
+                manifest.mark_failed(image_file, error)
                 continue
 
-            # モデルに合わせて形状調整（NHWC→NCHW）
-            if len(input_shape) == 4 and input_shape[1] == 3:
-                img_array = np.transpose(img_array, (0, 3, 1, 2))
-
-            # 推論実行
-            probs = session.run([output_name], {input_name: img_array})[0]
+            outputs = []
+            if writer is not None:
+                writer.append(image_file, label_ids[indices], scores)
+                # マニフェストに記録する前にストアへ書き出す
+                writer.flush()
+                outputs.append(store_path)
+            if args.output_format == 'store':
+                results.append((image_file, len(indices), store_path))
+                manifest.mark_done(image_file, outputs)
+                continue
 
-            # タグと確率をペアにする
-            tags_with_scores = [(labels[i], float(probs[0][i])) for i in range(len(labels))]
-            tags_with_scores.sort(key=lambda x: x[1], reverse=True)
+            try:
+                # 閾値以上のタグをスコア順に取得
+                filtered_tags = postprocessor.tags(indices, scores)
 
-            # 閾値以上のタグのみフィルタリング
-            filtered_tags = [(tag, score) for tag, score in tags_with_scores if score >= args.threshold]
+                # タグを保存
+                output_file = save_tags_to_file(image_file, filtered_tags, args.output, args.threshold)
+                results.append((image_file, len(filtered_tags), output_file))
+                outputs.append(output_file)
+                manifest.mark_done(image_file, outputs)
 
-            # タグを保存
-            output_file = save_tags_to_file(image_file, filtered_tags, args.output, args.threshold)
-            results.append((image_file, len(filtered_tags), output_file))
+            except Exception as e:
+                print(f"処理エラー {image_file}: {e}")
+                manifest.mark_failed(image_file, e)
 
-        except Exception as e:
-            print(f"処理エラー {image_file}: {e}")
+        failed = manifest.failed()
 
     # 結果サマリー
     print("\n=== 処理結果 ===")
     print(f"処理した画像数: {len(results)}/{len(image_files)}")
+    if failed:
+        print(f"エラーになった画像数: {len(failed)}（--retry-failed で再処理できます）")
     if results:
         avg_tags = sum(r[1] for r in results) / len(results)
         print(f"平均タグ数: {avg_tags:.1f}")
@@ -4,11 +4,12 @@
 import os
 import numpy as np
 from PIL import Image
-import onnxruntime as ort
 import pandas as pd
 import argparse
 import glob
 import time
+from tagger_engine import select_tags
+from onnx_session import create_session
 
 def parse_arguments():
     """コマンドライン引数のパース"""
@@ -47,9 +48,8 @@ def load_model_and_tags(model_dir):
     df = pd.read_csv(csv_path)
     labels = df['name'].tolist()
 
-    # モデルをロード
-    providers = ['CPUExecutionProvider']
-    session = ort.InferenceSession(model_path, providers=providers)
+    # モデルをロード（タガー共通の設定）
+    session = create_session(model_path)
 
     return session, labels
 
@@ -121,12 +121,8 @@ def tag_single_image(args):
         probs = session.run([output_name], {input_name: img_array})[0]
         inference_time = time.time() - start_time
 
-        # タグと確率をペアにする
-        tags_with_scores = [(labels[i], float(probs[0][i])) for i in range(len(labels))]
-        tags_with_scores.sort(key=lambda x: x[1], reverse=True)
-
-        # 閾値以上のタグのみフィルタリング
-        filtered_tags = [(tag, score) for tag, score in tags_with_scores if score >= args.threshold]
+        # 閾値以上のタグを確率の高い順に取得
+        filtered_tags = select_tags(probs[0], labels, args.threshold)
 
         # タグを保存
         output_file = save_tags_to_file(image_file, filtered_tags, args.output, args.threshold)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+共起に基づくタグのクラスタリング
+共起行列（TagCooccurrence）からよく一緒に出現するタグのまとまりを求め、
+まとまりの強さの順に並べたタグセットを返す。方法（バックエンド）は選択できる:
+
+    components: PMI がしきい値以上の組を辺とするグラフの連結成分
+    louvain:    共起回数を重みとするグラフのモジュラリティ最大化（Louvain法、ここで実装）
+    kmedoids:   正のPMIを並べた共起ベクトル（コサイン類似度）での k-medoids（行列演算）
+
+どのバックエンドもタグIDのまとまりを返し、共通の後処理で
+    - max_size を超えるまとまりは、内部の共起回数の多いタグから max_size 個ずつに分け
+    - min_size 未満のまとまりを除き
+    - タグの組の正のPMIの平均（まとまりの強さ）の大きい順に並べる
+
+使い方:
+    co = TagCooccurrence.from_file_tags(file_tags, category_tags)
+    for tags, score in cluster_tags(co, 'louvain', min_size=3, max_size=10):
+        ...
+"""
+
+import math
+import numpy as np
+from tag_cooccurrence import PAIR_CHUNK, sparse
+
+# k-medoids で共起ベクトルを縮める次元数（タグ数がこれ以下ならそのまま使う）
+KMEDOIDS_DIMS = 128
+
+# 連結成分・Louvain法で辺にする組の最小の共起回数（偶然の共起を除く）
+MIN_PAIR_COUNT = 2
+
+# Louvain法の1段階で全ノードを見直す最大回数
+LOUVAIN_PASSES = 20
+
+
+def _entry_rows(cooccurrence):
+    """対角以外の各成分の行（タグID）"""
+    return np.repeat(np.arange(len(cooccurrence)), np.diff(cooccurrence.indptr))
+
+
+def _positive_pmi(cooccurrence):
+    """対角以外の各成分の正のPMI（負の値は0）"""
+    return np.maximum(cooccurrence.scores('pmi'), 0.0)
+
+
+def _groups(labels):
+    """ラベル（-1 はどこにも属さない）ごとのタグIDの配列のリスト"""
+    order = np.argsort(labels, kind='stable')
+    order = order[labels[order] >= 0]
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return np.split(order, boundaries) if len(order) else []
+
+
+def _csr(rows, cols, weights, size):
+    """(行, 列, 重み) を行の順に並べた CSR 形式"""
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, cols[order], weights[order]
+
+
+def components(cooccurrence, threshold=1.0, min_count=MIN_PAIR_COUNT, **_):
+    """
+    PMI がしきい値以上（共起回数が min_count 以上）の組を辺とするグラフの連結成分
+
+    Returns:
+        list: タグIDの配列のリスト
+    """
+    rows, cols = _entry_rows(cooccurrence), cooccurrence.neighbors
+    edges = (cooccurrence.scores('pmi') >= threshold) & (cooccurrence.pair_counts >= min_count)
+    rows, cols = rows[edges], cols[edges]
+
+    # 隣のタグの小さい方のラベルを伝え、ポインタを辿って縮める（変わらなくなるまで）
+    labels = np.arange(len(cooccurrence))
+    while True:
+        updated = labels.copy()
+        np.minimum.at(updated, rows, labels[cols])
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return _groups(labels)
+
+
+def _local_moving(indptr, indices, weights, resolution, rng):
+    """
+    Louvain法の1段階: ノードを隣のコミュニティへ移してモジュラリティを上げる
+
+    Returns:
+        tuple: (ノードごとのコミュニティ番号（0からの連番）, 1つでも移動したか)
+    """
+    size = len(indptr) - 1
+    degree = np.bincount(np.repeat(np.arange(size), np.diff(indptr)), weights=weights, minlength=size)
+    total_weight = degree.sum()
+    community = np.arange(size)
+    if not total_weight:
+        return community, False
+
+    community_degree = degree.copy()
+    moved = False
+    for _ in range(LOUVAIN_PASSES):
+        changed = False
+        for node in rng.permutation(size).tolist():
+            start, end = indptr[node], indptr[node + 1]
+            neighbors, neighbor_weights = indices[start:end], weights[start:end]
+            others = neighbors != node
+            current = community[node]
+            community_degree[current] -= degree[node]
+
+            best = current
+            if others.any():
+                # コミュニティごとの「つながりの重み - 期待値」が移動による増加分
+                candidates, inverse = np.unique(community[neighbors[others]], return_inverse=True)
+                links = np.bincount(inverse, weights=neighbor_weights[others])
+                gains = links - resolution * community_degree[candidates] * degree[node] / total_weight
+                stay = np.flatnonzero(candidates == current)
+                stay_gain = gains[stay[0]] if len(stay) else \
+                    -resolution * community_degree[current] * degree[node] / total_weight
+                best_index = int(np.argmax(gains))
+                if gains[best_index] > stay_gain + 1e-12:
+                    best = candidates[best_index]
+
+            community_degree[best] += degree[node]
+            if best != current:
+                community[node] = best
+                changed = moved = True
+        if not changed:
+            break
+    return np.unique(community, return_inverse=True)[1], moved
+
+
+def louvain(cooccurrence, resolution=1.0, min_count=MIN_PAIR_COUNT, seed=0, max_community=None, **_):
+    """
+    共起回数（min_count 以上）を重みとするグラフを Louvain法でコミュニティに分ける
+
+    Args:
+        resolution (float): 大きいほど小さなコミュニティに分かれる
+        max_community (int): コミュニティをまとめる段階を進めた結果、これより大きい
+            コミュニティができる場合はその前の段階で止める（タグセット向けに小さく保つ）
+
+    Returns:
+        list: タグIDの配列のリスト
+    """
+    rng = np.random.default_rng(seed)
+    edges = cooccurrence.pair_counts >= min_count
+    size = len(cooccurrence)
+    edge_rows = _entry_rows(cooccurrence)[edges]
+    indptr, indices, weights = _csr(edge_rows, cooccurrence.neighbors[edges],
+                                    cooccurrence.pair_counts[edges].astype(np.float64), size)
+    labels = np.arange(size)
+
+    while True:
+        community, moved = _local_moving(indptr, indices, weights, resolution, rng)
+        if not moved:
+            break
+        if max_community and len(np.unique(labels)) < size and \
+                np.bincount(community[labels]).max() > max_community:
+            break
+        labels = community[labels]
+
+        # コミュニティを1つのノードにまとめたグラフ（内部の重みは自己ループ）
+        count = int(community.max()) + 1
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        codes, inverse = np.unique(community[rows] * count + community[indices], return_inverse=True)
+        indptr, indices, weights = _csr(codes // count, codes % count, np.bincount(inverse, weights=weights), count)
+
+    # 辺のないタグはどこにも属さない
+    labels[np.bincount(edge_rows, minlength=size) == 0] = -1
+    return _groups(labels)
+
+
+def _sparse_dense(indptr, indices, values, dense):
+    """CSR 形式の疎行列と密行列の積"""
+    size = len(indptr) - 1
+    if sparse is not None:
+        return np.asarray(sparse.csr_matrix((values, indices, indptr), shape=(size, dense.shape[0])) @ dense)
+    result = np.zeros((size, dense.shape[1]))
+    rows = np.repeat(np.arange(size), np.diff(indptr))
+    step = max(1, PAIR_CHUNK // dense.shape[1])
+    for start in range(0, len(indices), step):
+        chunk = slice(start, start + step)
+        np.add.at(result, rows[chunk], values[chunk, None] * dense[indices[chunk]])
+    return result
+
+
+def kmedoids(cooccurrence, clusters=None, iterations=20, dims=KMEDOIDS_DIMS, min_count=MIN_PAIR_COUNT, seed=0,
+             target_size=6, **_):
+    """
+    正のPMIを並べた共起ベクトルのコサイン類似度で k-medoids
+
+    共起ベクトルは共起回数が min_count 以上の組の正のPMIで、自分自身の成分は行の最大値。
+    タグ数が dims より多い場合は、共起ベクトルをランダム射影で dims 次元に縮める
+    （コサイン類似度はほぼ保たれる）。割り当てと medoid の更新は全タグ分を行列演算で行う。
+
+    Args:
+        clusters (int): クラスタ数（省略時はタグ数 / target_size）
+        iterations (int): 割り当てと更新の最大回数
+
+    Returns:
+        list: タグIDの配列のリスト
+    """
+    rng = np.random.default_rng(seed)
+    size = len(cooccurrence)
+    rows = _entry_rows(cooccurrence)
+    values = np.where(cooccurrence.pair_counts >= min_count, _positive_pmi(cooccurrence), 0.0)
+
+    # 自分自身の成分には行の最大値を置く（共起相手の重なりが少ない組も近くなるように）
+    self_values = np.zeros(size)
+    np.maximum.at(self_values, rows, values)
+    indptr = np.arange(size + 1) + cooccurrence.indptr
+    positions = np.arange(len(rows)) + rows + (cooccurrence.neighbors > rows)
+    indices = np.empty(len(rows) + size, dtype=np.int64)
+    entries = np.empty(len(rows) + size)
+    diagonal = np.setdiff1d(np.arange(len(indices)), positions, assume_unique=True)
+    indices[positions], entries[positions] = cooccurrence.neighbors, values
+    indices[diagonal], entries[diagonal] = np.arange(size), self_values
+
+    if size <= dims:
+        vectors = np.zeros((size, size))
+        vectors[np.repeat(np.arange(size), np.diff(indptr)), indices] = entries
+    else:
+        projection = rng.standard_normal((size, dims)) / math.sqrt(dims)
+        vectors = _sparse_dense(indptr, indices, entries, projection)
+
+    norms = np.linalg.norm(vectors, axis=1)
+    active = np.flatnonzero(norms > 0)  # 正のPMIを持たないタグはどこにも属さない
+    labels = np.full(size, -1)
+    if not len(active):
+        return []
+    vectors = vectors[active] / norms[active, None]
+
+    k = min(len(active), clusters or max(1, round(len(active) / target_size)))
+    medoids = np.sort(rng.choice(len(active), k, replace=False))
+    for _ in range(iterations):
+        # 最も似た medoid に割り当て（medoid 自身は自分のクラスタ）
+        assigned = np.argmax(vectors @ vectors[medoids].T, axis=1)
+        assigned[medoids] = np.arange(k)
+
+        # 類似度の合計が最大のメンバー = 正規化したベクトルの和との内積が最大のメンバー
+        sums = np.zeros((k, vectors.shape[1]))
+        np.add.at(sums, assigned, vectors)
+        fit = np.einsum('ij,ij->i', vectors, sums[assigned])
+        order = np.lexsort((-fit, assigned))
+        updated = order[np.r_[0, np.flatnonzero(np.diff(assigned[order])) + 1]]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+
+    labels[active] = assigned
+    return _groups(labels)
+
+
+# バックエンド名 → まとまり（タグIDの配列のリスト）を返す関数
+CLUSTER_BACKENDS = {
+    'components': components,
+    'louvain': louvain,
+    'kmedoids': kmedoids,
+}
+
+
+def rank_clusters(cooccurrence, groups, min_size=3, max_size=10):
+    """
+    まとまりを大きさで整え、まとまりの強さの順に並べる
+
+    Returns:
+        list: [(タグ名のリスト, 強さ), ...]。タグは内部の共起回数の多い順
+    """
+    size = len(cooccurrence)
+    rows, cols = _entry_rows(cooccurrence), cooccurrence.neighbors
+
+    def internal(labels):
+        return (labels[rows] >= 0) & (labels[rows] == labels[cols])
+
+    labels = np.full(size, -1)
+    for number, group in enumerate(groups):
+        labels[group] = number
+    inside = internal(labels)
+    strength = np.bincount(rows[inside], weights=cooccurrence.pair_counts[inside], minlength=size)
+
+    pieces = []
+    for group in groups:
+        group = group[np.lexsort((group, -strength[group]))]
+        pieces.extend(piece for piece in (group[start:start + max_size] for start in range(0, len(group), max_size))
+                      if len(piece) >= min_size)
+    if not pieces:
+        return []
+
+    # 強さ = まとまり内のタグの組（順序付き）の正のPMIの平均
+    labels = np.full(size, -1)
+    for number, piece in enumerate(pieces):
+        labels[piece] = number
+    inside = internal(labels)
+    totals = np.bincount(labels[rows[inside]], weights=_positive_pmi(cooccurrence)[inside], minlength=len(pieces))
+    sizes = np.array([len(piece) for piece in pieces], dtype=np.float64)
+    scores = totals / np.maximum(sizes * (sizes - 1), 1)
+
+    tags = cooccurrence.tags
+    return [([tags[i] for i in pieces[number].tolist()], float(scores[number]))
+            for number in np.argsort(-scores, kind='stable').tolist()]
+
+
+def cluster_tags(cooccurrence, backend='louvain', min_size=3, max_size=10, **options):
+    """
+    共起行列のタグをクラスタリングし、まとまりの強さの順のタグセットを返す
+
+    Args:
+        cooccurrence (TagCooccurrence): 共起行列（カテゴリのタグで作ったもの）
+        backend (str): CLUSTER_BACKENDS のいずれか
+        min_size, max_size (int): タグセットの最小・最大の大きさ
+        options: バックエンドの引数（threshold, resolution, clusters, seed など）
+
+    Returns:
+        list: [(タグ名のリスト, 強さ), ...]
+    """
+    if backend not in CLUSTER_BACKENDS:
+        raise ValueError(f"不明なバックエンドです: {backend}（{', '.join(CLUSTER_BACKENDS)} のいずれか）")
+    options.setdefault('target_size', (min_size + max_size) / 2)
+    options.setdefault('max_community', max_size)
+    groups = CLUSTER_BACKENDS[backend](cooccurrence, **options)
+    return rank_clusters(cooccurrence, groups, min_size, max_size)
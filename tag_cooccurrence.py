@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+タグの共起行列
+タグを整数IDに置き換えて ファイル×タグ の疎な出現行列 X を作り、共起回数を
+X^T X の1回の疎行列積で求める。ファイルごとに Python の辞書を二重ループで
+更新する方法に比べ、件数の多いコーパスでも速く、メモリも共起するタグの組の数で済む。
+
+scipy があれば scipy.sparse で積を計算し、なければ numpy だけで同じ結果を求める
+（ファイル内のタグの組を一括で列挙し、組ごとに数える）。
+
+共起回数のほか、PMI・Jaccard係数・リフト値を返す。
+
+使い方:
+    co = TagCooccurrence.from_file_tags(file_tags)          # ファイルごとのタグ名のリスト
+    co = TagCooccurrence.from_records(records, tags=category_tags)  # TagRecords（タグを絞る場合）
+    co.count('smile', 'blush')
+    co.most_common('smile', 10)                  # [(tag, 共起回数), ...]
+    pairs = co.similar_pairs('jaccard', 0.5)     # {(tag1, tag2): 係数}
+"""
+
+import numpy as np
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
+
+# numpy で計算する場合に1回で列挙するタグの組の数の上限（メモリ使用量を抑える）
+PAIR_CHUNK = 1 << 22
+
+# タグ数の2乗がこれ以下なら、組を並べ替えずに密な配列で数える（numpy で計算する場合）
+DENSE_CELLS = 1 << 24
+
+# 共起の強さの指標
+METRICS = ('count', 'jaccard', 'pmi', 'lift')
+
+
+def _incidence(file_tags, tags=None):
+    """
+    ファイルごとのタグ名のリストから出現行列（CSR形式）を作成
+
+    Returns:
+        tuple: (タグ名のリスト, indptr, タグIDの配列)。1ファイル内の重複は1つにまとめる
+    """
+    index = {}
+    if tags is not None:
+        for tag in tags:
+            index.setdefault(tag, len(index))
+    indptr = [0]
+    tag_ids = []
+    for file_tag_list in file_tags:
+        if tags is None:
+            row = {index.setdefault(tag, len(index)) for tag in file_tag_list}
+        else:
+            row = {index[tag] for tag in file_tag_list if tag in index}
+        tag_ids.extend(sorted(row))
+        indptr.append(len(tag_ids))
+    return list(index), np.array(indptr, dtype=np.int64), np.array(tag_ids, dtype=np.int64)
+
+
+def _cooccurrence_numpy(indptr, tag_ids, num_tags):
+    """
+    X^T X を numpy で計算（対角成分を含む）
+
+    ファイル内のタグIDは昇順なので、各レコードとそれ以降のレコードの組（上三角）だけを
+    列挙して数え、最後に対称にする。
+
+    Returns:
+        tuple: (行, 列, 回数) の配列。(行, 列) の順に並ぶ
+    """
+    lengths = np.diff(indptr)
+    file_ends = np.repeat(indptr[1:], lengths)
+    pair_lengths = file_ends - np.arange(len(tag_ids))
+
+    # 組の数が PAIR_CHUNK 程度になるようにレコードを区切る（1レコード分の組は必ず同じ区間）
+    pair_ends = np.cumsum(pair_lengths)
+    bounds = [0]
+    while bounds[-1] < len(tag_ids):
+        done = pair_ends[bounds[-1] - 1] if bounds[-1] else 0
+        bounds.append(max(int(np.searchsorted(pair_ends, done + PAIR_CHUNK, side='right')), bounds[-1] + 1))
+
+    dense = num_tags * num_tags <= DENSE_CELLS
+    totals = np.zeros(num_tags * num_tags if dense else 0, dtype=np.int64)
+    codes, counts = [], []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        chunk_lengths = pair_lengths[start:end]
+        left = np.repeat(np.arange(start, end), chunk_lengths)
+        offsets = np.cumsum(chunk_lengths) - chunk_lengths
+        right = left + np.arange(len(left)) - np.repeat(offsets, chunk_lengths)
+        chunk_codes = tag_ids[left] * num_tags + tag_ids[right]
+        if dense:
+            totals += np.bincount(chunk_codes, minlength=len(totals))
+            continue
+        chunk_codes, chunk_counts = np.unique(chunk_codes, return_counts=True)
+        codes.append(chunk_codes)
+        counts.append(chunk_counts)
+
+    if dense:
+        upper = totals.reshape(num_tags, num_tags)
+        full = upper + upper.T
+        full[np.diag_indices(num_tags)] = np.diag(upper)
+        codes = np.flatnonzero(full)
+        return codes // num_tags, codes % num_tags, full.ravel()[codes]
+
+    if not codes:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    codes = np.concatenate(codes)
+    counts = np.concatenate(counts)
+    if len(codes) > 1 and len(bounds) > 2:
+        # 区間ごとの結果をまとめる
+        order = np.argsort(codes, kind='stable')
+        codes, counts = codes[order], counts[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        codes, counts = codes[starts], np.add.reduceat(counts, starts)
+
+    # 下三角を加えて対称にする
+    rows, cols = codes // num_tags, codes % num_tags
+    off = rows != cols
+    codes = np.concatenate([codes, cols[off] * num_tags + rows[off]])
+    counts = np.concatenate([counts, counts[off]])
+    order = np.argsort(codes)
+    codes, counts = codes[order], counts[order]
+    return codes // num_tags, codes % num_tags, counts
+
+
+def _cooccurrence_scipy(indptr, tag_ids, num_tags):
+    """X^T X を scipy.sparse で計算（_cooccurrence_numpy と同じ戻り値）"""
+    incidence = sparse.csr_matrix((np.ones(len(tag_ids), dtype=np.int64), tag_ids, indptr),
+                                  shape=(len(indptr) - 1, num_tags))
+    product = (incidence.T @ incidence).tocoo()
+    order = np.lexsort((product.col, product.row))
+    return (product.row[order].astype(np.int64), product.col[order].astype(np.int64),
+            product.data[order].astype(np.int64))
+
+
+class TagCooccurrence:
+    """
+    タグの共起行列（疎行列）
+
+    対角成分（タグごとの出現ファイル数）は counts に、対角以外は CSR 形式
+    （indptr / neighbors / pair_counts）で持つ。行列は対称。
+    """
+
+    def __init__(self, file_tags, tags=None):
+        """
+        Args:
+            file_tags (iterable): ファイルごとのタグ名のリスト
+            tags (iterable): 指定した場合、このタグだけで行列を作る（出現しないタグも含む）
+        """
+        self.tags, indptr, tag_ids = _incidence(file_tags, tags)
+        self.index = {tag: i for i, tag in enumerate(self.tags)}
+        self.n_files = len(indptr) - 1
+        num_tags = len(self.tags)
+
+        compute = _cooccurrence_scipy if sparse is not None else _cooccurrence_numpy
+        rows, cols, values = compute(indptr, tag_ids, max(num_tags, 1))
+
+        diagonal = rows == cols
+        self.counts = np.zeros(num_tags, dtype=np.int64)
+        self.counts[rows[diagonal]] = values[diagonal]
+        rows, cols, values = rows[~diagonal], cols[~diagonal], values[~diagonal]
+        self.indptr = np.zeros(num_tags + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_tags), out=self.indptr[1:])
+        self.neighbors = cols
+        self.pair_counts = values
+        self._rows = rows
+
+    @classmethod
+    def from_file_tags(cls, file_tags, tags=None):
+        return cls(file_tags, tags)
+
+    @classmethod
+    def from_records(cls, records, tags=None):
+        """TagRecords から作成"""
+        return cls(records.file_tags(), tags)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __contains__(self, tag):
+        return tag in self.index
+
+    def row(self, tag_id):
+        """
+        タグIDの行（対角以外）
+
+        Returns:
+            tuple: (共起するタグIDの配列（昇順）, 共起回数の配列)
+        """
+        start, end = self.indptr[tag_id], self.indptr[tag_id + 1]
+        return self.neighbors[start:end], self.pair_counts[start:end]
+
+    def count(self, tag1, tag2):
+        """2つのタグが両方出現するファイルの数"""
+        if tag1 not in self.index or tag2 not in self.index:
+            return 0
+        i, j = self.index[tag1], self.index[tag2]
+        if i == j:
+            return int(self.counts[i])
+        neighbors, counts = self.row(i)
+        pos = np.searchsorted(neighbors, j)
+        return int(counts[pos]) if pos < len(neighbors) and neighbors[pos] == j else 0
+
+    def neighbor_counts(self, tag):
+        """{共起するタグ: 共起回数}"""
+        if tag not in self.index:
+            return {}
+        neighbors, counts = self.row(self.index[tag])
+        tags = self.tags
+        return {tags[j]: c for j, c in zip(neighbors.tolist(), counts.tolist())}
+
+    def most_common(self, tag, n=None):
+        """共起回数の多い順の [(tag, 共起回数), ...]（同じ回数はタグIDの順）"""
+        if tag not in self.index:
+            return []
+        neighbors, counts = self.row(self.index[tag])
+        order = np.argsort(-counts, kind='stable')[:n]
+        return [(self.tags[j], int(c)) for j, c in zip(neighbors[order].tolist(), counts[order].tolist())]
+
+    def scores(self, metric='count'):
+        """
+        対角以外の各成分（neighbors / pair_counts と同じ並び）の共起の強さ
+
+        Args:
+            metric (str): 'count'（共起回数）/ 'jaccard'（c_ij / (c_i + c_j - c_ij)）/
+                'pmi'（log(c_ij N / (c_i c_j))）/ 'lift'（c_ij N / (c_i c_j)）
+        """
+        if metric not in METRICS:
+            raise ValueError(f"不明な指標です: {metric}（{', '.join(METRICS)} のいずれか）")
+        pair = self.pair_counts.astype(np.float64)
+        if metric == 'count':
+            return pair
+        count_i = self.counts[self._rows].astype(np.float64)
+        count_j = self.counts[self.neighbors].astype(np.float64)
+        if metric == 'jaccard':
+            return pair / (count_i + count_j - pair)
+        lift = pair * self.n_files / (count_i * count_j)
+        return np.log(lift) if metric == 'pmi' else lift
+
+    def similar_pairs(self, metric='jaccard', threshold=0.0):
+        """
+        指標がしきい値以上のタグの組
+
+        Returns:
+            dict: {(tag1, tag2): 値}（tag1 のタグIDが小さい方、値の大きい順）
+        """
+        values = self.scores(metric)
+        mask = (self._rows < self.neighbors) & (values >= threshold)
+        rows, cols, values = self._rows[mask], self.neighbors[mask], values[mask]
+        order = np.argsort(-values, kind='stable')
+        tags = self.tags
+        return {(tags[i], tags[j]): v for i, j, v in
+                zip(rows[order].tolist(), cols[order].tolist(), values[order].tolist())}
+
+    def neighbor_jaccard(self, tag):
+        """
+        共起するタグの集合どうしの Jaccard 係数（tag と各タグの「共起相手」の重なり）
+
+        Returns:
+            np.ndarray: タグIDごとの係数
+        """
+        num_tags = len(self.tags)
+        if tag not in self.index:
+            return np.zeros(num_tags)
+        seed_neighbors, _ = self.row(self.index[tag])
+        degrees = np.diff(self.indptr)
+        # 共起相手 u ごとの行をまとめて数えると |N(tag) ∩ N(t)|
+        rows = [self.row(u)[0] for u in seed_neighbors.tolist()]
+        shared = np.bincount(np.concatenate(rows), minlength=num_tags) if rows else np.zeros(num_tags, dtype=np.int64)
+        union = len(seed_neighbors) + degrees - shared
+        return np.divide(shared, union, out=np.zeros(num_tags), where=union > 0)
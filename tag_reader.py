@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+タグファイルの読み込み（全スクリプト共通）
+タグファイルの形式は行ごとに自動で判定する:
+
+    1girl, 0.99        「tag, score」形式（WD14 Tagger の出力）
+    smile: 0.8         「tag: score」形式（":d" のようにコロンを含むタグもそのまま読む）
+    1girl, solo, smile カンマ区切り（数値だけの要素はスコアの列として読み飛ばす）
+    solo               1行1タグ
+
+スコアのないタグは DEFAULT_SCORE（1.0）として扱う。ファイルは1回で全体を読み込み、
+除外するタグは exclusion_set() で小文字の frozenset にしてから渡す（タグごとに
+除外リストを作り直さない）。
+
+使い方:
+    EXCLUDED = exclusion_set(EXCLUDE_TAGS)
+    read_scored_tags(path, exclude=EXCLUDED, min_score=0.5)   # [(tag, score), ...]
+    read_tag_names(path, exclude=EXCLUDED)                    # [tag, ...]
+"""
+
+# スコアが書かれていないタグのスコア
+DEFAULT_SCORE = 1.0
+
+# スコアになりうる文字列の先頭の文字（これ以外で始まる要素は float() を試さない）
+_SCORE_START = frozenset('0123456789.-+')
+
+
+def _parse_score(text):
+    """スコアとして読める場合は float、読めない場合は None"""
+    text = text.strip()
+    if not text or text[0] not in _SCORE_START:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def exclusion_set(tags):
+    """除外するタグ名を大文字・小文字を区別せずに引ける frozenset"""
+    return frozenset(tag.lower() for tag in tags)
+
+
+def _select(tags, exclude, min_score):
+    """除外タグ（小文字の集合）とスコアのしきい値で絞り込む"""
+    if min_score is not None:
+        tags = [(tag, score) for tag, score in tags if score >= min_score]
+    if exclude:
+        tags = [(tag, score) for tag, score in tags if tag.lower() not in exclude]
+    return tags
+
+
+def parse_scored_tags(content, exclude=None, min_score=None):
+    """
+    タグファイルの内容を [(tag, score), ...] に変換
+
+    Args:
+        content (str): タグファイルの内容
+        exclude (frozenset): 除外するタグ名（小文字、exclusion_set() の戻り値）
+        min_score (float): このスコア未満のタグを除く
+    """
+    tags = []
+    append = tags.append
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if ',' in line:
+            tag, _, rest = line.partition(',')
+            if ',' not in rest:
+                score = _parse_score(rest)
+                tag = tag.strip()
+                if score is not None and tag:
+                    append((tag, score))
+                    continue
+            for part in line.split(','):
+                part = part.strip()
+                if part and _parse_score(part) is None:
+                    append((part, DEFAULT_SCORE))
+        elif ':' in line:
+            tag, _, score_text = line.rpartition(':')
+            score = _parse_score(score_text)
+            tag = tag.strip()
+            if score is not None and tag:
+                append((tag, score))
+            else:
+                # ":d" のようにコロンを含むタグ
+                append((line, DEFAULT_SCORE))
+        else:
+            append((line, DEFAULT_SCORE))
+    return _select(tags, exclude, min_score)
+
+
+def read_scored_tags(file_path, exclude=None, min_score=None):
+    """タグファイルを [(tag, score), ...] で読み込む（読めない場合は空のリスト）"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"ファイル読み込みエラー {file_path}: {e}")
+        return []
+    return parse_scored_tags(content, exclude, min_score)
+
+
+def read_tag_names(file_path, exclude=None, min_score=None):
+    """タグファイルのタグ名のリスト（ファイル内の順）"""
+    return [tag for tag, _ in read_scored_tags(file_path, exclude, min_score)]
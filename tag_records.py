@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ワイルドカード生成用のタグレコード
+全ファイルのタグを (ファイル番号, タグID, スコア) の列としてまとめて持ち、
+信頼度（タガーのスコア）での絞り込みや重み付けを numpy で一度に行う。
+
+タグファイル（tag_reader で読み込む）とタグストアのどちらからでも作れる。
+スコアのないタグは 1.0 として扱う。
+
+使い方:
+    records = TagRecords.load('tags_dir').filter(min_score=0.5, exclude=EXCLUDE_TAGS)
+    counts = records.tag_counter()              # タグごとの出現ファイル数
+    confidence = records.tag_counter(weighted=True)  # スコアの合計（信頼度で重み付けした出現数）
+    for tags in records.file_tags():            # ファイルごとのタグ名のリスト
+        ...
+"""
+
+from pathlib import Path
+from collections import Counter
+import numpy as np
+from tag_store import TagStore, is_tag_store
+from tag_reader import exclusion_set, read_scored_tags
+
+
+class TagRecords:
+    """
+    (ファイル番号, タグID, スコア) のレコード列
+
+    レコードはファイル番号の順に並び、1ファイル内で同じタグは1つにまとめる
+    （スコアは最大値）。絞り込みはタグ表とファイル一覧を共有した新しい
+    TagRecords を返すので、タグIDとファイル番号は元のものと同じ。
+    """
+
+    def __init__(self, labels, sources, file_ids, tag_ids, scores):
+        """
+        Args:
+            labels (list): タグID → タグ名
+            sources (list): ファイル番号 → 読み込み元のパス
+            file_ids, tag_ids (np.ndarray): int32 のファイル番号・タグID
+            scores (np.ndarray): float32 のスコア
+        """
+        self.labels = labels
+        self.sources = sources
+        self.file_ids = np.asarray(file_ids, dtype=np.int32)
+        self.tag_ids = np.asarray(tag_ids, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        (読み込み元, [(tag, score), ...]) の列から作成
+
+        Returns:
+            TagRecords
+        """
+        labels = []
+        label_ids = {}
+        sources = []
+        file_ids, tag_ids, scores = [], [], []
+        for source, tags_with_scores in rows:
+            file_id = len(sources)
+            sources.append(str(source))
+            best = {}
+            for tag, score in tags_with_scores:
+                tag_id = label_ids.get(tag)
+                if tag_id is None:
+                    tag_id = label_ids[tag] = len(labels)
+                    labels.append(tag)
+                if tag_id not in best or score > best[tag_id]:
+                    best[tag_id] = score
+            file_ids.extend([file_id] * len(best))
+            tag_ids.extend(best)
+            scores.extend(best.values())
+        return cls(labels, sources, file_ids, tag_ids, scores)
+
+    @classmethod
+    def from_files(cls, tag_files):
+        """タグファイルのリストから作成"""
+        return cls.from_rows((path, read_scored_tags(path)) for path in tag_files)
+
+    @classmethod
+    def from_store(cls, store_path):
+        """タグストアから作成（タグIDはストアのものをそのまま使う）"""
+        store = TagStore(store_path)
+        sources = []
+        file_ids, tag_ids, scores = [], [], []
+        for image_path, row_tag_ids, row_scores in store:
+            file_ids.append(np.full(len(row_tag_ids), len(sources), dtype=np.int32))
+            tag_ids.append(row_tag_ids)
+            scores.append(row_scores)
+            sources.append(image_path)
+        if not sources:
+            return cls(list(store.labels), sources, [], [], [])
+        return cls(list(store.labels), sources, np.concatenate(file_ids),
+                   np.concatenate(tag_ids), np.concatenate(scores))
+
+    @classmethod
+    def load(cls, path, pattern='*.txt'):
+        """タグストアまたはタグファイルのディレクトリから作成"""
+        if is_tag_store(path):
+            return cls.from_store(path)
+        return cls.from_files(sorted(Path(path).glob(pattern)))
+
+    def __len__(self):
+        return len(self.tag_ids)
+
+    @property
+    def file_count(self):
+        """レコードが1つ以上あるファイルの数"""
+        return len(np.unique(self.file_ids))
+
+    def select(self, mask):
+        """真偽値（またはインデックス）の配列で選んだレコード"""
+        return TagRecords(self.labels, self.sources, self.file_ids[mask],
+                          self.tag_ids[mask], self.scores[mask])
+
+    def filter(self, min_score=None, exclude=None, tags=None):
+        """
+        レコードを絞り込む
+
+        Args:
+            min_score (float): このスコア未満のレコードを除く
+            exclude (iterable): 除外するタグ名（大文字・小文字を区別しない。exclusion_set() の戻り値も可）
+            tags (iterable): 指定した場合、このタグ名のレコードだけを残す
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if min_score is not None:
+            mask &= self.scores >= min_score
+        if exclude:
+            excluded = exclude if isinstance(exclude, frozenset) else exclusion_set(exclude)
+            mask &= ~self._label_mask(lambda label: label.lower() in excluded)[self.tag_ids]
+        if tags is not None:
+            wanted = set(tags)
+            mask &= self._label_mask(lambda label: label in wanted)[self.tag_ids]
+        return self.select(mask)
+
+    def _label_mask(self, predicate):
+        """タグIDごとの真偽値の配列"""
+        return np.fromiter((predicate(label) for label in self.labels), dtype=bool, count=len(self.labels))
+
+    def counts(self):
+        """タグIDごとの出現ファイル数"""
+        return np.bincount(self.tag_ids, minlength=len(self.labels))
+
+    def weighted_counts(self):
+        """タグIDごとのスコアの合計（信頼度で重み付けした出現数）"""
+        return np.bincount(self.tag_ids, weights=self.scores, minlength=len(self.labels))
+
+    def mean_scores(self):
+        """タグIDごとの平均スコア（出現しないタグは0）"""
+        counts = self.counts()
+        return np.divide(self.weighted_counts(), counts, out=np.zeros(len(self.labels)), where=counts > 0)
+
+    def tag_counter(self, weighted=False):
+        """
+        出現したタグの Counter
+
+        Args:
+            weighted (bool): True の場合は出現ファイル数ではなくスコアの合計
+        """
+        values = self.weighted_counts() if weighted else self.counts()
+        present = np.flatnonzero(self.counts())
+        return Counter({self.labels[i]: values[i].item() for i in present})
+
+    def ranked(self, tags=None):
+        """
+        タグ名を信頼度で重み付けした出現数の多い順に並べる（同じ値はタグ名順）
+
+        Args:
+            tags (iterable): 並べるタグ名（省略時は出現した全てのタグ）
+        """
+        weights = self.weighted_counts()
+        index = {label: i for i, label in enumerate(self.labels)}
+        if tags is None:
+            tags = [self.labels[i] for i in np.flatnonzero(self.counts())]
+        return sorted(tags, key=lambda tag: (-weights[index[tag]] if tag in index else 0.0, tag))
+
+    def file_tags(self):
+        """ファイルごとのタグ名のリスト（レコードのないファイルは含めない）"""
+        if not len(self):
+            return []
+        labels = self.labels
+        boundaries = np.flatnonzero(np.diff(self.file_ids)) + 1
+        return [[labels[i] for i in chunk.tolist()] for chunk in np.split(self.tag_ids, boundaries)]
+
+    def file_paths(self):
+        """file_tags() と同じ順の読み込み元のパス"""
+        return [self.sources[i] for i in np.unique(self.file_ids)]
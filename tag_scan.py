@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+タグファイルのコーパスの並列読み込み
+ネットワーク共有や Windows の共有フォルダでは、10万件を超えるタグファイルの読み込み時間の
+ほとんどがファイルごとの待ち時間になる。ファイルをチャンクに分けてプロセスプールで
+並列に読み込み・解析することで、待ち時間を重ねて隠す。
+
+各ワーカーはチャンクごとに
+    - タグごとの出現ファイル数（Counter）
+    - チャンク内のタグ表と、ファイルごとのタグID・スコアの配列
+を返し、親プロセスでタグIDを全体のものに付け替えて TagRecords にまとめる。
+ファイルの順は入力の順のまま（workers=1 なら同じ処理をプロセスを使わずに行う）。
+
+タグの出現回数だけが必要な場合は count_tags() を使う。こちらは1ファイル内の重複も
+1回ずつ数え、TagRecords は作らない。
+
+使い方:
+    records, counts = scan_files(tag_files, workers=8, exclude=EXCLUDED_TAGS, min_score=0.6)
+    counts, file_count = count_tags(tag_files, workers=8, min_score=0.6)
+"""
+
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tag_reader import read_scored_tags
+from tag_records import TagRecords
+
+# 1つのタスクにまとめるファイル数。大きいほどプロセス間の往復が減り、小さいほど負荷が均等になる
+SCAN_CHUNK = 256
+
+
+def _scan_chunk(task):
+    """
+    ワーカー: チャンクのファイルを読み込む
+
+    Args:
+        task (tuple): (ファイルパスのリスト, 除外タグの集合, 最小スコア)
+
+    Returns:
+        tuple: (タグ表, Counter, ファイルごとのタグ数, タグIDの配列, スコアの配列)。
+            1ファイル内で同じタグは最初の位置に1つにまとめる（スコアは最大値）
+    """
+    paths, exclude, min_score = task
+    labels = []
+    label_ids = {}
+    counts = Counter()
+    lengths, tag_ids, scores = [], [], []
+    for path in paths:
+        best = {}
+        for tag, score in read_scored_tags(path, exclude):
+            if tag not in best or score > best[tag]:
+                best[tag] = score
+        if min_score is not None:
+            best = {tag: score for tag, score in best.items() if score >= min_score}
+        counts.update(best.keys())
+        for tag in best:
+            if tag not in label_ids:
+                label_ids[tag] = len(labels)
+                labels.append(tag)
+        lengths.append(len(best))
+        tag_ids.extend(label_ids[tag] for tag in best)
+        scores.extend(best.values())
+    return (labels, counts, np.array(lengths, dtype=np.int32),
+            np.array(tag_ids, dtype=np.int32), np.array(scores, dtype=np.float32))
+
+
+def _count_chunk(task):
+    """
+    ワーカー: チャンクのファイルのタグを出現回数で数える
+
+    Returns:
+        tuple: (Counter（1ファイル内の重複も数える）, タグが1つ以上あるファイル数（しきい値で除く前）)
+    """
+    paths, exclude, min_score = task
+    counts = Counter()
+    file_count = 0
+    for path in paths:
+        tags = read_scored_tags(path, exclude)
+        if not tags:
+            continue
+        file_count += 1
+        counts.update(tag for tag, score in tags if min_score is None or score >= min_score)
+    return counts, file_count
+
+
+def _chunk_tasks(tag_files, chunk_size, exclude, min_score):
+    chunk_size = max(1, chunk_size)
+    return [(tag_files[start:start + chunk_size], exclude, min_score)
+            for start in range(0, len(tag_files), chunk_size)]
+
+
+def _run_chunks(function, tasks, workers):
+    """チャンクのタスクを入力順に処理（workers が1以下かタスクが1つなら逐次処理）"""
+    workers = max(1, workers or os.cpu_count() or 1)
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield function(task)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            yield from pool.map(function, tasks)
+
+
+def count_tags(tag_files, workers=None, chunk_size=SCAN_CHUNK, exclude=None, min_score=None):
+    """
+    タグファイルを並列に読み込み、タグの出現回数を数える
+
+    Args:
+        引数は scan_files() と同じ
+
+    Returns:
+        tuple: (Counter（タグ → 出現回数。1ファイル内の重複も数える）,
+                タグが1つ以上あるファイル数（min_score で除く前に数える）)
+    """
+    tag_files = [str(path) for path in tag_files]
+    counts = Counter()
+    file_count = 0
+    done = 0
+    tasks = _chunk_tasks(tag_files, chunk_size, exclude, min_score)
+    for task, (chunk_counts, chunk_file_count) in zip(tasks, _run_chunks(_count_chunk, tasks, workers)):
+        counts.update(chunk_counts)
+        file_count += chunk_file_count
+        done += len(task[0])
+        print(f"  {done}/{len(tag_files)} ファイル読み込み済み")
+    return counts, file_count
+
+
+def scan_files(tag_files, workers=None, chunk_size=SCAN_CHUNK, exclude=None, min_score=None):
+    """
+    タグファイルを並列に読み込み、TagRecords とタグごとの出現ファイル数にまとめる
+
+    Args:
+        tag_files (list): タグファイルのパス
+        workers (int): ワーカープロセス数（省略時はCPUコア数、1以下は逐次処理）
+        chunk_size (int): 1タスクのファイル数
+        exclude (frozenset): 除外するタグ名（小文字、tag_reader.exclusion_set() の戻り値）
+        min_score (float): このスコア未満のタグを除く
+
+    Returns:
+        tuple: (TagRecords（ファイルの順は tag_files の順）, Counter（タグ → 出現ファイル数）)
+    """
+    tag_files = [str(path) for path in tag_files]
+    tasks = _chunk_tasks(tag_files, chunk_size, exclude, min_score)
+
+    labels = []
+    label_ids = {}
+    counts = Counter()
+    lengths, tag_ids, scores = [], [], []
+
+    def merge(result):
+        chunk_labels, chunk_counts, chunk_lengths, chunk_tag_ids, chunk_scores = result
+        # チャンク内のタグID → 全体のタグID
+        mapping = np.empty(len(chunk_labels), dtype=np.int32)
+        for i, tag in enumerate(chunk_labels):
+            if tag not in label_ids:
+                label_ids[tag] = len(labels)
+                labels.append(tag)
+            mapping[i] = label_ids[tag]
+        counts.update(chunk_counts)
+        lengths.append(chunk_lengths)
+        tag_ids.append(mapping[chunk_tag_ids])
+        scores.append(chunk_scores)
+        done = sum(len(chunk) for chunk in lengths)
+        print(f"  {done}/{len(tag_files)} ファイル読み込み済み")
+
+    for result in _run_chunks(_scan_chunk, tasks, workers):
+        merge(result)
+
+    if not tasks:
+        return TagRecords(labels, tag_files, [], [], []), counts
+    lengths = np.concatenate(lengths)
+    file_ids = np.repeat(np.arange(len(tag_files), dtype=np.int32), lengths)
+    return TagRecords(labels, tag_files, file_ids, np.concatenate(tag_ids), np.concatenate(scores)), counts
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+共起に基づくタグセットの貪欲法による作成
+ランダムに選んだシードタグに、まだ使っていないタグのうちシードとの共起回数が
+多いものを順に加えてセットを作る（create_wildcards_yaml_all の従来の方法と同じ規則）。
+
+従来はセットごとに残りのリストから list.remove し、残り全てのタグの候補リストを
+作って並べ替えていたため、カテゴリのタグ数に対して3乗近くで遅くなっていた。
+ここでは
+    - 使用済みのタグは真偽値の配列（removed）と Fenwick 木で管理し、シードは O(log n) で選ぶ
+    - 候補はシードの共起行列の行（共起するタグのみ）から上位だけを取り出して並べる
+ことで、全体を共起するタグの組の数程度の手間で済ませる。乱数は random.Random を
+受け取るので、シードを固定すれば同じセットになる（同じ乱数なら従来の方法と同じセット）。
+
+ベンチマーク: benchmark_tag_sets.py
+"""
+
+import random
+import numpy as np
+
+# シードの行から最初に並べ替える候補の数（セットの大きさに対する倍率）
+CANDIDATE_FACTOR = 4
+
+
+def _ranked_neighbors(positions, counts, first):
+    """
+    共起回数の多い順（同じ回数はカテゴリ内の位置の順）に位置を返す
+
+    最初は上位 first 個程度（境界と同じ回数のものは全て含める）だけを並べ替え、
+    足りなくなった場合に残りを並べ替える。
+    """
+    if len(counts) > first:
+        boundary = np.partition(counts, len(counts) - first)[len(counts) - first]
+        top = counts >= boundary
+        order = np.lexsort((positions[top], -counts[top]))
+        yield from positions[top][order].tolist()
+        positions, counts = positions[~top], counts[~top]
+    order = np.lexsort((positions, -counts))
+    yield from positions[order].tolist()
+
+
+class _UnusedPositions:
+    """
+    未使用の位置の集合（Fenwick木）
+
+    「未使用の位置を昇順に並べたときの k 番目」を O(log n) で求められるので、
+    リストから list.remove していく従来の方法と同じ順でシードを選べる。
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.count = size
+        self.tree = [0] * (size + 1)
+        for i in range(1, size + 1):
+            self.tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= size:
+                self.tree[parent] += self.tree[i]
+        self.top = 1 << size.bit_length()
+
+    def __len__(self):
+        return self.count
+
+    def remove(self, pos):
+        self.count -= 1
+        i = pos + 1
+        while i <= self.size:
+            self.tree[i] -= 1
+            i += i & -i
+
+    def select(self, k):
+        """k 番目（0始まり）の未使用の位置"""
+        pos = 0
+        step = self.top
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= k:
+                pos = nxt
+                k -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+def greedy_sets(cooccurrence, category_tags, num_sets=50, set_size=3, rng=None):
+    """
+    共起行列からカテゴリのタグのセットを作成
+
+    Args:
+        cooccurrence (TagCooccurrence): 共起行列
+        category_tags (iterable): カテゴリのタグ（この順が同じ共起回数の場合の優先順、
+            セットにならなかった残りのタグもこの順にまとめる）
+        num_sets (int): 共起で作るセットの最大数
+        set_size (int): 1セットのタグ数
+        rng (random.Random): シードタグの選択に使う乱数（省略時は新しく作る）
+
+    Returns:
+        list: タグのリストのリスト。共起で作ったセットの後に、残りのタグを
+            set_size 個ずつまとめたもの（最後は少なくてもよい）
+    """
+    tags = list(category_tags)
+    if len(tags) < set_size:
+        return [tags] if tags else []
+    rng = rng or random.Random()
+
+    # 共起行列のタグID → カテゴリ内の位置（カテゴリ外は -1）
+    tag_ids = np.array([cooccurrence.index.get(tag, -1) for tag in tags], dtype=np.int64)
+    positions = np.full(len(cooccurrence), -1, dtype=np.int64)
+    known = tag_ids >= 0
+    positions[tag_ids[known]] = np.flatnonzero(known)
+
+    removed = np.zeros(len(tags), dtype=bool)
+    unused = _UnusedPositions(len(tags))
+    next_unused = 0  # 共起するタグが足りない場合に補う位置
+
+    def take(pos):
+        removed[pos] = True
+        unused.remove(pos)
+
+    sets = []
+    for _ in range(min(num_sets, len(tags) // set_size)):
+        # 未使用のタグを並び順に並べたリストからの rng.choice と同じ選び方
+        seed = unused.select(rng.randrange(len(unused)))
+        take(seed)
+        members = [seed]
+
+        if tag_ids[seed] >= 0:
+            neighbors, counts = cooccurrence.row(tag_ids[seed])
+            neighbor_positions = positions[neighbors]
+            in_category = neighbor_positions >= 0
+            for pos in _ranked_neighbors(neighbor_positions[in_category], counts[in_category],
+                                         set_size * CANDIDATE_FACTOR):
+                if len(members) == set_size:
+                    break
+                if not removed[pos]:
+                    take(pos)
+                    members.append(pos)
+
+        # 共起するタグが足りない場合はカテゴリの順に補う
+        while len(members) < set_size:
+            while removed[next_unused]:
+                next_unused += 1
+            take(next_unused)
+            members.append(next_unused)
+        sets.append(members)
+
+    # 残りのタグもカテゴリの順にまとめる
+    rest = np.flatnonzero(~removed).tolist()
+    sets.extend(rest[start:start + set_size] for start in range(0, len(rest), set_size))
+    return [[tags[pos] for pos in members] for members in sets]
+
+
+def set_score(cooccurrence, tag_set):
+    """セットの先頭（シード）と他のタグの共起回数の合計"""
+    return sum(cooccurrence.count(tag_set[0], tag) for tag in tag_set[1:])
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+タグ付け結果ストア
+画像ごとの .txt / _categorized.json の代わりに、全画像のタグとスコアを
+1つの追記専用バイナリログ（.tagstore）にまとめて保存する。
+
+ファイル形式:
+    先頭にマジック b'TAGSTORE1\\n'、以降はレコードの列
+    レコード = 種別(1バイト) + ペイロード長(uint32) + ペイロード
+        b'L': タグ名の追加（UTF-8のJSON配列）。タグIDは出現順の通し番号
+        b'R': 1画像分の結果。パス長(uint16) + タグ数(uint32) + パス(UTF-8)
+              + タグID(int32 × タグ数) + スコア(float32 × タグ数)
+
+同じ画像を再度追記した場合は後のレコードが有効。書き込み途中で終了した
+末尾の不完全なレコードは読み込み時に無視し、次の書き込み時に切り詰める。
+
+使い方:
+    python tag_store.py export tags.tagstore output_dir   # 従来の画像ごとの .txt に書き出し
+    python tag_store.py summary tags.tagstore             # 件数と頻出タグを表示
+"""
+
+import os
+import sys
+import json
+import struct
+import argparse
+from collections import Counter
+import numpy as np
+
+# 出力ディレクトリ内に作成するストアのファイル名
+STORE_FILENAME = 'tags.tagstore'
+
+# タガーの出力形式（files: 画像ごとのファイル / store: ストアのみ / both: 両方）
+OUTPUT_FORMATS = ('files', 'store', 'both')
+
+MAGIC = b'TAGSTORE1\n'
+RECORD_HEADER = struct.Struct('<cI')
+ROW_HEADER = struct.Struct('<HI')
+LABELS = b'L'
+ROW = b'R'
+
+
+def is_tag_store(path):
+    """ファイルがタグストアかどうか（先頭のマジックで判定）"""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _scan(f):
+    """
+    レコードを先頭から走査（ペイロードは読み飛ばす）
+
+    Yields:
+        tuple: (種別, ペイロードの開始位置, ペイロード長)
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(len(MAGIC))
+    pos = len(MAGIC)
+    while pos + RECORD_HEADER.size <= size:
+        kind, length = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+        start = pos + RECORD_HEADER.size
+        if start + length > size:
+            break
+        yield kind, start, length
+        pos = start + length
+        f.seek(pos)
+
+
+def _valid_end(f):
+    """最後の完全なレコードの終端位置"""
+    end = len(MAGIC)
+    for _, start, length in _scan(f):
+        end = start + length
+    return end
+
+
+class TagStoreWriter:
+    """
+    タグストアへの追記
+
+    使い方:
+        with TagStoreWriter('out/tags.tagstore') as writer:
+            label_ids = writer.intern(engine.labels)
+            writer.append(img_path, label_ids[indices], scores)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.labels = {}
+
+        if is_tag_store(path):
+            # 既存のタグ表を読み込み、不完全な末尾レコードを切り詰めて追記
+            for tag in TagStore(path).labels:
+                self.labels[tag] = len(self.labels)
+            with open(path, 'r+b') as f:
+                f.truncate(_valid_end(f))
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC)
+
+    def _write(self, kind, payload):
+        self.file.write(RECORD_HEADER.pack(kind, len(payload)))
+        self.file.write(payload)
+
+    def intern(self, tags):
+        """
+        タグ名をタグIDに変換（新しいタグはタグ表に追加）
+
+        Returns:
+            np.ndarray: tags と同じ順の int32 のタグID
+        """
+        new_tags = []
+        for tag in tags:
+            if tag not in self.labels:
+                self.labels[tag] = len(self.labels)
+                new_tags.append(tag)
+        if new_tags:
+            self._write(LABELS, json.dumps(new_tags, ensure_ascii=False).encode('utf-8'))
+        return np.array([self.labels[tag] for tag in tags], dtype=np.int32)
+
+    def append(self, image_path, tag_ids, scores):
+        """1画像分のタグID・スコアを追記"""
+        path_bytes = image_path.encode('utf-8')
+        tag_ids = np.asarray(tag_ids, dtype='<i4')
+        scores = np.asarray(scores, dtype='<f4')
+        self._write(ROW, b''.join([
+            ROW_HEADER.pack(len(path_bytes), len(tag_ids)),
+            path_bytes,
+            tag_ids.tobytes(),
+            scores.tobytes(),
+        ]))
+
+    def append_tags(self, image_path, tags_with_scores):
+        """[(tag, score), ...] 形式で追記"""
+        tags = [tag for tag, _ in tags_with_scores]
+        self.append(image_path, self.intern(tags), [score for _, score in tags_with_scores])
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class TagStore:
+    """
+    タグストアの読み込み
+
+    開いた時点でレコードの位置の索引（画像パス → 位置）を作るので、
+    任意の画像の結果を1回の読み込みで取り出せる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.labels = []
+        self.index = {}
+
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"タグストアではありません: {path}")
+            for kind, start, length in _scan(f):
+                if kind == LABELS:
+                    f.seek(start)
+                    self.labels.extend(json.loads(f.read(length).decode('utf-8')))
+                elif kind == ROW:
+                    f.seek(start)
+                    path_length, _ = ROW_HEADER.unpack(f.read(ROW_HEADER.size))
+                    image_path = f.read(path_length).decode('utf-8')
+                    # 再追記された画像は後のレコードが有効（順序は最初に追記された位置のまま）
+                    self.index[image_path] = start
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, image_path):
+        return image_path in self.index
+
+    def paths(self):
+        """画像パスのリスト（追記順）"""
+        return list(self.index)
+
+    def _read_row(self, f, start):
+        f.seek(start)
+        path_length, count = ROW_HEADER.unpack(f.read(ROW_HEADER.size))
+        f.seek(path_length, os.SEEK_CUR)
+        data = f.read(count * 8)
+        tag_ids = np.frombuffer(data, dtype='<i4', count=count)
+        scores = np.frombuffer(data, dtype='<f4', count=count, offset=count * 4)
+        return tag_ids, scores
+
+    def get(self, image_path):
+        """
+        Returns:
+            tuple: (タグID配列, スコア配列)
+        """
+        with open(self.path, 'rb') as f:
+            return self._read_row(f, self.index[image_path])
+
+    def tags(self, image_path):
+        """[(tag, score), ...] 形式で取得"""
+        return self.to_tags(*self.get(image_path))
+
+    def to_tags(self, tag_ids, scores):
+        """タグID・スコア配列を [(tag, score), ...] に変換"""
+        labels = self.labels
+        return [(labels[i], score) for i, score in zip(tag_ids.tolist(), scores.tolist())]
+
+    def __iter__(self):
+        """(画像パス, タグID配列, スコア配列) を追記順に返す"""
+        with open(self.path, 'rb') as f:
+            for image_path, start in self.index.items():
+                yield (image_path, *self._read_row(f, start))
+
+    def iter_tags(self):
+        """(画像パス, [(tag, score), ...]) を追記順に返す"""
+        for image_path, tag_ids, scores in self:
+            yield image_path, self.to_tags(tag_ids, scores)
+
+    def tag_counts(self):
+        """タグごとの出現画像数（Counter）"""
+        counts = np.zeros(len(self.labels), dtype=np.int64)
+        for _, tag_ids, _ in self:
+            counts += np.bincount(tag_ids, minlength=len(self.labels))
+        return Counter({self.labels[i]: int(counts[i]) for i in np.nonzero(counts)[0]})
+
+
+def export_legacy(store_path, output_dir, categorize=None):
+    """
+    従来のレイアウト（画像ごとの「tag, score」形式の .txt）に書き出す
+
+    Args:
+        store_path (str): タグストアのパス
+        output_dir (str): 出力ディレクトリ
+        categorize (callable): [(tag, score), ...] を受け取りカテゴリ別の辞書を返す関数。
+            指定した場合は {base_name}_categorized.json も書き出す
+
+    Returns:
+        int: 書き出した画像数
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    count = 0
+    for image_path, tags_with_scores in TagStore(store_path).iter_tags():
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        with open(os.path.join(output_dir, f"{base_name}.txt"), 'w', encoding='utf-8') as f:
+            for tag, score in tags_with_scores:
+                f.write(f"{tag}, {score:.6f}\n")
+        if categorize is not None:
+            json_path = os.path.join(output_dir, f"{base_name}_categorized.json")
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(categorize(tags_with_scores), f, ensure_ascii=False, indent=2)
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='タグストア（.tagstore）の書き出し・確認')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='画像ごとの .txt に書き出す')
+    export_parser.add_argument('store', help='タグストアのパス')
+    export_parser.add_argument('output_dir', help='出力ディレクトリ')
+
+    summary_parser = subparsers.add_parser('summary', help='件数と頻出タグを表示')
+    summary_parser.add_argument('store', help='タグストアのパス')
+    summary_parser.add_argument('--top', type=int, default=30, help='表示する頻出タグの数')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        count = export_legacy(args.store, args.output_dir)
+        print(f"{count}件を {args.output_dir} に書き出しました")
+    else:
+        store = TagStore(args.store)
+        print(f"画像数: {len(store)}")
+        print(f"タグ数: {len(store.labels)}")
+        for tag, count in store.tag_counts().most_common(args.top):
+            print(f"  {tag}: {count}回")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,32 +8,26 @@ import re
 import sys
 import yaml
 from collections import Counter, defaultdict
+from tag_store import TagStore, is_tag_store
+from tag_reader import read_scored_tags
 
 def read_tag_files(directory, pattern_str=r'item_\d+_\d+\.txt'):
-    """タグファイルを読み込んでタグを抽出"""
+    """タグファイルを読み込んでタグを抽出（directory にタグストアも指定可）"""
     all_tags = []
     tag_files = 0
 
+    if is_tag_store(directory):
+        store = TagStore(directory)
+        for _, tags_with_scores in store.iter_tags():
+            all_tags.extend(tags_with_scores)
+        return all_tags, len(store)
+
     # パターンにマッチするファイルを検索
     pattern = re.compile(pattern_str)
     for filename in os.listdir(directory):
         if pattern.match(filename):
             tag_files += 1
-            file_path = os.path.join(directory, filename)
-
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    # 各行からタグを抽出
-                    for line in f:
-                        line = line.strip()
-                        if ',' in line:
-                            tag, confidence = line.split(',', 1)
-                            tag = tag.strip()
-                            confidence = float(confidence.strip())
-                            if tag:
-                                all_tags.append((tag, confidence))
-            except Exception as e:
-                print(f"Error reading {file_path}: {e}")
+            all_tags.extend(read_scored_tags(os.path.join(directory, filename)))
 
     return all_tags, tag_files
 
@@ -113,7 +107,7 @@ def generate_summary(categorized, tag_counter, total_files):
 
 def main():
     if len(sys.argv) < 2:
-        print("使用法: python tag_summary.py タグディレクトリ [出力ファイル]")
+        print("使用法: python tag_summary.py タグディレクトリ|タグストア [出力ファイル]")
         return 1
 
     directory = sys.argv[1]
@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+EVA02タガー共通エンジン
+ONNXセッションを1回だけロードし、画像をバッチにまとめて推論する。
+画像のデコード・リサイズはスレッドまたはプロセスのプールで先読みし、
+事前確保したバッチバッファ（プロセスの場合は共有メモリ）へ直接書き込む。
+キャッシュを有効にすると、推論済みの画像（内容ハッシュが同じもの）は推論を省略する。
+
+eva02_tagger / improved_eva02_tagger / eva02_tagger_categorized / simple_tagger
+はこのエンジンを使うCLIフロントエンド。
+"""
+
+import os
+import glob
+import queue
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from PIL import Image
+from onnx_session import get_session
+from tagging_cache import CACHE_FILENAME, TaggingCache, file_sha256
+
+# 対象とする画像の拡張子
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp', 'bmp']
+
+# モデル入力サイズが不明な場合の既定値
+DEFAULT_TARGET_SIZE = (448, 448)
+
+# 精度ごとのモデルファイル名（int8 は quantize_model.py で作成）
+MODEL_FILENAMES = {'fp32': 'model.onnx', 'int8': 'model.int8.onnx'}
+
+# 前処理のバージョン（load_image の出力が変わる変更をしたら上げる。キャッシュのキーに含まれる）
+PREPROCESS_VERSION = '2'
+
+# 前処理の方法
+#   pad    : 縦横比を保って縮小し、余白を PAD_COLOR で埋める（WDタガーの学習時と同じ）
+#   stretch: 縦横比を無視して入力サイズに引き伸ばす（従来の方法）
+PREPROCESS_MODES = ('pad', 'stretch')
+
+# 余白・透過部分の色
+PAD_COLOR = (255, 255, 255)
+
+# 縮小デコード後も最終的なリサンプルの倍率をこれ以上残す（Pillow の reducing_gap と同じ考え方）
+REDUCING_GAP = 2.0
+
+# selected_tags.csv の category 列の値
+TAG_CATEGORIES = {'general': 0, 'character': 4, 'rating': 9}
+
+# デコード用の子プロセスでアタッチ済みの共有メモリ（名前 → SharedMemory）
+_attached_buffers = {}
+
+
+def find_images(img_dir):
+    """
+    ディレクトリ内の画像ファイルをファイル名順で取得
+
+    大文字・小文字の拡張子を両方検索するため、大文字小文字を区別しない
+    ファイルシステム（Windows）で同じファイルが重複しないようにまとめる。
+    """
+    image_files = []
+    for ext in IMAGE_EXTENSIONS:
+        image_files.extend(glob.glob(os.path.join(img_dir, f"*.{ext}")))
+        image_files.extend(glob.glob(os.path.join(img_dir, f"*.{ext.upper()}")))
+
+    unique = {os.path.normcase(os.path.abspath(path)): path for path in image_files}
+    return sorted(unique.values())
+
+
+def load_labels(csv_path):
+    """selected_tags.csv からタグ名のリストを読み込む"""
+    return load_tag_table(csv_path)[0]
+
+
+def load_tag_table(csv_path):
+    """
+    selected_tags.csv からタグ名とカテゴリを読み込む
+
+    Returns:
+        tuple: (タグ名のリスト, カテゴリ値の np.ndarray)
+            category 列がなければ全タグを general とみなす
+    """
+    df = pd.read_csv(csv_path)
+    if 'category' in df.columns:
+        categories = df['category'].fillna(TAG_CATEGORIES['general']).to_numpy(dtype=np.int16)
+    else:
+        categories = np.full(len(df), TAG_CATEGORIES['general'], dtype=np.int16)
+    return df['name'].tolist(), categories
+
+
+def fit_size(size, target_size, preprocess='pad'):
+    """リサイズ後の画像サイズ（pad の場合は縦横比を保って target_size に収まる大きさ）"""
+    if preprocess == 'stretch':
+        return target_size
+    width, height = size
+    scale = min(target_size[0] / width, target_size[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _to_rgb(img):
+    """RGBに変換（透過部分は余白と同じ色で塗る）"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, PAD_COLOR + (255,))
+        return Image.alpha_composite(background, img).convert('RGB')
+    return img.convert('RGB')
+
+
+def preprocess_image(img, target_size=DEFAULT_TARGET_SIZE, preprocess='pad', draft=True):
+    """
+    開いた画像をモデル入力サイズのRGB画像に変換
+
+    draft=True の場合、JPEGはDCTの段階で縮小してデコードし（Image.draft）、
+    それ以外も reduce() で整数倍に縮小してから最終的なリサンプルを行う。
+    どちらも最終サイズの REDUCING_GAP 倍以上を残すので、画質への影響は小さい。
+
+    Args:
+        img (PIL.Image.Image): Image.open で開いた画像（draft はデコード前にしか効かない）
+        target_size (tuple): (幅, 高さ)
+        preprocess (str): PREPROCESS_MODES のいずれか
+        draft (bool): 縮小デコードを使う（False の場合は全画素をデコードしてからリサイズ）
+    """
+    if preprocess not in PREPROCESS_MODES:
+        raise ValueError(f"不明な前処理: {preprocess}（{', '.join(PREPROCESS_MODES)}）")
+    size = fit_size(img.size, target_size, preprocess)
+
+    if draft:
+        img.draft('RGB', (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP)))
+    img = _to_rgb(img) if preprocess == 'pad' else img.convert('RGB')
+    if draft:
+        factor = int(min(img.width / size[0], img.height / size[1]) / REDUCING_GAP)
+        if factor > 1:
+            img = img.reduce(factor)
+
+    # 高品質なリサイズ（LANCZOS法を使用）
+    img = img.resize(size, resample=Image.LANCZOS)
+    if size != tuple(target_size):
+        canvas = Image.new('RGB', target_size, PAD_COLOR)
+        canvas.paste(img, ((target_size[0] - size[0]) // 2, (target_size[1] - size[1]) // 2))
+        img = canvas
+    return img
+
+
+def load_image(img_path, target_size=DEFAULT_TARGET_SIZE, out=None, preprocess='pad', draft=True):
+    """
+    画像を読み込み、モデル入力用の (H, W, C) float32 配列に変換
+
+    Args:
+        img_path (str): 画像ファイルのパス
+        target_size (tuple): (幅, 高さ)
+        out (np.ndarray): 書き込み先の (H, W, C) float32 配列（省略時は新規確保）
+        preprocess (str): PREPROCESS_MODES のいずれか
+        draft (bool): 縮小デコードを使う（preprocess_image を参照）
+
+    Returns:
+        np.ndarray: 0〜1に正規化したRGB配列
+    """
+    with Image.open(img_path) as img:
+        pixels = np.asarray(preprocess_image(img, target_size, preprocess, draft))
+
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.float32)
+    np.divide(pixels, np.float32(255.0), out=out)
+    return out
+
+
+def _decode_into(buffer, index, img_path, target_size, preprocess='pad'):
+    """バッチバッファの index 枚目へデコード（失敗時は例外を値として返す）"""
+    try:
+        load_image(img_path, target_size, out=buffer[index], preprocess=preprocess)
+        return None
+    except Exception as e:
+        return e
+
+
+def _decode_into_shared(shm_name, shape, slot, index, img_path, target_size, preprocess='pad'):
+    """子プロセス用: 共有メモリ上のバッチバッファへデコード"""
+    shm = _attached_buffers.get(shm_name)
+    if shm is None:
+        shm = _attached_buffers[shm_name] = shared_memory.SharedMemory(name=shm_name)
+    buffers = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    return _decode_into(buffers[slot], index, img_path, target_size, preprocess)
+
+
+def _hash_safely(img_path):
+    """読み込めないファイルは None（推論側でエラーとして報告される）"""
+    try:
+        return file_sha256(img_path)
+    except OSError:
+        return None
+
+
+def _iter_images(batches):
+    """run_batches の結果を1画像ずつの (img_path, probs, error) に展開"""
+    for batch_paths, probs, rows, errors in batches:
+        for img_path, row, error in zip(batch_paths, rows, errors):
+            if error is not None:
+                yield img_path, None, error
+            else:
+                yield img_path, probs[row], None
+
+
+def _future_error(future):
+    """デコード結果（None または例外）を取得。結果の受け渡し自体の失敗も例外として返す"""
+    try:
+        return future.result()
+    except Exception as e:
+        return e
+
+
+def select_tags(probs, labels, threshold):
+    """
+    1画像分の確率ベクトルから閾値以上のタグをスコア降順で返す
+
+    Returns:
+        list: [(tag, score), ...]
+    """
+    indices = np.nonzero(probs >= threshold)[0]
+    indices = indices[np.argsort(-probs[indices], kind='stable')]
+    return [(labels[i], float(probs[i])) for i in indices]
+
+
+class TagSelection:
+    """
+    バッチ分のタグ選択結果（CSR形式の配列）
+
+    i 枚目の画像のタグは indices[offsets[i]:offsets[i + 1]]、スコアは同じ範囲の scores。
+    各画像内ではスコア降順。タグ名の文字列はここでは作らない。
+    """
+
+    def __init__(self, indices, scores, offsets):
+        self.indices = indices
+        self.scores = scores
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def row(self, i):
+        """i 枚目の (タグインデックス配列, スコア配列)"""
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.indices[start:stop], self.scores[start:stop]
+
+
+class TagPostprocessor:
+    """
+    確率のバッチ (N, タグ数) を閾値・上位k件でまとめて絞り込む
+
+    閾値はタグごとの配列として持つので、カテゴリ別の閾値（general / character / rating）
+    も1回の比較で適用できる。
+    """
+
+    def __init__(self, labels, categories=None, threshold=0.35, category_thresholds=None, top_k=None):
+        """
+        Args:
+            labels (list): タグ名のリスト
+            categories (np.ndarray): タグごとのカテゴリ値（省略時は全て general）
+            threshold (float): 既定の閾値
+            category_thresholds (dict): カテゴリ名（TAG_CATEGORIES のキー）または値 → 閾値
+            top_k (int): 1画像あたりの最大タグ数（None なら制限なし）
+        """
+        self.labels = labels
+        self.top_k = top_k
+        self.thresholds = np.full(len(labels), threshold, dtype=np.float32)
+
+        if category_thresholds:
+            if categories is None:
+                categories = np.full(len(labels), TAG_CATEGORIES['general'], dtype=np.int16)
+            for category, value in category_thresholds.items():
+                if value is None:
+                    continue
+                category = TAG_CATEGORIES.get(category, category)
+                self.thresholds[categories == category] = value
+
+    def process(self, probs):
+        """
+        Args:
+            probs (np.ndarray): (N, タグ数) の確率
+
+        Returns:
+            TagSelection: 画像ごとの閾値以上のタグ（スコア降順、top_k件まで）
+        """
+        probs = np.asarray(probs)
+        batch_count, label_count = probs.shape
+
+        if self.top_k is not None and self.top_k < label_count:
+            # 各行の上位k件だけを候補にしてから閾値を適用
+            candidates = np.argpartition(-probs, self.top_k - 1, axis=1)[:, :self.top_k]
+            candidate_scores = np.take_along_axis(probs, candidates, axis=1)
+            rows, positions = np.nonzero(candidate_scores >= self.thresholds[candidates])
+            cols = candidates[rows, positions]
+        else:
+            rows, cols = np.nonzero(probs >= self.thresholds)
+
+        scores = probs[rows, cols]
+        # 画像順 → スコア降順 → タグ順（同点時の並びを固定）
+        order = np.lexsort((cols, -scores, rows))
+        offsets = np.zeros(batch_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=batch_count), out=offsets[1:])
+
+        return TagSelection(cols[order].astype(np.int32), scores[order].astype(np.float32), offsets)
+
+    def tags(self, indices, scores):
+        """インデックス配列をタグ名に変換（書き出し時に呼ぶ）"""
+        labels = self.labels
+        return [(labels[i], score) for i, score in zip(indices.tolist(), scores.tolist())]
+
+
+class TaggerEngine:
+    """
+    バッチ推論エンジン
+
+    使い方:
+        engine = TaggerEngine('tagger_data', batch_size=8)
+        for img_path, probs, error in engine.run(find_images('images')):
+            ...
+    """
+
+    def __init__(self, model_dir='tagger_data', batch_size=8, use_gpu=False,
+                 prefetch=2, decode_workers=None, use_processes=False,
+                 use_cache=False, cache_path=None, session_profile='default', threads=None,
+                 precision='fp32', preprocess='pad', cache_optimized=False):
+        """
+        Args:
+            model_dir (str): model.onnx と selected_tags.csv のあるディレクトリ
+            batch_size (int): 1回の推論にまとめる画像数
+            use_gpu (bool): CUDAを優先して使う
+            prefetch (int): 先読みしておくバッチ数（メモリ使用量の上限）
+            decode_workers (int): デコードの並列数（省略時はスレッドならCPUコア数と
+                batch_sizeの小さい方、プロセスならCPUコア数）
+            use_processes (bool): Trueの場合、デコード・リサイズをプロセスプールで行い
+                共有メモリ経由で受け渡す（GILの影響を受けない）
+            use_cache (bool): 画像の内容ハッシュで推論結果をキャッシュする
+            cache_path (str): キャッシュファイルのパス（省略時は model_dir 内）
+            session_profile (str): onnx_session.SESSION_PROFILES のキー
+            threads (int): 推論スレッド数（intra-op。省略時はプロファイルの値）
+            precision (str): 'fp32' または 'int8'（動的量子化したモデルを使う）
+            preprocess (str): 'pad'（縦横比を保って余白を埋める）または 'stretch'（引き伸ばす）
+            cache_optimized (bool): 最適化済みモデルを保存・再利用する（onnx_session.create_session）
+        """
+        if precision not in MODEL_FILENAMES:
+            raise ValueError(f"不明な精度: {precision}（{', '.join(MODEL_FILENAMES)}）")
+        if preprocess not in PREPROCESS_MODES:
+            raise ValueError(f"不明な前処理: {preprocess}（{', '.join(PREPROCESS_MODES)}）")
+        self.preprocess = preprocess
+        self.precision = precision
+        self.model_path = os.path.join(model_dir, MODEL_FILENAMES[precision])
+        if precision != 'fp32' and not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"量子化モデルがありません: {self.model_path}"
+                f"（python quantize_model.py quantize --model_dir {model_dir} で作成してください）")
+        self.csv_path = os.path.join(model_dir, "selected_tags.csv")
+
+        print(f"タグ定義を読み込み中... {self.csv_path}")
+        self.labels, self.categories = load_tag_table(self.csv_path)
+
+        print(f"モデルをロード中... {self.model_path}")
+        # 同じプロセスで同じモデルを再度使う場合は作成済みのセッションを共有
+        self.session = get_session(self.model_path, use_gpu, session_profile, cache_optimized,
+                                   intra_op_threads=threads)
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.output_name = self.session.get_outputs()[0].name
+        self.input_shape = model_input.shape
+
+        # NCHW (batch, 3, H, W) か NHWC (batch, H, W, 3) か
+        self.channels_first = len(self.input_shape) == 4 and self.input_shape[1] == 3
+        spatial = self.input_shape[2:4] if self.channels_first else self.input_shape[1:3]
+        if len(spatial) == 2 and all(isinstance(dim, int) and dim > 0 for dim in spatial):
+            self.target_size = (spatial[1], spatial[0])
+        else:
+            self.target_size = DEFAULT_TARGET_SIZE
+
+        # バッチ次元が固定のモデルはその数までしかまとめられない
+        fixed_batch = self.input_shape[0] if self.input_shape else None
+        if isinstance(fixed_batch, int) and fixed_batch > 0:
+            batch_size = min(batch_size, fixed_batch)
+
+        self.batch_size = max(1, batch_size)
+        self.prefetch = max(1, prefetch)
+        self.use_processes = use_processes
+        if decode_workers is None:
+            cpu_count = os.cpu_count() or 1
+            decode_workers = cpu_count if use_processes else min(cpu_count, self.batch_size)
+        self.decode_workers = max(1, decode_workers)
+
+        self.cache = None
+        if use_cache:
+            try:
+                self.cache = TaggingCache(cache_path or os.path.join(model_dir, CACHE_FILENAME))
+                self.cache_key = self.cache.model_key(
+                    self.model_path, f'{PREPROCESS_VERSION}:{preprocess}:{self.target_size[0]}x{self.target_size[1]}')
+            except (sqlite3.Error, OSError) as e:
+                # 読み取り専用のディレクトリなどではキャッシュなしで続行
+                print(f"キャッシュを使用できません（キャッシュなしで続行）: {e}")
+                if self.cache is not None:
+                    self.cache.close()
+                self.cache = None
+
+    def close(self):
+        """キャッシュを閉じる"""
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def infer(self, batch_array):
+        """(N, H, W, C) の配列を推論し、(N, タグ数) の確率を返す"""
+        if self.channels_first:
+            batch_array = np.transpose(batch_array, (0, 3, 1, 2))
+        return self.session.run([self.output_name], {self.input_name: batch_array})[0]
+
+    def postprocessor(self, threshold=0.35, category_thresholds=None, top_k=None):
+        """このモデルのタグ定義に合わせた TagPostprocessor を作成"""
+        return TagPostprocessor(self.labels, self.categories, threshold, category_thresholds, top_k)
+
+    def run(self, image_paths):
+        """
+        画像をバッチ推論し、入力順に結果を返す
+
+        Args:
+            image_paths (list): 画像ファイルのパス
+
+        Yields:
+            tuple: (img_path, probs, error)
+                成功時は probs が確率ベクトル、error が None
+                失敗時は probs が None、error が例外
+        """
+        return _iter_images(self.run_batches(image_paths))
+
+    def tag(self, image_paths, postprocessor):
+        """
+        画像をバッチ推論し、バッチ単位で閾値・上位k件を適用して入力順に返す
+
+        Yields:
+            tuple: (img_path, indices, scores, error)
+                indices はタグインデックス、scores はスコア（いずれもスコア降順の配列）。
+                タグ名は postprocessor.tags(indices, scores) で取得する。
+        """
+        for batch_paths, probs, rows, errors in self.run_batches(image_paths):
+            selection = postprocessor.process(probs) if probs is not None else None
+            for img_path, row, error in zip(batch_paths, rows, errors):
+                if error is not None:
+                    yield img_path, None, None, error
+                else:
+                    indices, scores = selection.row(row)
+                    yield img_path, indices, scores, None
+
+    def run_batches(self, image_paths):
+        """
+        バッチ単位の推論結果を返す
+
+        Yields:
+            tuple: (batch_paths, probs, rows, errors)
+                probs は成功した画像分の (M, タグ数) の確率（全て失敗なら None）
+                rows[i] は i 枚目の probs 内の行番号、errors[i] は失敗時の例外
+        """
+        if self.cache is not None:
+            yield from self._run_cached_batches(image_paths)
+        else:
+            yield from self._run_batches(image_paths)
+
+    def _run_cached_batches(self, image_paths):
+        """キャッシュにない画像だけを推論し、キャッシュ済みの結果と入力順に合わせて返す"""
+        with ThreadPoolExecutor(max_workers=self.decode_workers) as pool:
+            hashes = list(pool.map(_hash_safely, image_paths))
+        cached = self.cache.contains(self.cache_key, hashes)
+        misses = [img_path for img_path, image_hash in zip(image_paths, hashes)
+                  if image_hash not in cached]
+        print(f"キャッシュ: {len(image_paths) - len(misses)}件ヒット / {len(misses)}件を推論")
+
+        inferred = _iter_images(self._run_batches(misses))
+        for start in range(0, len(image_paths), self.batch_size):
+            batch_paths = image_paths[start:start + self.batch_size]
+            batch_hashes = hashes[start:start + self.batch_size]
+            hits = self.cache.load(self.cache_key, [h for h in batch_hashes if h in cached])
+
+            vectors = []
+            rows = []
+            errors = []
+            records = []
+            for image_hash in batch_hashes:
+                if image_hash in cached:
+                    probs, error = hits[image_hash], None
+                else:
+                    _, probs, error = next(inferred)
+                    if error is None and image_hash is not None:
+                        records.append((image_hash, probs))
+                rows.append(None if error is not None else len(vectors))
+                errors.append(error)
+                if error is None:
+                    vectors.append(probs)
+
+            if records:
+                self.cache.store(self.cache_key, records)
+            yield batch_paths, np.stack(vectors) if vectors else None, rows, errors
+
+    def _run_batches(self, image_paths):
+        """全画像をデコードしてバッチ推論"""
+        for batch_paths, batch_array, errors in self.iter_decoded_batches(image_paths):
+            ok = [i for i, error in enumerate(errors) if error is None]
+
+            probs = None
+            if ok:
+                try:
+                    probs = self.infer(batch_array if len(ok) == len(errors) else batch_array[ok])
+                except Exception as e:
+                    errors = [error or e for error in errors]
+            # バッファは次のバッチのデコードに再利用されるため参照を残さない
+            batch_array = None
+
+            rows = [None] * len(batch_paths)
+            for n, i in enumerate(ok):
+                rows[i] = n
+            yield batch_paths, probs, rows, errors
+
+    def iter_decoded_batches(self, image_paths):
+        """
+        デコード済みバッチを入力順に返す
+
+        (prefetch + 1) 個のバッチバッファを事前に確保し、別スレッドのプロデューサーが
+        空いたバッファへデコードを割り当てる。デコードはプール内で並行して進み、
+        完了したバッチから順番にキューへ渡す。呼び出し側が次のバッチを要求した時点で
+        前のバッファは空きに戻るので、メモリ使用量はフォルダの大きさに関係なく一定。
+
+        Yields:
+            tuple: (batch_paths, batch_array, errors)
+                batch_array は (len(batch_paths), H, W, C) のバッファ（次の要求まで有効）
+                errors はデコード失敗時の例外（成功は None）。失敗した行の内容は不定
+        """
+        width, height = self.target_size
+        shape = (self.prefetch + 1, self.batch_size, height, width, 3)
+        if self.use_processes:
+            shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+            buffers = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        else:
+            shm = None
+            buffers = np.empty(shape, dtype=np.float32)
+
+        free_slots = queue.Queue()
+        for slot in range(shape[0]):
+            free_slots.put(slot)
+        batches = queue.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def take_slot():
+            while not stop.is_set():
+                try:
+                    return free_slots.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return None
+
+        def submit(pool, slot, index, img_path):
+            if shm is not None:
+                return pool.submit(_decode_into_shared, shm.name, shape, slot, index,
+                                   img_path, self.target_size, self.preprocess)
+            return pool.submit(_decode_into, buffers[slot], index, img_path, self.target_size,
+                               self.preprocess)
+
+        def emit(pending):
+            batch_paths, slot, futures = pending.popleft()
+            batches.put((batch_paths, slot, [_future_error(f) for f in futures]))
+
+        def producer():
+            executor = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+            pending = deque()
+            try:
+                with executor(max_workers=self.decode_workers) as pool:
+                    for start in range(0, len(image_paths), self.batch_size):
+                        # 空きバッファがなければ、最も古いバッチの完了を待って渡す
+                        while free_slots.empty() and pending:
+                            emit(pending)
+                        slot = take_slot()
+                        if slot is None:
+                            return
+                        batch_paths = image_paths[start:start + self.batch_size]
+                        pending.append((batch_paths, slot, [
+                            submit(pool, slot, i, img_path) for i, img_path in enumerate(batch_paths)
+                        ]))
+                    while pending and not stop.is_set():
+                        emit(pending)
+            except Exception as e:
+                batches.put(e)
+            finally:
+                batches.put(done)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                batch_paths, slot, errors = item
+                yield batch_paths, buffers[slot][:len(batch_paths)], errors
+                free_slots.put(slot)
+        finally:
+            stop.set()
+            thread.join()
+            buffers = None
+            if shm is not None:
+                shm.unlink()
+                try:
+                    shm.close()
+                except BufferError:
+                    # 呼び出し側がまだバッファを参照している場合は、参照が消えた時点で解放される
+                    pass
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+複数プロセスでのタグ付け（タガーファーム）
+1つのONNXセッションでは多コアのマシンを使い切れないため、ワーカープロセスを
+N個起動し、それぞれが1スレッド設定（worker プロファイル）のセッションで推論する。
+
+画像パスは共有キューにチャンク（数バッチ分）単位で入れ、空いたワーカーから取り出す。
+結果は親プロセスに集め、書き込みは親プロセスだけが行う（タグストアへの追記は1か所）。
+
+使い方:
+    farm = TaggerFarm('tagger_data', workers=16)
+    postprocessor = farm.postprocessor(threshold=0.35)
+    for img_path, indices, scores, error in farm.tag(image_files, postprocessor):
+        ...
+    print(farm.images_per_second)
+
+labels / categories / model_path / postprocessor() は TaggerEngine と同じなので、
+タガーの各フロントエンドでは --workers N を指定したときに TaggerEngine の代わりに使う。
+"""
+
+import os
+import time
+import queue
+import multiprocessing
+from tagger_engine import MODEL_FILENAMES, TaggerEngine, TagPostprocessor, load_tag_table
+
+# 1回に取り出す画像数（バッチ数）。大きいほどキューの往復が減り、小さいほど負荷が均等になる
+CHUNK_BATCHES = 4
+
+# ワーカーの状態を確認する間隔（秒）
+POLL_INTERVAL = 1.0
+
+
+def _worker(worker_id, model_dir, engine_options, postprocessor, tasks, results):
+    """ワーカープロセス: キューからチャンクを取り出してタグ付けし、チャンク単位で結果を返す"""
+    try:
+        engine = TaggerEngine(model_dir, **engine_options)
+    except Exception as e:
+        results.put(('failed', worker_id, f"{type(e).__name__}: {e}"))
+        return
+    results.put(('ready', worker_id))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        chunk_id, chunk = task
+        results.put(('start', worker_id, chunk_id))
+        rows = []
+        for img_path, indices, scores, error in engine.tag(chunk, postprocessor):
+            # 例外はプロセス間で受け渡せない場合があるため文字列にする
+            rows.append((img_path, indices, scores,
+                         None if error is None else f"{type(error).__name__}: {error}"))
+        results.put(('chunk', worker_id, chunk_id, rows))
+    results.put(('done', worker_id))
+
+
+class TaggerFarm:
+    """
+    ワーカープロセスでタグ付けを並列実行
+
+    キャッシュは使わない（複数プロセスからの同時書き込みを避けるため）。
+    """
+
+    def __init__(self, model_dir='tagger_data', workers=None, batch_size=8, threads=1,
+                 use_gpu=False, precision='fp32', preprocess='pad', cache_optimized=False):
+        """
+        Args:
+            model_dir (str): model.onnx と selected_tags.csv のあるディレクトリ
+            workers (int): ワーカープロセス数（省略時はCPUコア数）
+            batch_size (int): 1回の推論にまとめる画像数
+            threads (int): ワーカー1つあたりの推論スレッド数
+            use_gpu (bool): CUDAを優先して使う
+            precision (str): 'fp32' または 'int8'
+            preprocess (str): 'pad' または 'stretch'
+            cache_optimized (bool): 最適化済みモデルを保存・再利用する（最初のワーカーだけが保存する）
+        """
+        if precision not in MODEL_FILENAMES:
+            raise ValueError(f"不明な精度: {precision}（{', '.join(MODEL_FILENAMES)}）")
+        self.model_dir = model_dir
+        self.model_path = os.path.join(model_dir, MODEL_FILENAMES[precision])
+        # モデルは各ワーカーでロードし、このプロセスはタグ定義だけを使う
+        self.labels, self.categories = load_tag_table(os.path.join(model_dir, "selected_tags.csv"))
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.batch_size = max(1, batch_size)
+        self.engine_options = {
+            'batch_size': self.batch_size, 'use_gpu': use_gpu, 'prefetch': 1, 'decode_workers': 1,
+            'session_profile': 'worker', 'threads': threads, 'precision': precision,
+            'preprocess': preprocess, 'cache_optimized': cache_optimized,
+        }
+        self.images = 0
+        self.elapsed = 0.0
+
+    def postprocessor(self, threshold=0.35, category_thresholds=None, top_k=None):
+        """このモデルのタグ定義に合わせた TagPostprocessor を作成（TaggerEngine.postprocessor と同じ）"""
+        return TagPostprocessor(self.labels, self.categories, threshold, category_thresholds, top_k)
+
+    def close(self):
+        """TaggerEngine と同じ使い方ができるように用意（ワーカーは tag() の終わりに終了している）"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def images_per_second(self):
+        """直前の tag() 全体での処理速度（画像/秒）"""
+        return self.images / self.elapsed if self.elapsed else 0.0
+
+    def tag(self, image_paths, postprocessor):
+        """
+        画像をワーカーでタグ付けし、終わったチャンクから順に返す（入力順ではない）
+
+        Yields:
+            tuple: (img_path, indices, scores, error)  TaggerEngine.tag と同じ形式。
+                error は失敗時の RuntimeError
+        """
+        chunk_size = self.batch_size * CHUNK_BATCHES
+        chunks = [image_paths[start:start + chunk_size] for start in range(0, len(image_paths), chunk_size)]
+        workers = min(self.workers, len(chunks))
+        if not workers:
+            return
+
+        # Windows / macOS と同じ spawn で起動（ONNXランタイムのスレッドを fork で複製しない）
+        context = multiprocessing.get_context('spawn')
+        tasks = context.Queue()
+        results = context.Queue()
+        for task in enumerate(chunks):
+            tasks.put(task)
+        for _ in range(workers):
+            tasks.put(None)
+
+        def start(worker_id):
+            process = context.Process(target=_worker, daemon=True, args=(
+                worker_id, self.model_dir, self.engine_options, postprocessor, tasks, results))
+            process.start()
+            processes[worker_id] = process
+
+        def start_rest():
+            for worker_id in range(len(processes), workers):
+                start(worker_id)
+
+        start_time = time.perf_counter()
+        self.images = 0
+        processes = {}    # ワーカーID → Process
+        running = {}      # ワーカーID → 処理中のチャンクID
+        finished = set()  # 終了した（または異常終了した）ワーカー
+        completed = set()  # 結果を返したチャンクID
+        ready = 0
+
+        # 最初のワーカーでモデルの最適化結果を保存してから残りを起動（同じファイルへの同時書き込みを避ける）
+        start(0)
+        try:
+            while len(finished) < workers:
+                try:
+                    message = results.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    # 結果を返さずに終了したワーカー（メモリ不足など）の処理中チャンクは失敗扱い
+                    for worker_id, process in list(processes.items()):
+                        if worker_id not in finished and not process.is_alive():
+                            finished.add(worker_id)
+                            start_rest()
+                            chunk_id = running.pop(worker_id, None)
+                            if chunk_id is not None:
+                                completed.add(chunk_id)
+                                error = RuntimeError(f"ワーカー{worker_id}が異常終了しました (exitcode={process.exitcode})")
+                                for img_path in chunks[chunk_id]:
+                                    yield img_path, None, None, error
+                    continue
+
+                kind, worker_id = message[0], message[1]
+                if kind in ('ready', 'failed'):
+                    start_rest()
+                if kind == 'ready':
+                    ready += 1
+                elif kind == 'failed':
+                    print(f"ワーカー{worker_id}を起動できません: {message[2]}")
+                    finished.add(worker_id)
+                    if len(finished) == workers and not ready:
+                        raise RuntimeError(f"全てのワーカーの起動に失敗しました: {message[2]}")
+                elif kind == 'start':
+                    running[worker_id] = message[2]
+                elif kind == 'chunk':
+                    running.pop(worker_id, None)
+                    completed.add(message[2])
+                    for img_path, indices, scores, error in message[3]:
+                        if error is None:
+                            self.images += 1
+                            yield img_path, indices, scores, None
+                        else:
+                            yield img_path, None, None, RuntimeError(error)
+                elif kind == 'done':
+                    finished.add(worker_id)
+
+            # 全てのワーカーが異常終了した場合、キューに残ったチャンクも失敗扱い
+            error = RuntimeError("処理できるワーカーが残っていません")
+            for chunk_id, chunk in enumerate(chunks):
+                if chunk_id not in completed:
+                    for img_path in chunk:
+                        yield img_path, None, None, error
+        finally:
+            self.elapsed = time.perf_counter() - start_time
+            for process in processes.values():
+                if process.is_alive():
+                    process.terminate()
+                process.join()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+タグ付け結果キャッシュ
+画像の内容ハッシュ（SHA-256）ごとにモデルの出力確率をSQLiteへ保存し、
+同じ画像の再推論を省略する。閾値やカテゴリの設定を変えても推論は不要。
+"""
+
+import os
+import hashlib
+import sqlite3
+import numpy as np
+
+# キャッシュファイル名（タガーの --cache で PATH を省略した場合は出力ディレクトリ内に作成）
+CACHE_FILENAME = '.tagging_cache.sqlite'
+
+# この値未満の確率は保存しない（0 とみなす）。None の場合は全タグを保存
+DEFAULT_FLOOR = 0.01
+
+# SQLiteのプレースホルダ数の上限を超えないよう、IN句はこの件数ずつ問い合わせる
+QUERY_CHUNK = 500
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """ファイル内容のSHA-256（16進）。dictionaries/learned_tags.json の画像キーと同じ形式"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TaggingCache:
+    """
+    画像内容ハッシュ → 確率ベクトルのキャッシュ
+
+    キーは (画像のSHA-256, モデルキー)。モデルキーにはモデルファイルのハッシュ・
+    前処理のバージョン・保存時の floor を含めるので、どれかが変われば別エントリになる。
+    確率は floor 以上のものだけを (インデックス int32, 値 float16) の疎形式で保存する。
+    floor 未満の確率は 0 として復元されるため、floor より低い閾値では結果が変わる。
+    """
+
+    def __init__(self, cache_path, floor=DEFAULT_FLOOR):
+        self.cache_path = cache_path
+        self.floor = floor
+        self.conn = sqlite3.connect(cache_path)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS probs ('
+                ' image_hash TEXT NOT NULL,'
+                ' model_key TEXT NOT NULL,'
+                ' label_count INTEGER NOT NULL,'
+                ' indices BLOB,'
+                ' scores BLOB NOT NULL,'
+                ' PRIMARY KEY (image_hash, model_key))')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS models ('
+                ' path TEXT PRIMARY KEY,'
+                ' mtime_ns INTEGER NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' sha256 TEXT NOT NULL)')
+
+    def model_key(self, model_path, preprocess_key):
+        """
+        モデルファイルと前処理の組み合わせを表すキー
+
+        モデルのハッシュ計算は大きなファイルでは時間がかかるため、
+        パス・更新時刻・サイズが同じ間は保存済みの値を使う。
+        """
+        path = os.path.abspath(model_path)
+        stat = os.stat(path)
+        row = self.conn.execute(
+            'SELECT mtime_ns, size, sha256 FROM models WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[:2] == (stat.st_mtime_ns, stat.st_size):
+            model_hash = row[2]
+        else:
+            model_hash = file_sha256(path)
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO models (path, mtime_ns, size, sha256) VALUES (?, ?, ?, ?)',
+                    (path, stat.st_mtime_ns, stat.st_size, model_hash))
+        return f'{model_hash}:{preprocess_key}:floor={self.floor}'
+
+    def _select(self, columns, model_key, image_hashes):
+        hashes = list(dict.fromkeys(h for h in image_hashes if h))
+        for start in range(0, len(hashes), QUERY_CHUNK):
+            chunk = hashes[start:start + QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            yield from self.conn.execute(
+                f'SELECT {columns} FROM probs WHERE model_key = ? AND image_hash IN ({placeholders})',
+                [model_key, *chunk])
+
+    def contains(self, model_key, image_hashes):
+        """キャッシュ済みの画像ハッシュの集合"""
+        return {image_hash for (image_hash,) in self._select('image_hash', model_key, image_hashes)}
+
+    def load(self, model_key, image_hashes):
+        """
+        Returns:
+            dict: 画像ハッシュ → float32 の確率ベクトル
+        """
+        loaded = {}
+        for image_hash, label_count, indices, scores in self._select(
+                'image_hash, label_count, indices, scores', model_key, image_hashes):
+            values = np.frombuffer(scores, dtype=np.float16).astype(np.float32)
+            if indices is None:
+                loaded[image_hash] = values
+            else:
+                probs = np.zeros(label_count, dtype=np.float32)
+                probs[np.frombuffer(indices, dtype=np.int32)] = values
+                loaded[image_hash] = probs
+        return loaded
+
+    def store(self, model_key, records):
+        """
+        確率ベクトルをまとめて保存（1トランザクション）
+
+        Args:
+            records (iterable): (画像ハッシュ, 確率ベクトル) のイテラブル
+        """
+        rows = []
+        for image_hash, probs in records:
+            probs = np.asarray(probs, dtype=np.float32)
+            if self.floor is None:
+                indices = None
+                scores = probs.astype(np.float16).tobytes()
+            else:
+                kept = np.nonzero(probs >= self.floor)[0].astype(np.int32)
+                indices = kept.tobytes()
+                scores = probs[kept].astype(np.float16).tobytes()
+            rows.append((image_hash, model_key, len(probs), indices, scores))
+
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO probs (image_hash, model_key, label_count, indices, scores) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmark_preprocess.py のテスト（速度計測と従来の前処理とのタグ一致度）
+"""
+
+import pytest
+
+pytest.importorskip('onnx')
+
+from benchmark_preprocess import BASELINE, VARIANTS, benchmark, make_synthetic_images
+from test_tagger_engine import make_model_dir
+
+
+def test_benchmark_report(tmp_path):
+    """全ての前処理を計測し、従来の方法自身との一致度は 1.0 になる"""
+    model_dir = make_model_dir(tmp_path)
+    img_dir = tmp_path / 'images'
+    img_dir.mkdir()
+    image_files = make_synthetic_images(str(img_dir), 3, (1200, 1800))
+
+    report = benchmark(image_files, model_dir=model_dir, threshold=0.5, batch_size=2)
+
+    assert report['images'] == 3
+    assert list(report['variants']) == list(VARIANTS)
+    assert report['variants'][BASELINE]['micro_f1'] == 1.0
+    assert report['variants'][BASELINE]['max_abs_prob_diff'] == 0.0
+    assert report['variants']['pad_draft']['mean_abs_pixel_diff_vs_full'] < 0.01
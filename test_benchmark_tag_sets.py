@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmark_tag_sets.py のテスト（従来の方法との時間・スコアの比較）
+"""
+
+from benchmark_tag_sets import benchmark
+
+
+def test_benchmark_report():
+    """ベンチマークは従来の方法と同じスコア・同じセットになる"""
+    report = benchmark([200, 400], legacy_max=200)
+    small, large = report['results']
+    assert small['identical'] and small['legacy_mean_score'] == small['greedy_mean_score']
+    assert 'legacy_seconds' not in large and large['greedy_seconds'] >= 0
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmark_tagger.py のテスト（再現可能なコーパス・ダミーモデルでのシナリオ実行）
+"""
+
+import json
+import pytest
+
+pytest.importorskip('onnx')
+
+from benchmark_tagger import make_corpus, run_benchmark
+from tagging_cache import file_sha256
+from tagger_engine import find_images
+
+SMALL_SIZES = [(320, 240), (200, 300)]
+
+
+def test_corpus_is_deterministic(tmp_path):
+    """同じ枚数・シードなら同じ画像、形式は jpg / png / webp が混在"""
+    first = make_corpus(str(tmp_path / 'a'), 6, sizes=SMALL_SIZES)
+    second = make_corpus(str(tmp_path / 'b'), 6, sizes=SMALL_SIZES)
+
+    assert first == second
+    assert first['formats'] == {'jpg': 2, 'png': 2, 'webp': 2}
+    assert ([file_sha256(path) for path in find_images(str(tmp_path / 'a'))] ==
+            [file_sha256(path) for path in find_images(str(tmp_path / 'b'))])
+
+
+def test_run_benchmark_report(tmp_path):
+    """エンジンと入口のシナリオを別プロセスで実行し、速度・レイテンシ・RSSをJSONにまとめる"""
+    report = run_benchmark(['engine_b8', 'eva02_tagger_store'], images=6, work_dir=str(tmp_path),
+                           sizes=SMALL_SIZES)
+
+    assert report['model']['dummy']
+    engine, entry = report['results']
+    assert engine['name'] == 'engine_b8' and engine['images'] == 6
+    assert engine['images_per_second'] > 0
+    assert set(engine['latency_ms']) == {'p50', 'p95'}
+    assert engine['peak_rss_mb'] > 0
+    assert entry['kind'] == 'entry' and entry['images'] == 6
+    assert set(entry['latency_ms']) == {'p50', 'p95'}
+    assert (tmp_path / 'eva02_tagger_store' / 'tags.tagstore').exists()
+    json.dumps(report)
+
+    with pytest.raises(ValueError):
+        run_benchmark(['unknown'], images=1, work_dir=str(tmp_path))
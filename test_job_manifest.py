@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+job_manifest.py のテスト（続きからの再開・失敗画像の再処理・不完全な末尾行）
+"""
+
+import os
+import pytest
+from PIL import Image
+from job_manifest import MANIFEST_FILENAME, JobManifest
+
+
+def make_files(tmp_path, count=3):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"img_{i}.png"
+        path.write_bytes(b'x' * (i + 1))
+        paths.append(str(path))
+    return paths
+
+
+def test_resume_and_retry_failed(tmp_path):
+    """記録済みの画像は飛ばし、retry_failed では失敗した画像だけを返す"""
+    paths = make_files(tmp_path)
+    with JobManifest(str(tmp_path), job={'threshold': 0.35}) as manifest:
+        assert manifest.pending(paths) == paths
+        manifest.mark_done(paths[0], ['out/img_0.txt'])
+        manifest.mark_failed(paths[1], OSError('broken'))
+
+    with JobManifest(str(tmp_path), job={'threshold': 0.35}) as manifest:
+        assert manifest.pending(paths) == [paths[2]]
+        assert manifest.pending(paths, retry_failed=True) == [paths[1]]
+        assert manifest.failed() == {paths[1]: 'OSError: broken'}
+        manifest.mark_done(paths[1], ['out/img_1.txt'])
+
+    with JobManifest(str(tmp_path), job={'threshold': 0.35}) as manifest:
+        assert manifest.pending(paths, retry_failed=True) == []
+        assert manifest.failed() == {}
+
+
+def test_changed_image_or_job_is_reprocessed(tmp_path):
+    """画像が変わった場合、ジョブの設定が変わった場合、restart の場合は再処理する"""
+    paths = make_files(tmp_path)
+    with JobManifest(str(tmp_path), job={'threshold': 0.35}) as manifest:
+        for path in paths:
+            manifest.mark_done(path, [])
+
+    with open(paths[0], 'ab') as f:
+        f.write(b'more')
+    with JobManifest(str(tmp_path), job={'threshold': 0.35}) as manifest:
+        assert manifest.pending(paths) == [paths[0]]
+    with JobManifest(str(tmp_path), job={'threshold': 0.35}, restart=True) as manifest:
+        assert manifest.pending(paths) == paths
+        manifest.mark_done(paths[0], [])
+    with JobManifest(str(tmp_path), job={'threshold': 0.5}) as manifest:
+        assert manifest.pending(paths) == paths
+
+
+def test_torn_tail_is_ignored_and_truncated(tmp_path):
+    """書き込み途中で終了した末尾の行は無視し、次の追記で切り詰める"""
+    paths = make_files(tmp_path)
+    with JobManifest(str(tmp_path)) as manifest:
+        manifest.mark_done(paths[0], [])
+    manifest_path = tmp_path / MANIFEST_FILENAME
+    with open(manifest_path, 'ab') as f:
+        f.write(b'{"path": "img_1.png", "sta')
+
+    with JobManifest(str(tmp_path)) as manifest:
+        assert manifest.pending(paths) == paths[1:]
+        manifest.mark_done(paths[1], [])
+    with JobManifest(str(tmp_path)) as manifest:
+        assert manifest.pending(paths) == paths[2:]
+    assert all(line.endswith('}') for line in manifest_path.read_text(encoding='utf-8').splitlines())
+
+
+def test_categorized_tagger_resumes(tmp_path):
+    """eva02_tagger_categorized は再実行時に処理済みの画像を飛ばし、失敗した画像を記録する"""
+    pytest.importorskip('onnx')
+    import eva02_tagger_categorized
+    from test_tagger_engine import make_images, make_model_dir
+
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+    out_dir = tmp_path / 'out'
+
+    assert eva02_tagger_categorized.tag_images(img_dir, str(out_dir), model_dir, threshold=0.5, use_cache=False)
+    with open(out_dir / MANIFEST_FILENAME, encoding='utf-8') as f:
+        assert '"status": "error"' in f.read()
+
+    # 出力を消しても、処理済みの画像は再実行で作り直さない
+    os.remove(out_dir / 'a_red.txt')
+    assert eva02_tagger_categorized.tag_images(img_dir, str(out_dir), model_dir, threshold=0.5, use_cache=False)
+    assert not (out_dir / 'a_red.txt').exists()
+
+    # 画像を直してから、失敗した画像だけを再処理する
+    broken = os.path.join(img_dir, 'f_broken.jpg')
+    os.remove(broken)
+    Image.new('RGB', (64, 64), (250, 10, 10)).save(broken, format='JPEG')
+    assert eva02_tagger_categorized.tag_images(img_dir, str(out_dir), model_dir, threshold=0.5,
+                                               use_cache=False, retry_failed=True)
+    assert (out_dir / 'f_broken.txt').exists()
+    assert not (out_dir / 'a_red.txt').exists()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+onnx_session.py のテスト（最適化済みモデルの保存・再利用、セッションの共有）
+"""
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('onnx')
+
+from onnx_session import (OPTIMIZED_DIRNAME, create_session, get_session,
+                          optimized_model_path, session_settings)
+from test_tagger_engine import make_model_dir
+
+
+def test_session_settings_profiles():
+    """プロファイルに個別指定を上書き（None は無視）"""
+    worker = session_settings('worker')
+    assert worker['intra_op_threads'] == 1 and not worker['allow_spinning']
+    assert session_settings('worker', intra_op_threads=2, inter_op_threads=None)['intra_op_threads'] == 2
+    assert session_settings('default')['execution_mode'] == 'sequential'
+    with pytest.raises(ValueError):
+        session_settings('unknown')
+    with pytest.raises(ValueError):
+        session_settings('default', threads=2)
+
+
+def test_optimized_model_is_saved_and_reused(tmp_path):
+    """1回目に最適化済みモデルを保存し、2回目はそれを読み込んで同じ結果を返す"""
+    model_path = os.path.join(make_model_dir(tmp_path), 'model.onnx')
+    optimized_path = optimized_model_path(model_path, ['CPUExecutionProvider'])
+    batch = np.random.default_rng(0).random((2, 448, 448, 3), dtype=np.float32)
+
+    first = create_session(model_path, profile='worker', cache_optimized=True)
+    assert os.path.exists(optimized_path)
+    expected = first.run(None, {'input': batch})[0]
+
+    mtime = os.path.getmtime(optimized_path)
+    second = create_session(model_path, cache_optimized=True)
+    assert os.path.getmtime(optimized_path) == mtime
+    np.testing.assert_allclose(second.run(None, {'input': batch})[0], expected, rtol=1e-6)
+
+    # 既定ではキャッシュせず、保存先を作らない
+    other_dir = tmp_path / 'other'
+    other_dir.mkdir()
+    model_copy = other_dir / 'model.onnx'
+    model_copy.write_bytes(open(model_path, 'rb').read())
+    create_session(str(model_copy))
+    assert not (other_dir / OPTIMIZED_DIRNAME).exists()
+
+
+def test_stale_cleanup_keeps_other_models_and_providers(tmp_path):
+    """モデルが変わったときは同じモデル・実行プロバイダの古いファイルだけを置き換える"""
+    model_path = os.path.join(make_model_dir(tmp_path), 'model.onnx')
+    optimized_dir = os.path.join(os.path.dirname(model_path), OPTIMIZED_DIRNAME)
+    os.makedirs(optimized_dir)
+    kept = ['model.int8.cpu.0123456789abcdef.onnx', 'model.cuda-cpu.0123456789abcdef.onnx', 'model.cpu.notes.onnx']
+    for name in kept + ['model.cpu.0123456789abcdef.onnx']:
+        open(os.path.join(optimized_dir, name), 'wb').close()
+
+    create_session(model_path, cache_optimized=True)
+    optimized_path = optimized_model_path(model_path, ['CPUExecutionProvider'])
+    assert sorted(os.listdir(optimized_dir)) == sorted(kept + [os.path.basename(optimized_path)])
+
+
+def test_get_session_reuses_within_process(tmp_path):
+    """同じモデル・設定なら作成済みのセッションを返し、設定が違えば別に作る"""
+    model_path = os.path.join(make_model_dir(tmp_path), 'model.onnx')
+
+    session = get_session(model_path)
+    assert get_session(model_path) is session
+    assert get_session(model_path, profile='worker') is not session
+    assert get_session(model_path, intra_op_threads=2) is not session
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+prompt_classifier.py のタグ正規化・索引テスト
+"""
+
+from keyword_database import CATEGORY_KEYWORDS
+from prompt_classifier import (
+    PromptClassifier, TAG_INDEX, LINE_PROGRESS_INTERVAL, CATEGORIES, CATEGORY_IDS, canonical_tag,
+)
+
+
+def test_canonical_tag_variants():
+    """アンダースコア・重み・強調・エスケープ括弧の正規化"""
+    assert canonical_tag('blue_eyes') == 'blue eyes'
+    assert canonical_tag('  Blue Eyes ') == 'blue eyes'
+    assert canonical_tag('(blue eyes:1.2)') == 'blue eyes'
+    assert canonical_tag('((blue_eyes))') == 'blue eyes'
+    assert canonical_tag('[blue eyes]') == 'blue eyes'
+    assert canonical_tag('bat \\(animal\\)') == 'bat (animal)'
+    assert canonical_tag('(bat (animal):1.1)') == 'bat (animal)'
+    assert canonical_tag(':d') == ':d'
+
+
+def test_classify_tag_uses_index():
+    """表記ゆれがあっても同じカテゴリに分類される"""
+    classifier = PromptClassifier()
+    for tag in ['blue eyes', 'blue_eyes', '(blue eyes:1.2)', 'BLUE_EYES']:
+        assert classifier.classify_tag(tag) == 'characterface'
+    assert classifier.classify_tag('hair_over_one_eye') == 'characterface'
+    assert classifier.classify_tag('hair over one eye') == 'characterface'
+    assert classifier.classify_tag('no such tag') == 'uncategorized'
+
+
+def test_index_covers_keyword_database():
+    """全キーワードが索引に登録され、索引は読み取り専用"""
+    for keywords in CATEGORY_KEYWORDS.values():
+        for keyword in keywords:
+            assert canonical_tag(keyword) in TAG_INDEX
+
+    try:
+        TAG_INDEX['blue eyes'] = 'clothing'
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('TAG_INDEX は変更できてはいけない')
+
+
+def test_classify_stream_is_lazy():
+    """ジェネレータ入力を1行ずつ処理し、空行はスキップする"""
+    classifier = PromptClassifier()
+    consumed = []
+
+    def lines():
+        for line in ["long hair, smile", "", "bikini, unknown tag"]:
+            consumed.append(line)
+            yield line
+
+    stream = classifier.classify_stream(lines())
+    first = next(stream)
+    assert consumed == ["long hair, smile"]
+    assert first[CATEGORY_IDS['characterface']] == ['long hair']
+    assert first[CATEGORY_IDS['poseemotion']] == ['smile']
+
+    second = next(stream)
+    assert second[CATEGORY_IDS['clothing']] == ['bikini']
+    assert second[CATEGORY_IDS['uncategorized']] == ['unknown tag']
+    assert list(stream) == []
+
+
+def test_file_methods_match_classify_prompt(tmp_path):
+    """classify_file / classify_file_for_yaml が行単位の分類と一致する"""
+    classifier = PromptClassifier()
+    lines = ["long hair, blue eyes, smile", "", "short hair, bikini, beach"]
+    file_path = tmp_path / "prompts.txt"
+    file_path.write_text("\n".join(lines), encoding='utf-8')
+
+    expected_yaml = {category: [] for category in CATEGORIES}
+    expected_sets = {category: set() for category in CATEGORIES}
+    for line in lines:
+        if not line:
+            continue
+        for category, tags in classifier.classify_prompt(line).items():
+            if tags:
+                expected_yaml[category].append(', '.join(tags))
+            expected_sets[category].update(tags)
+
+    assert classifier.classify_file_for_yaml(str(file_path)) == expected_yaml
+    assert classifier.classify_file(str(file_path)) == expected_sets
+
+    categorized, total_lines = classifier.classify_files_for_yaml([str(file_path)] * 2)
+    assert total_lines == 4
+    assert categorized['characterface'] == expected_yaml['characterface'] * 2
+
+
+def test_files_for_yaml_reports_progress_within_file(tmp_path):
+    """巨大なファイルでも一定行数ごとに進捗callbackを呼び、そこで中断できる"""
+    file_path = tmp_path / 'big.txt'
+    file_path.write_text('blue eyes, smile\n' * (LINE_PROGRESS_INTERVAL * 2 + 1), encoding='utf-8')
+    calls = []
+    classifier = PromptClassifier()
+    classifier.classify_files_for_yaml([str(file_path)], progress_callback=lambda *args: calls.append(args))
+    assert calls == [
+        (0, 1, str(file_path), LINE_PROGRESS_INTERVAL),
+        (0, 1, str(file_path), LINE_PROGRESS_INTERVAL * 2),
+        (1, 1, str(file_path)),
+    ]
+
+    class Cancelled(Exception):
+        pass
+
+    def cancel(*_):
+        raise Cancelled()
+
+    try:
+        classifier.classify_files_for_yaml([str(file_path)], progress_callback=cancel)
+    except Cancelled:
+        pass
+    else:
+        raise AssertionError('キャンセルされなかった')
+
+
+if __name__ == "__main__":
+    test_canonical_tag_variants()
+    test_classify_tag_uses_index()
+    test_index_covers_keyword_database()
+    test_classify_stream_is_lazy()
+    print("✅ prompt_classifier テスト完了")
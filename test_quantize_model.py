@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+quantize_model.py のテスト（量子化・fp32/int8比較）
+"""
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('onnx')
+
+from quantize_model import compare_outputs, evaluate, quantize_model
+from tagger_engine import MODEL_FILENAMES, TaggerEngine
+from test_tagger_engine import make_images, make_model_dir
+
+
+def test_compare_outputs():
+    """基準の閾値判定を正解としたタグごとの適合率・再現率"""
+    reference = np.array([[0.9, 0.1, 0.6],
+                          [0.8, 0.7, 0.2]], dtype=np.float32)
+    candidate = np.array([[0.9, 0.6, 0.4],
+                          [0.7, 0.7, 0.2]], dtype=np.float32)
+    metrics = compare_outputs(reference, candidate, np.full(3, 0.5, dtype=np.float32))
+
+    assert metrics['tp'].tolist() == [2, 1, 0]
+    assert metrics['fp'].tolist() == [0, 1, 0]
+    assert metrics['fn'].tolist() == [0, 0, 1]
+    assert metrics['precision'].tolist() == [1.0, 0.5, 1.0]
+    assert metrics['recall'].tolist() == [1.0, 1.0, 0.0]
+    assert metrics['micro_precision'] == 0.75
+    assert metrics['micro_recall'] == 0.75
+    assert metrics['max_abs_diff'] == pytest.approx(0.5)
+
+
+def test_quantize_and_evaluate(tmp_path):
+    """量子化モデルを作成し、--int8 相当のエンジンで読み込んで比較できる"""
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+
+    with pytest.raises(FileNotFoundError):
+        TaggerEngine(model_dir, precision='int8')
+
+    output_path = quantize_model(model_dir)
+    assert output_path == os.path.join(model_dir, MODEL_FILENAMES['int8'])
+    assert TaggerEngine(model_dir, precision='int8').model_path == output_path
+
+    report = evaluate(model_dir, img_dir, threshold=0.5, batch_size=2)
+    assert report['images'] == 5
+    assert 0.0 <= report['micro_f1'] <= 1.0
+    assert report['max_abs_prob_diff'] < 0.1
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tag_clustering.py のテスト（合成コーパスのまとまりの復元・並び順・大きさの制限）
+"""
+
+import pytest
+from benchmark_tag_sets import CLUSTER_SIZE, make_file_tags
+from tag_cooccurrence import TagCooccurrence
+from tag_clustering import CLUSTER_BACKENDS, cluster_tags
+
+
+@pytest.fixture(scope='module')
+def cooccurrence():
+    tags, file_tags = make_file_tags(160, seed=0)
+    return TagCooccurrence.from_file_tags(file_tags, tags)
+
+
+def planted(tag):
+    """合成コーパスでのまとまりの番号"""
+    return int(tag.split('_')[1]) // CLUSTER_SIZE
+
+
+@pytest.mark.parametrize('backend, options', [
+    ('components', {'threshold': 2.0}),
+    ('louvain', {}),
+    ('kmedoids', {}),
+])
+def test_recovers_planted_clusters(cooccurrence, backend, options):
+    """上位のセットは合成コーパスの同じまとまりのタグからなり、強さの順に並ぶ"""
+    sets = cluster_tags(cooccurrence, backend, min_size=3, max_size=10, **options)
+    assert sets
+    scores = [score for _, score in sets]
+    assert scores == sorted(scores, reverse=True)
+    assert all(3 <= len(tags) <= 10 for tags, _ in sets)
+
+    top = sets[:5]
+    assert all(len({planted(tag) for tag in tags}) == 1 for tags, _ in top)
+    used = [tag for tags, _ in sets for tag in tags]
+    assert len(used) == len(set(used))
+
+
+def test_louvain_finds_every_cluster(cooccurrence):
+    """Louvain法は全てのまとまりをそのまま見つける"""
+    sets = cluster_tags(cooccurrence, 'louvain', min_size=3, max_size=CLUSTER_SIZE)
+    groups = sorted(sorted(tags) for tags, _ in sets)
+    expected = sorted(sorted(tag for tag in cooccurrence.tags if planted(tag) == number)
+                      for number in range(len(cooccurrence) // CLUSTER_SIZE))
+    assert groups == expected
+
+
+def test_max_size_and_unknown_backend(cooccurrence):
+    """max_size を超えるまとまりは分け、不明なバックエンドは ValueError"""
+    sets = cluster_tags(cooccurrence, 'components', min_size=2, max_size=4, threshold=2.0)
+    assert sets and all(2 <= len(tags) <= 4 for tags, _ in sets)
+    assert set(CLUSTER_BACKENDS) == {'components', 'louvain', 'kmedoids'}
+    with pytest.raises(ValueError):
+        cluster_tags(cooccurrence, 'spectral')
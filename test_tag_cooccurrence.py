@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tag_cooccurrence.py のテスト（辞書による共起の数え上げとの一致・指標・分割計算）
+"""
+
+import math
+import random
+from collections import Counter, defaultdict
+import numpy as np
+import pytest
+import tag_cooccurrence
+from tag_cooccurrence import TagCooccurrence
+
+
+def make_file_tags(seed=0, files=300, vocabulary=40):
+    rng = random.Random(seed)
+    tags = [f"tag{i}" for i in range(vocabulary)]
+    return [rng.sample(tags, rng.randint(0, 12)) for _ in range(files)]
+
+
+def naive_cooccurrence(file_tags):
+    """従来の二重ループによる共起回数"""
+    co_occurrence = defaultdict(Counter)
+    for tags in file_tags:
+        for i, tag1 in enumerate(tags):
+            for tag2 in tags[i:]:
+                if tag1 != tag2:
+                    co_occurrence[tag1][tag2] += 1
+                    co_occurrence[tag2][tag1] += 1
+    return co_occurrence
+
+
+@pytest.mark.parametrize('pair_chunk, dense_cells', [
+    (tag_cooccurrence.PAIR_CHUNK, tag_cooccurrence.DENSE_CELLS),
+    (tag_cooccurrence.PAIR_CHUNK, 0),
+    (7, 0),
+])
+def test_matches_naive(monkeypatch, pair_chunk, dense_cells):
+    """疎行列積の結果が二重ループと一致（密な配列で数えても、組の列挙を小さく分割しても同じ）"""
+    monkeypatch.setattr(tag_cooccurrence, 'PAIR_CHUNK', pair_chunk)
+    monkeypatch.setattr(tag_cooccurrence, 'DENSE_CELLS', dense_cells)
+    file_tags = make_file_tags()
+    co = TagCooccurrence.from_file_tags(file_tags)
+    expected = naive_cooccurrence(file_tags)
+
+    for tag in co.tags:
+        assert co.neighbor_counts(tag) == dict(expected[tag])
+    assert co.count('tag1', 'tag2') == expected['tag1']['tag2']
+    assert co.count('tag3', 'tag3') == sum('tag3' in tags for tags in file_tags)
+    assert co.count('tag1', 'missing') == 0
+    assert [count for _, count in co.most_common('tag5', 3)] == \
+        [count for _, count in expected['tag5'].most_common(3)]
+
+
+def test_metrics_and_pairs():
+    """Jaccard・リフト・PMI の値と、しきい値以上の組を値の大きい順に返す"""
+    file_tags = [['a', 'b'], ['a', 'b', 'c'], ['a'], ['c', 'd']]
+    co = TagCooccurrence.from_file_tags(file_tags)
+
+    pairs = co.similar_pairs('jaccard', 0.4)
+    assert list(pairs) == [('a', 'b'), ('c', 'd')]
+    assert pairs[('a', 'b')] == pytest.approx(2 / 3)
+    assert pairs[('c', 'd')] == pytest.approx(1 / 2)
+    assert co.similar_pairs('lift')[('a', 'b')] == pytest.approx(2 * 4 / (3 * 2))
+    assert co.similar_pairs('pmi', -10)[('a', 'c')] == pytest.approx(math.log(1 * 4 / (3 * 2)))
+    with pytest.raises(ValueError):
+        co.scores('cosine')
+
+
+def test_restrict_tags_and_neighbor_jaccard():
+    """タグを絞った行列と、共起するタグの集合どうしの Jaccard 係数"""
+    file_tags = make_file_tags(seed=1)
+    category = ['tag0', 'tag1', 'tag2', 'tag3', 'tag4', 'unused']
+    co = TagCooccurrence.from_file_tags(file_tags, category)
+    assert co.tags == category
+    assert co.count('unused', 'unused') == 0
+
+    neighbor_sets = defaultdict(set)
+    for tags in file_tags:
+        present = set(tags) & set(category)
+        for tag in present:
+            neighbor_sets[tag].update(present - {tag})
+    scores = co.neighbor_jaccard('tag0')
+    for tag in category:
+        union = neighbor_sets['tag0'] | neighbor_sets[tag]
+        expected = len(neighbor_sets['tag0'] & neighbor_sets[tag]) / max(1, len(union))
+        assert np.isclose(scores[co.index[tag]], expected)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tag_reader.py のテスト（形式の自動判定・除外タグとしきい値・読み込みエラー）
+"""
+
+from tag_reader import exclusion_set, parse_scored_tags, read_scored_tags, read_tag_names
+
+
+def test_parse_formats():
+    """「tag, score」「tag: score」はスコア付き、カンマ区切りは1.0、数値だけの要素は読み飛ばす"""
+    assert parse_scored_tags('1girl, 0.99\nsmile, 0.5') == [('1girl', 0.99), ('smile', 0.5)]
+    assert parse_scored_tags('smile: 0.8\n:d\n:d: 0.3') == [('smile', 0.8), (':d', 1.0), (':d', 0.3)]
+    assert parse_scored_tags('1girl, solo, 0.5, smile') == [('1girl', 1.0), ('solo', 1.0), ('smile', 1.0)]
+    assert parse_scored_tags('1girl, 0.9') == [('1girl', 0.9)]
+    assert parse_scored_tags('1girl, 2girls') == [('1girl', 1.0), ('2girls', 1.0)]
+    assert parse_scored_tags('solo') == [('solo', 1.0)]
+    assert parse_scored_tags('\r\n  solo  \r\n\n') == [('solo', 1.0)]
+
+
+def test_exclude_and_min_score(tmp_path):
+    """除外タグは大文字・小文字を区別せず、しきい値未満のタグも除く"""
+    excluded = exclusion_set(['Watermark', 'sample'])
+    assert excluded == frozenset({'watermark', 'sample'})
+    content = '1girl, 0.99\nwatermark, 0.9\nSample, 0.8\nsmile, 0.3\n'
+    assert parse_scored_tags(content, exclude=excluded, min_score=0.5) == [('1girl', 0.99)]
+
+    path = tmp_path / 'a.txt'
+    path.write_text(content, encoding='utf-8')
+    assert read_scored_tags(path, exclude=excluded) == [('1girl', 0.99), ('smile', 0.3)]
+    assert read_tag_names(path, min_score=0.85) == ['1girl', 'watermark']
+
+
+def test_unreadable_file(tmp_path):
+    """読めないファイルは空のリスト"""
+    assert read_scored_tags(tmp_path / 'missing.txt') == []
+    path = tmp_path / 'binary.txt'
+    path.write_bytes(b'\xff\xfe\xfa')
+    assert read_tag_names(path) == []
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tag_records.py のテスト（ストアとの一致・信頼度での絞り込みと重み付け）
+"""
+
+import numpy as np
+import create_wildcards_yaml_all
+from tag_records import TagRecords
+from tag_store import TagStoreWriter
+
+
+def write_tag_files(tag_dir):
+    tag_dir.mkdir()
+    (tag_dir / 'a.txt').write_text('1girl, 0.99\nlong hair, 0.5\nsmile, 0.9\n', encoding='utf-8')
+    (tag_dir / 'b.txt').write_text('smile: 0.8\nblue eyes: 0.4\n:d: 0.7\n', encoding='utf-8')
+    (tag_dir / 'c.txt').write_text('1girl, smile, smile', encoding='utf-8')
+    (tag_dir / 'd.txt').write_text('', encoding='utf-8')
+
+
+def test_files_and_store_agree(tmp_path):
+    """タグファイルとタグストアで同じレコードになり、同じファイル内の重複はスコアの大きい方が残る"""
+    tag_dir = tmp_path / 'tags'
+    write_tag_files(tag_dir)
+    from_files = TagRecords.load(str(tag_dir))
+
+    store_path = tmp_path / 'tags.tagstore'
+    with TagStoreWriter(str(store_path)) as writer:
+        for path, tags in zip(from_files.sources, [[('1girl', 0.99), ('long hair', 0.5), ('smile', 0.9)],
+                                                  [('smile', 0.8), ('blue eyes', 0.4), (':d', 0.7)],
+                                                  [('1girl', 1.0), ('smile', 1.0)]]):
+            writer.append_tags(path, tags)
+    from_store = TagRecords.load(str(store_path))
+
+    assert len(from_files.sources) == 4 and from_files.file_count == 3
+    assert from_files.file_tags() == from_store.file_tags() == [
+        ['1girl', 'long hair', 'smile'], ['smile', 'blue eyes', ':d'], ['1girl', 'smile']]
+    assert from_files.tag_counter() == from_store.tag_counter()
+    for tag, total in from_files.tag_counter(weighted=True).items():
+        assert np.isclose(total, from_store.tag_counter(weighted=True)[tag])
+
+
+def test_filter_and_weights(tmp_path):
+    """スコア・除外タグでの絞り込み、信頼度で重み付けした出現数と平均スコア"""
+    tag_dir = tmp_path / 'tags'
+    write_tag_files(tag_dir)
+    records = TagRecords.load(str(tag_dir))
+
+    confident = records.filter(min_score=0.6, exclude=['Long Hair', ':D'])
+    assert confident.file_tags() == [['1girl', 'smile'], ['smile'], ['1girl', 'smile']]
+    assert confident.file_paths() == [str(tag_dir / name) for name in ('a.txt', 'b.txt', 'c.txt')]
+    assert confident.tag_counter() == {'1girl': 2, 'smile': 3}
+    assert np.isclose(confident.tag_counter(weighted=True)['smile'], 0.9 + 0.8 + 1.0)
+
+    smile = records.labels.index('smile')
+    assert np.isclose(records.mean_scores()[smile], (0.9 + 0.8 + 1.0) / 3)
+    assert records.filter(tags=['blue eyes']).file_tags() == [['blue eyes']]
+    assert records.ranked() == ['smile', '1girl', ':d', 'long hair', 'blue eyes']
+
+
+def test_wildcards_yaml_all_uses_scores(tmp_path):
+    """create_wildcards_yaml_all はスコアで絞り込み、カテゴリ内を信頼度順に並べる"""
+    tag_dir = tmp_path / 'tags'
+    write_tag_files(tag_dir)
+    tag_files = create_wildcards_yaml_all.get_tag_files(str(tag_dir))
+
+    all_tags, file_tags, file_count, confidence = create_wildcards_yaml_all.analyze_files(tag_files, min_score=0.6)
+    assert file_count == 3
+    assert 'long hair' not in all_tags and 'blue eyes' not in all_tags
+    assert all_tags['smile'] == 3
+
+    ranked = create_wildcards_yaml_all.rank_categories({'emotion': {':d', 'smile'}}, confidence)
+    assert ranked == {'emotion': ['smile', ':d']}
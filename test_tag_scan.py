@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tag_scan.py のテスト（並列読み込みと逐次読み込み・TagRecords.from_files との一致）
+"""
+
+import random
+from collections import Counter
+import numpy as np
+import process_wildcards
+from tag_reader import exclusion_set, read_scored_tags
+from tag_records import TagRecords
+from tag_scan import count_tags, scan_files
+
+
+def write_corpus(tag_dir, files=40, seed=0):
+    """形式の混ざったタグファイル（空のファイル・同じタグの重複を含む）"""
+    rng = random.Random(seed)
+    vocabulary = [f"tag {i}" for i in range(30)] + ['Watermark', ':d']
+    tag_dir.mkdir()
+    paths = []
+    for i in range(files):
+        tags = rng.sample(vocabulary, rng.randint(0, 8))
+        style = i % 3
+        if style == 0:
+            content = ''.join(f"{tag}, {rng.random():.3f}\n" for tag in tags + tags[:1])
+        elif style == 1:
+            content = ''.join(f"{tag}: {rng.random():.3f}\n" for tag in tags)
+        else:
+            content = ', '.join(tags)
+        path = tag_dir / f"{i:03d}.txt"
+        path.write_text(content, encoding='utf-8')
+        paths.append(path)
+    return paths
+
+
+def assert_same_records(actual, expected):
+    assert actual.sources == expected.sources
+    assert actual.file_tags() == expected.file_tags()
+    assert actual.file_paths() == expected.file_paths()
+    assert actual.tag_counter() == expected.tag_counter()
+    weighted, expected_weighted = actual.tag_counter(weighted=True), expected.tag_counter(weighted=True)
+    assert weighted.keys() == expected_weighted.keys()
+    assert all(np.isclose(weighted[tag], expected_weighted[tag]) for tag in weighted)
+
+
+def test_parallel_matches_sequential(tmp_path):
+    """プロセスプールで小さなチャンクに分けて読んでも、from_files で読んで絞り込んだ結果と同じ"""
+    paths = write_corpus(tmp_path / 'tags')
+    excluded = exclusion_set(['watermark'])
+    expected = TagRecords.from_files(paths).filter(min_score=0.3, exclude=excluded)
+
+    for workers, chunk_size in [(1, 256), (1, 3), (3, 4)]:
+        records, counts = scan_files(paths, workers, chunk_size, exclude=excluded, min_score=0.3)
+        assert_same_records(records, expected)
+        assert counts == expected.tag_counter()
+        assert 'Watermark' not in counts
+
+
+def test_empty_and_analyze_files(tmp_path):
+    """ファイルがない場合は空、process_wildcards.analyze_files は並列でも同じ集計"""
+    records, counts = scan_files([], workers=2)
+    assert len(records) == 0 and records.file_tags() == [] and not counts
+    assert count_tags([], workers=2) == (Counter(), 0)
+
+    paths = write_corpus(tmp_path / 'tags', files=12)
+    assert process_wildcards.analyze_files(paths, 0.5, workers=2) == \
+        process_wildcards.analyze_files(paths, 0.5, workers=1)
+
+
+def test_count_tags_counts_occurrences(tmp_path):
+    """count_tags は重複も1回ずつ数え、しきい値未満のタグしかないファイルもファイル数に含める"""
+    paths = write_corpus(tmp_path / 'tags')
+    expected = Counter()
+    expected_files = 0
+    for path in paths:
+        tags = read_scored_tags(path)
+        if tags:
+            expected_files += 1
+        expected.update(tag for tag, score in tags if score >= 0.6)
+
+    for workers, chunk_size in [(1, 256), (3, 4)]:
+        assert count_tags(paths, workers, chunk_size, min_score=0.6) == (expected, expected_files)
+    records, _ = scan_files(paths, workers=1, min_score=0.6)
+    assert expected_files > records.file_count
+    assert process_wildcards.analyze_files(paths, 0.6) == (expected, expected_files)
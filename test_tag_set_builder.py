@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tag_set_builder.py のテスト（従来の方法と同じセット・再現性・共起のないタグの扱い）
+"""
+
+import random
+from collections import Counter
+import create_wildcards_yaml_all
+from benchmark_tag_sets import legacy_sets, make_file_tags
+from tag_cooccurrence import TagCooccurrence
+from tag_set_builder import greedy_sets
+
+
+def test_matches_legacy():
+    """同じ乱数のシードなら、従来の list.remove と並べ替えによる方法と同じセットになる"""
+    tags, file_tags = make_file_tags(300, seed=1)
+    category = tags[::2] + ['never_seen']
+    co = TagCooccurrence.from_file_tags(file_tags)
+    counters = {tag: Counter(co.neighbor_counts(tag)) for tag in category}
+
+    for num_sets, set_size in [(50, 3), (1000, 3), (20, 5)]:
+        expected = legacy_sets(counters, category, num_sets, set_size, random.Random(7))
+        assert greedy_sets(co, category, num_sets, set_size, random.Random(7)) == expected
+
+    assert greedy_sets(co, ['tag_00000', 'tag_00001'], 50, 3) == [['tag_00000', 'tag_00001']]
+    assert greedy_sets(co, [], 50, 3) == []
+
+
+def test_reproducible_yaml_sets():
+    """create_wildcards_yaml_all は同じシードなら同じセット、全てのタグをちょうど1回使う"""
+    file_tags = [['a', 'b', 'c'], ['a', 'b'], ['d', 'e'], ['d', 'e', 'f'], ['g']]
+    co = create_wildcards_yaml_all.create_co_occurrence_matrix(file_tags)
+    category = ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+
+    first = create_wildcards_yaml_all.create_sets_from_co_occurrence(co, category, 2, 3, random.Random(3))
+    second = create_wildcards_yaml_all.create_sets_from_co_occurrence(co, category, 2, 3, random.Random(3))
+    assert first == second
+    used = [tag for tag_set in first for tag in tag_set.split(', ')]
+    assert sorted(used) == category
+
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tag_store.py のテスト（追記・索引・不完全レコード・従来形式への書き出し）
+"""
+
+import os
+import numpy as np
+import tag_summary
+from tag_store import TagStore, TagStoreWriter, export_legacy, is_tag_store
+
+
+def write_store(path):
+    with TagStoreWriter(str(path)) as writer:
+        label_ids = writer.intern(['1girl', 'smile', 'long hair'])
+        writer.append('images/a.jpg', label_ids[[0, 2]], np.array([0.99, 0.5], dtype=np.float32))
+        writer.append_tags('images/b.png', [('smile', 0.8), ('blue eyes', 0.4)])
+
+
+def test_roundtrip(tmp_path):
+    """タグIDとスコアを追記順に読み戻せる"""
+    store_path = tmp_path / 'tags.tagstore'
+    write_store(store_path)
+
+    assert is_tag_store(str(store_path))
+    store = TagStore(str(store_path))
+    assert store.labels == ['1girl', 'smile', 'long hair', 'blue eyes']
+    assert store.paths() == ['images/a.jpg', 'images/b.png']
+    assert store.get('images/a.jpg')[0].tolist() == [0, 2]
+    assert [tag for tag, _ in store.tags('images/b.png')] == ['smile', 'blue eyes']
+    assert store.tag_counts() == {'1girl': 1, 'smile': 1, 'long hair': 1, 'blue eyes': 1}
+
+
+def test_reappend_and_torn_tail(tmp_path):
+    """再追記は後の結果が有効、書き込み途中の末尾は無視して次の追記で切り詰める"""
+    store_path = tmp_path / 'tags.tagstore'
+    write_store(store_path)
+    with open(store_path, 'ab') as f:
+        f.write(b'R\x40\x00\x00\x00partial')
+
+    store = TagStore(str(store_path))
+    assert len(store) == 2
+
+    with TagStoreWriter(str(store_path)) as writer:
+        writer.append_tags('images/a.jpg', [('smile', 0.7)])
+
+    store = TagStore(str(store_path))
+    assert store.paths() == ['images/a.jpg', 'images/b.png']
+    assert store.tags('images/a.jpg') == [('smile', np.float32(0.7).item())]
+
+
+def test_export_legacy_and_summary(tmp_path):
+    """従来の「tag, score」形式の .txt に書き出し、tag_summary はストアを直接読める"""
+    store_path = tmp_path / 'tags.tagstore'
+    write_store(store_path)
+
+    out_dir = tmp_path / 'out'
+    assert export_legacy(str(store_path), str(out_dir)) == 2
+    assert (out_dir / 'a.txt').read_text(encoding='utf-8') == '1girl, 0.990000\nlong hair, 0.500000\n'
+
+    from_store, store_count = tag_summary.read_tag_files(str(store_path))
+    os.rename(out_dir / 'a.txt', out_dir / 'item_1_1.txt')
+    os.rename(out_dir / 'b.txt', out_dir / 'item_1_2.txt')
+    from_files, file_count = tag_summary.read_tag_files(str(out_dir))
+    assert store_count == file_count == 2
+    assert sorted((tag, round(score, 6)) for tag, score in from_store) == sorted(from_files)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tagger_engine.py のテスト（小さなダミーONNXモデルで実行、モデルのダウンロード不要）
+"""
+
+import os
+import numpy as np
+import pytest
+from PIL import Image
+
+onnx = pytest.importorskip('onnx')
+from onnx import helper, TensorProto
+
+import eva02_tagger
+from tagger_engine import (PAD_COLOR, TaggerEngine, TagPostprocessor, find_images, load_image,
+                           select_tags)
+from tagging_cache import CACHE_FILENAME, TaggingCache
+from tag_store import STORE_FILENAME, TagStore, TagStoreWriter, export_legacy
+
+LABELS = ['red', 'green', 'blue', 'dark']
+LABEL_CATEGORIES = [0, 0, 0, 4]
+
+
+def make_model_dir(tmp_path, fixed_batch=None):
+    """
+    色からタグ確率を出すダミーモデル (N, 448, 448, 3) → (N, 4) を作成
+
+    ReduceMean はバッチサイズで加算順序が変わり結果がずれるため、誤差の出ない ReduceMax を使う
+    """
+    model_dir = tmp_path / 'tagger_data'
+    model_dir.mkdir()
+
+    batch = fixed_batch if fixed_batch else 'batch'
+    weights = np.array([[8, -4, -4, -6],
+                        [-4, 8, -4, -6],
+                        [-4, -4, 8, -6]], dtype=np.float32)
+    bias = np.array([-2, -2, -2, 3], dtype=np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node('ReduceMax', ['input'], ['color'], axes=[1, 2], keepdims=0),
+            helper.make_node('MatMul', ['color', 'weights'], ['logits_raw']),
+            helper.make_node('Add', ['logits_raw', 'bias'], ['logits']),
+            helper.make_node('Sigmoid', ['logits'], ['output']),
+        ],
+        'dummy_tagger',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, [batch, 448, 448, 3])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, [batch, len(LABELS)])],
+        [helper.make_tensor('weights', TensorProto.FLOAT, weights.shape, weights.flatten()),
+         helper.make_tensor('bias', TensorProto.FLOAT, bias.shape, bias)],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, str(model_dir / 'model.onnx'))
+
+    with open(model_dir / 'selected_tags.csv', 'w', encoding='utf-8') as f:
+        f.write('tag_id,name,category,count\n')
+        for i, (name, category) in enumerate(zip(LABELS, LABEL_CATEGORIES)):
+            f.write(f'{i},{name},{category},100\n')
+
+    return str(model_dir)
+
+
+def make_images(tmp_path):
+    """色の異なるテスト画像と壊れた画像を作成"""
+    img_dir = tmp_path / 'images'
+    img_dir.mkdir()
+    colors = {'a_red.png': (250, 10, 10), 'b_green.jpg': (10, 250, 10),
+              'c_blue.webp': (10, 10, 250), 'd_black.bmp': (0, 0, 0),
+              'e_red.PNG': (240, 30, 30)}
+    # ダミーモデルは画素の最大値を見るため、余白（白）の入らない正方形にする
+    for name, color in colors.items():
+        Image.new('RGB', (320, 320), color).save(img_dir / name)
+    (img_dir / 'f_broken.jpg').write_bytes(b'not an image')
+    return str(img_dir)
+
+
+def test_find_images_sorted(tmp_path):
+    """拡張子の大文字小文字を含めて、重複なしのファイル名順"""
+    img_dir = make_images(tmp_path)
+    names = [os.path.basename(p) for p in find_images(img_dir)]
+    assert names == ['a_red.png', 'b_green.jpg', 'c_blue.webp', 'd_black.bmp',
+                     'e_red.PNG', 'f_broken.jpg']
+
+
+def test_engine_batches_match_single(tmp_path):
+    """バッチ推論の結果が1枚ずつの推論と一致し、入力順で返る"""
+    model_dir = make_model_dir(tmp_path)
+    image_files = find_images(make_images(tmp_path))
+
+    batched = list(TaggerEngine(model_dir, batch_size=4).run(image_files))
+    single = list(TaggerEngine(model_dir, batch_size=1).run(image_files))
+
+    assert [r[0] for r in batched] == image_files
+    for (path, probs, error), (_, probs_1, error_1) in zip(batched, single):
+        if path.endswith('f_broken.jpg'):
+            assert probs is None and error is not None and error_1 is not None
+            continue
+        assert error is None
+        np.testing.assert_allclose(probs, probs_1, rtol=1e-6)
+
+    top_tags = [select_tags(probs, LABELS, 0.5)[0][0] for _, probs, _ in batched[:5]]
+    assert top_tags == ['red', 'green', 'blue', 'dark', 'red']
+
+
+def test_process_decode_matches_threads(tmp_path):
+    """プロセスプール＋共有メモリでのデコードでもスレッドと同じ結果・順序になる"""
+    model_dir = make_model_dir(tmp_path)
+    image_files = find_images(make_images(tmp_path)) * 3
+
+    threads = list(TaggerEngine(model_dir, batch_size=2, prefetch=1).run(image_files))
+    engine = TaggerEngine(model_dir, batch_size=2, prefetch=1, decode_workers=2, use_processes=True)
+    processes = list(engine.run(image_files))
+
+    assert [r[0] for r in processes] == image_files
+    for (_, probs, error), (_, probs_t, error_t) in zip(processes, threads):
+        assert (error is None) == (error_t is None)
+        if error is None:
+            np.testing.assert_array_equal(probs, probs_t)
+
+    # 途中で打ち切っても共有メモリは解放される
+    results = engine.run(image_files)
+    next(results)
+    results.close()
+
+
+def test_load_image_pads_to_aspect_ratio(tmp_path):
+    """pad は縦横比を保って中央に配置し、余白と透過部分を白で埋める。stretch は全体に引き伸ばす"""
+    wide = tmp_path / 'wide.png'
+    Image.new('RGBA', (400, 200), (250, 10, 10, 255)).save(wide)
+    padded = load_image(str(wide), (448, 448))
+    assert padded.shape == (448, 448, 3)
+    np.testing.assert_allclose(padded[0, 0], np.array(PAD_COLOR) / 255.0)
+    np.testing.assert_allclose(padded[224, 224], [250 / 255.0, 10 / 255.0, 10 / 255.0], atol=1e-6)
+    assert np.allclose(padded[:100], 1.0) and np.allclose(padded[-100:], 1.0)
+
+    stretched = load_image(str(wide), (448, 448), preprocess='stretch')
+    np.testing.assert_allclose(stretched[0, 0], [250 / 255.0, 10 / 255.0, 10 / 255.0], atol=1e-6)
+
+    transparent = tmp_path / 'transparent.png'
+    Image.new('RGBA', (64, 64), (0, 0, 0, 0)).save(transparent)
+    assert np.allclose(load_image(str(transparent), (32, 32)), 1.0)
+
+
+def test_draft_decode_matches_full_decode(tmp_path):
+    """大きなJPEGの縮小デコードは、全画素をデコードした場合とほぼ同じ入力になる"""
+    x = np.linspace(0, 255, 3000, dtype=np.float32)
+    y = np.linspace(0, 255, 2000, dtype=np.float32)[:, None]
+    pixels = np.stack([np.broadcast_to(x, (2000, 3000)), np.broadcast_to(y, (2000, 3000)),
+                       (x + y) / 2], axis=-1).astype(np.uint8)
+    big = tmp_path / 'big.jpg'
+    Image.fromarray(pixels).save(big, quality=95)
+
+    full = load_image(str(big), (448, 448), draft=False)
+    fast = load_image(str(big), (448, 448))
+    assert np.abs(full - fast).mean() < 0.01
+
+
+def test_fixed_batch_model(tmp_path):
+    """バッチ次元が固定のモデルではその数までに制限される"""
+    model_dir = make_model_dir(tmp_path, fixed_batch=1)
+    engine = TaggerEngine(model_dir, batch_size=8)
+    assert engine.batch_size == 1
+    results = list(engine.run(find_images(make_images(tmp_path))))
+    assert sum(error is None for _, _, error in results) == 5
+
+
+def test_eva02_tagger_frontend(tmp_path):
+    """CLIフロントエンドが画像ごとに tag, score 形式のtxtを書き出す"""
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+    out_dir = tmp_path / 'out'
+
+    assert eva02_tagger.tag_images(img_dir, str(out_dir), model_dir, threshold=0.5, batch_size=3)
+    lines = (out_dir / 'b_green.txt').read_text(encoding='utf-8').splitlines()
+    assert lines[0].startswith('green, ')
+    assert not (out_dir / 'f_broken.txt').exists()
+    # 結果キャッシュは指定した場合だけ、出力ディレクトリに作る
+    assert not (out_dir / CACHE_FILENAME).exists()
+    assert not os.path.exists(os.path.join(model_dir, CACHE_FILENAME))
+    assert eva02_tagger.tag_images(img_dir, str(out_dir), model_dir, threshold=0.5, use_cache=True)
+    assert (out_dir / CACHE_FILENAME).exists()
+
+
+def test_eva02_tagger_store_output(tmp_path):
+    """タグストアに集約した結果を書き出すと、画像ごとの出力と同じ内容になる"""
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+    out_dir = tmp_path / 'out'
+
+    assert eva02_tagger.tag_images(img_dir, str(out_dir), model_dir, threshold=0.1,
+                                   output_format='both', use_cache=False)
+    export_legacy(str(out_dir / STORE_FILENAME), str(tmp_path / 'exported'))
+
+    for name in ['a_red', 'b_green', 'c_blue', 'd_black', 'e_red']:
+        assert ((tmp_path / 'exported' / f'{name}.txt').read_text(encoding='utf-8') ==
+                (out_dir / f'{name}.txt').read_text(encoding='utf-8'))
+
+
+def test_front_end_closes_resources_on_error(tmp_path, monkeypatch):
+    """書き込み中に例外が起きても、エンジン（キャッシュ）とタグストアを閉じる"""
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+    closed = []
+    for cls in (TaggerEngine, TagStoreWriter):
+        monkeypatch.setattr(cls, 'close', lambda self, close=cls.close: closed.append(type(self)) or close(self))
+
+    def broken_append(self, *args):
+        raise OSError('disk full')
+    monkeypatch.setattr(TagStoreWriter, 'append', broken_append)
+
+    with pytest.raises(OSError):
+        eva02_tagger.tag_images(img_dir, str(tmp_path / 'out'), model_dir, use_cache=True, output_format='store')
+    assert sorted(cls.__name__ for cls in closed) == ['TagStoreWriter', 'TaggerEngine']
+
+def test_simple_tagger_store_output(tmp_path, monkeypatch):
+    """simple_tagger の --output-format store はタグストアだけに書き出す"""
+    import simple_tagger
+
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+    out_dir = tmp_path / 'out'
+    monkeypatch.setattr('sys.argv', ['simple_tagger.py', '-i', img_dir, '-o', str(out_dir),
+                                     '-m', model_dir, '-t', '0.1', '--output-format', 'store'])
+    simple_tagger.tag_images_batch(simple_tagger.parse_arguments())
+
+    store = TagStore(str(out_dir / STORE_FILENAME))
+    assert [os.path.basename(path) for path in store.paths()] == [
+        'a_red.png', 'b_green.jpg', 'c_blue.webp', 'd_black.bmp', 'e_red.PNG']
+    assert not list(out_dir.glob('*.txt'))
+
+def test_postprocessor_matches_select_tags():
+    """バッチ一括の閾値処理が1画像ずつの select_tags と同じ結果・順序になる"""
+    rng = np.random.default_rng(0)
+    labels = [f'tag_{i}' for i in range(500)]
+    probs = rng.random((7, len(labels)), dtype=np.float32)
+    probs[3] = 0.0
+    probs[5, :10] = 0.9  # 同点
+
+    selection = TagPostprocessor(labels, threshold=0.8).process(probs)
+    assert len(selection) == 7
+    for i in range(7):
+        indices, scores = selection.row(i)
+        assert indices.dtype == np.int32
+        assert TagPostprocessor(labels).tags(indices, scores) == select_tags(probs[i], labels, 0.8)
+
+    # top_k は閾値を満たすもののうち上位k件
+    top = TagPostprocessor(labels, threshold=0.8, top_k=5).process(probs)
+    for i in range(7):
+        assert top.row(i)[0].tolist() == selection.row(i)[0][:5].tolist()
+
+
+def test_postprocessor_category_thresholds():
+    """カテゴリごとの閾値（キャラクターだけ厳しくする等）"""
+    probs = np.array([[0.5, 0.2, 0.1, 0.6],
+                      [0.1, 0.1, 0.1, 0.95]], dtype=np.float32)
+    postprocessor = TagPostprocessor(LABELS, np.array(LABEL_CATEGORIES), threshold=0.3,
+                                     category_thresholds={'character': 0.9})
+    selection = postprocessor.process(probs)
+
+    assert postprocessor.tags(*selection.row(0)) == [('red', 0.5)]
+    assert [tag for tag, _ in postprocessor.tags(*selection.row(1))] == ['dark']
+
+
+def test_cache_skips_already_tagged_images(tmp_path):
+    """2回目は推論なし、内容が変わった画像だけを再推論（閾値の変更にも推論不要）"""
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+    image_files = find_images(img_dir)
+
+    engine = TaggerEngine(model_dir, batch_size=2, use_cache=True)
+    inferred = []
+    infer = engine.infer
+    engine.infer = lambda batch: inferred.append(len(batch)) or infer(batch)
+
+    first = list(engine.run(image_files))
+    assert sum(inferred) == 5
+    assert os.path.exists(os.path.join(model_dir, CACHE_FILENAME))
+
+    inferred.clear()
+    second = list(engine.tag(image_files, engine.postprocessor(0.9)))
+    assert inferred == []
+    assert [r[0] for r in second] == image_files
+    assert second[5][3] is not None  # 壊れた画像は毎回エラー
+    for (_, probs, _), (_, indices, scores, _) in zip(first[:5], second[:5]):
+        assert indices.tolist() == np.nonzero(probs >= 0.9)[0].tolist()
+        np.testing.assert_allclose(scores, probs[indices], rtol=1e-3)
+
+    # 内容が変わった画像だけ再推論（ファイル名は同じ）
+    inferred.clear()
+    Image.new('RGB', (320, 320), (10, 250, 10)).save(os.path.join(img_dir, 'a_red.png'))
+    third = list(engine.tag(image_files, engine.postprocessor(0.5)))
+    assert sum(inferred) == 1
+    assert engine.postprocessor().tags(third[0][1], third[0][2])[0][0] == 'green'
+    engine.close()
+
+
+def test_cache_sparse_roundtrip(tmp_path):
+    """floor 未満は 0、それ以外は float16 の精度で復元される"""
+    probs = np.array([0.5, 0.001, 0.0, 0.9999, 0.02], dtype=np.float32)
+    with TaggingCache(str(tmp_path / CACHE_FILENAME), floor=0.01) as cache:
+        cache.store('model', [('a' * 64, probs)])
+        assert cache.contains('model', ['a' * 64, 'b' * 64]) == {'a' * 64}
+        assert cache.contains('other', ['a' * 64]) == set()
+        loaded = cache.load('model', ['a' * 64])['a' * 64]
+
+    assert loaded.dtype == np.float32
+    np.testing.assert_allclose(loaded, [0.5, 0.0, 0.0, 0.9999, 0.02], rtol=1e-3)
+
+
+def test_tagger_farm_matches_single_process(tmp_path):
+    """ワーカープロセスでのタグ付けが1プロセスと同じ結果になり、壊れた画像はエラーになる"""
+    from tagger_farm import TaggerFarm
+
+    model_dir = make_model_dir(tmp_path)
+    image_files = find_images(make_images(tmp_path)) * 4
+    engine = TaggerEngine(model_dir, batch_size=2)
+    postprocessor = engine.postprocessor(0.3)
+    expected = {path: (indices, scores)
+                for path, indices, scores, _ in engine.tag(image_files, postprocessor)}
+
+    farm = TaggerFarm(model_dir, workers=2, batch_size=2)
+    results = list(farm.tag(image_files, postprocessor))
+
+    assert sorted(path for path, _, _, _ in results) == sorted(image_files)
+    for path, indices, scores, error in results:
+        if path.endswith('f_broken.jpg'):
+            assert isinstance(error, RuntimeError)
+            continue
+        assert error is None
+        assert indices.tolist() == expected[path][0].tolist()
+        np.testing.assert_allclose(scores, expected[path][1], rtol=1e-6)
+    assert farm.images == 20 and farm.images_per_second > 0
+
+
+def test_eva02_tagger_workers_store_output(tmp_path):
+    """--workers でもタグストアへの書き込みは親プロセスで1か所にまとまる"""
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+    out_dir = tmp_path / 'out'
+
+    assert eva02_tagger.tag_images(img_dir, str(out_dir), model_dir, threshold=0.5, batch_size=2,
+                                   output_format='store', workers=2)
+    store = TagStore(str(out_dir / STORE_FILENAME))
+    assert sorted(os.path.basename(path) for path in store.paths()) == [
+        'a_red.png', 'b_green.jpg', 'c_blue.webp', 'd_black.bmp', 'e_red.PNG']
+    assert store.tags(os.path.join(img_dir, 'b_green.jpg'))[0][0] == 'green'
+
+
+def test_front_ends_workers_match_single_process(tmp_path):
+    """improved_eva02_tagger / eva02_tagger_categorized の --workers は1プロセスと同じ出力になる"""
+    import improved_eva02_tagger
+    import eva02_tagger_categorized
+
+    model_dir = make_model_dir(tmp_path)
+    img_dir = make_images(tmp_path)
+    names = ['a_red', 'b_green', 'c_blue', 'd_black', 'e_red']
+    for module in (improved_eva02_tagger, eva02_tagger_categorized):
+        single_dir = tmp_path / f'{module.__name__}_single'
+        farm_dir = tmp_path / f'{module.__name__}_farm'
+        assert module.tag_images(img_dir, str(single_dir), model_dir, threshold=0.1, batch_size=2)
+        assert module.tag_images(img_dir, str(farm_dir), model_dir, threshold=0.1, batch_size=2, workers=2)
+        for name in names:
+            assert ((farm_dir / f'{name}.txt').read_text(encoding='utf-8') ==
+                    (single_dir / f'{name}.txt').read_text(encoding='utf-8'))
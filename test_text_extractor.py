@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+text_extractor.py の抽出テスト（逐次・並列で同じ結果になること）
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import text_extractor
+from extraction_cache import CACHE_FILENAME, default_cache_path
+from text_extractor import TextExtractor, PreviewBuffer, bounded_map
+
+TEST_FILES = {
+    'test_003.txt': 'girl, squatting, solo, looking at viewer, blush, from below, arm up',
+    'test_001.txt': 'all fours, breasts, open mouth, blush, cleavage, :d, teeth',
+    'test_002.txt': '',
+    'test_004.txt': 'long hair, school uniform, classroom',
+}
+
+
+def make_folder(tmp_path):
+    """テスト用txtファイルを作成"""
+    for filename, content in TEST_FILES.items():
+        (tmp_path / filename).write_text(content, encoding='utf-8')
+    return str(tmp_path)
+
+
+def test_extract_serial(tmp_path):
+    """ファイル名順に1ファイル=1行で抽出し、空ファイルはスキップ"""
+    folder = make_folder(tmp_path)
+    lines = TextExtractor().extract_from_folder(folder, ['poseemotion'], quiet=True)
+
+    assert len(lines) == 3
+    assert lines[0].startswith('all fours,')
+    assert lines[1].startswith('squatting,')
+    assert lines[2] == ''
+
+
+def test_extract_parallel_keeps_order(tmp_path):
+    """スレッド/プロセス並列でも逐次処理と同じ順序・内容になる"""
+    folder = make_folder(tmp_path)
+    extractor = TextExtractor()
+    categories = ['clothing', 'poseemotion', 'uncategorized']
+
+    expected = extractor.extract_from_folder(folder, categories, quiet=True)
+    assert extractor.extract_from_folder(folder, categories, workers=4, quiet=True) == expected
+    assert extractor.extract_from_folder(folder, categories, workers=2,
+                                         use_processes=True, quiet=True) == expected
+
+
+def test_bounded_map_limits_pending_tasks():
+    """bounded_map は入力順に返し、未消費のタスクを window 個までしか投入しない"""
+    submitted = []
+    lock = threading.Lock()
+
+    def work(item):
+        with lock:
+            submitted.append(item)
+        return item * 2
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = bounded_map(pool, work, range(100), 3)
+        assert next(results) == 0
+        assert len(submitted) <= 4
+        assert list(results) == [item * 2 for item in range(1, 100)]
+
+
+def test_progress_callback(tmp_path, capsys):
+    """進捗はcallbackに通知され、printは行われない"""
+    folder = make_folder(tmp_path)
+    progress = []
+
+    TextExtractor().extract_from_folder(
+        folder, ['poseemotion'], workers=2, quiet=True,
+        progress_callback=lambda *args: progress.append(args))
+
+    assert [p[0] for p in progress] == [1, 2, 3, 4]
+    assert all(p[1] == 4 for p in progress)
+    assert progress[1][2:] == ('test_002.txt', None)
+    assert capsys.readouterr().out == ''
+
+
+def use_cache_dir(tmp_path, monkeypatch):
+    """ユーザーのキャッシュディレクトリをテスト用の場所にする"""
+    cache_dir = tmp_path.parent / f"{tmp_path.name}_cache"
+    monkeypatch.setenv('XDG_CACHE_HOME', str(cache_dir))
+    monkeypatch.setenv('LOCALAPPDATA', str(cache_dir))
+
+
+def counting_reads(monkeypatch):
+    """read_prompt_file で読んだファイル名のリスト"""
+    read_files = []
+    read_prompt_file = text_extractor.read_prompt_file
+
+    def counting_read(file_path):
+        read_files.append(os.path.basename(file_path))
+        return read_prompt_file(file_path)
+
+    monkeypatch.setattr(text_extractor, 'read_prompt_file', counting_read)
+    return read_files
+
+
+def test_cache_reclassifies_only_changed_files(tmp_path, monkeypatch):
+    """キャッシュ使用時は新規・変更ファイルだけを読み込み、カテゴリ切替は再読込なし"""
+    use_cache_dir(tmp_path, monkeypatch)
+    folder = make_folder(tmp_path)
+    extractor = TextExtractor()
+    read_files = counting_reads(monkeypatch)
+
+    first = extractor.extract_from_folder(folder, ['poseemotion'], quiet=True, use_cache=True)
+    assert len(read_files) == 4
+    # キャッシュは入力フォルダではなくユーザーのキャッシュディレクトリに作る
+    assert os.path.exists(default_cache_path(folder))
+    assert not (tmp_path / CACHE_FILENAME).exists()
+
+    # カテゴリを切り替えてもファイルは読まない
+    read_files.clear()
+    clothing = extractor.extract_from_folder(folder, ['clothing'], quiet=True, use_cache=True)
+    assert read_files == []
+    assert clothing == extractor.extract_from_folder(folder, ['clothing'], quiet=True)
+    assert extractor.extract_from_folder(folder, ['poseemotion'], quiet=True, use_cache=True) == first
+
+    # 変更・追加したファイルだけを再分類
+    read_files.clear()
+    (tmp_path / 'test_001.txt').write_text('standing, smile, extra tag', encoding='utf-8')
+    (tmp_path / 'test_005.txt').write_text('sitting', encoding='utf-8')
+    lines = extractor.extract_from_folder(folder, ['poseemotion'], quiet=True, use_cache=True)
+    assert sorted(read_files) == ['test_001.txt', 'test_005.txt']
+    assert lines == extractor.extract_from_folder(folder, ['poseemotion'], quiet=True)
+
+
+def test_cache_keeps_results_when_stopped_early(tmp_path, monkeypatch):
+    """途中で止めても、それまでに分類したファイルは次回キャッシュから使う"""
+    use_cache_dir(tmp_path, monkeypatch)
+    monkeypatch.setattr(text_extractor, 'FLUSH_FILES', 1)
+    folder = make_folder(tmp_path)
+    extractor = TextExtractor()
+    read_files = counting_reads(monkeypatch)
+
+    lines = extractor.iter_extracted_lines(folder, ['poseemotion'], quiet=True, use_cache=True)
+    next(lines)
+    lines.close()
+    assert read_files == ['test_001.txt']
+
+    read_files.clear()
+    cached = extractor.extract_from_folder(folder, ['poseemotion'], quiet=True, use_cache=True)
+    assert read_files == ['test_002.txt', 'test_003.txt', 'test_004.txt']
+    assert cached == extractor.extract_from_folder(folder, ['poseemotion'], quiet=True)
+
+
+def test_extract_to_file_streams_with_bounded_preview(tmp_path):
+    """extract_to_file は save_to_file と同じ内容を書き、プレビューは先頭・末尾のみ"""
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    folder = make_folder(input_dir)
+    extractor = TextExtractor()
+    categories = ['poseemotion', 'clothing']
+
+    expected_path = tmp_path / 'expected.txt'
+    extractor.save_to_file(extractor.extract_from_folder(folder, categories, quiet=True),
+                           str(expected_path))
+
+    output_path = tmp_path / 'streamed.txt'
+    preview = extractor.extract_to_file(folder, categories, str(output_path),
+                                        preview=PreviewBuffer(head_size=1, tail_size=1),
+                                        quiet=True)
+
+    assert output_path.read_bytes() == expected_path.read_bytes()
+    assert preview.count == 3
+    assert preview.omitted == 1
+    lines = output_path.read_text(encoding='utf-8').splitlines()
+    assert preview.text() == f"{lines[0]}\n... （1行省略） ...\n{lines[2]}"
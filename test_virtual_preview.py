@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+virtual_preview.py の行索引テスト（GUIは起動しない）
+"""
+
+from virtual_preview import FileLines, ListLines
+
+
+def test_file_lines_random_access(tmp_path):
+    """mmapした結果ファイルから任意の行範囲を取り出せる"""
+    path = tmp_path / 'result.txt'
+    lines = [f"line {i}, タグ{i}," for i in range(1000)]
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    source = FileLines(str(path))
+    try:
+        assert len(source) == 1000
+        assert source.lines(0, 3) == lines[0:3]
+        assert source.lines(500, 502) == lines[500:502]
+        assert source.lines(998, 2000) == lines[998:]
+    finally:
+        source.close()
+
+
+def test_file_lines_edge_cases(tmp_path):
+    """末尾改行なし・CRLF・空ファイル"""
+    path = tmp_path / 'no_newline.txt'
+    path.write_bytes(b'a,\r\nb,\r\nc,')
+    source = FileLines(str(path))
+    assert len(source) == 3
+    assert source.lines(0, 3) == ['a,', 'b,', 'c,']
+    source.close()
+
+    empty = tmp_path / 'empty.txt'
+    empty.write_bytes(b'')
+    source = FileLines(str(empty))
+    assert len(source) == 0
+    assert source.lines(0, 10) == []
+    source.close()
+
+
+def test_list_lines_extend():
+    """途中経過表示用の行リスト"""
+    source = ListLines(['a'])
+    source.extend(['b', 'c'])
+    assert len(source) == 3
+    assert source.lines(1, 10) == ['b', 'c']
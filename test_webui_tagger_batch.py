@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+webui_tagger_batch.py のテスト（ローカルのスタブHTTPサーバーを相手に並行送信・再試行・base64）
+"""
+
+import base64
+import json
+import threading
+import time
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from webui_tagger_batch import WebUITaggerClient, tag_images_batch
+
+
+class StubWebUI(ThreadingHTTPServer):
+    """画像のバイト列をタグとして返すスタブ。指定回数だけ503を返す"""
+
+    daemon_threads = True
+
+    def __init__(self, failures=0, delay=0.0):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.failures = failures
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._reply(200 if self.path == '/internal/ping' else 404, {})
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.requests += 1
+            fail = server.failures > 0
+            server.failures -= fail
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            if fail:
+                self._reply(503, {'detail': 'busy'})
+                return
+            header, encoded = payload['image'].split(',', 1)
+            content = base64.b64decode(encoded, validate=True).decode('ascii')
+            self._reply(200, {'tags': {content: 0.9, header: 0.5}})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server = StubWebUI(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_images(tmp_path, count):
+    img_dir = tmp_path / 'images'
+    img_dir.mkdir()
+    paths = []
+    for i in range(count):
+        # スタブはファイルの中身をそのままタグとして返す
+        path = img_dir / f"img_{i:02d}.png"
+        path.write_bytes(f"image+/{i}".encode('ascii'))
+        paths.append(str(path))
+    return paths
+
+
+def test_concurrent_requests_keep_input_order(tmp_path, stub):
+    """同時リクエスト数の上限を守り、結果は入力順に返る。画像は正しくbase64で送られる"""
+    server = stub(delay=0.05)
+    paths = make_images(tmp_path, 12)
+
+    with WebUITaggerClient(server.url, concurrency=4) as client:
+        results = list(client.interrogate_many(paths, batch_size=6))
+
+    assert [path for path, _, _ in results] == paths
+    for i, (_, tags, error) in enumerate(results):
+        assert error is None
+        assert tags == {f"image+/{i}": 0.9, 'data:image/png;base64': 0.5}
+    assert 1 < server.max_in_flight <= 4
+
+
+def test_batch_size_limits_unreceived_results(tmp_path, stub):
+    """batch_size が concurrency より小さい場合は、同時リクエスト数も batch_size までに抑える"""
+    server = stub(delay=0.05)
+    paths = make_images(tmp_path, 8)
+
+    with WebUITaggerClient(server.url, concurrency=4) as client:
+        results = list(client.interrogate_many(paths, batch_size=2))
+
+    assert [path for path, _, _ in results] == paths
+    assert server.max_in_flight <= 2
+
+def test_retry_with_backoff(tmp_path, stub):
+    """一時的な503は再試行し、回数を使い切ったらエラーとして返す"""
+    paths = make_images(tmp_path, 1)
+
+    server = stub(failures=2)
+    with WebUITaggerClient(server.url, retries=2, backoff=0.01) as client:
+        assert client.interrogate(paths[0]) == {'image+/0': 0.9, 'data:image/png;base64': 0.5}
+    assert server.requests == 3
+
+    server = stub(failures=5)
+    with WebUITaggerClient(server.url, retries=1, backoff=0.01) as client:
+        [(_, tags, error)] = client.interrogate_many(paths)
+    assert tags is None and isinstance(error, requests.exceptions.HTTPError)
+    assert server.requests == 2
+
+
+def test_tag_images_batch_writes_files(tmp_path, stub):
+    """一括処理でタグファイルを書き出す"""
+    server = stub()
+    paths = make_images(tmp_path, 3)
+    out_dir = tmp_path / 'out'
+    args = Namespace(input=str(tmp_path / 'images'), output=str(out_dir), threshold=0.05,
+                     batch_size=2, concurrency=2, retries=0, timeout=10,
+                     interrogator='wd-EVA02-Large-v3', url=server.url)
+
+    tag_images_batch(args)
+
+    assert sorted(p.name for p in out_dir.glob('*.txt')) == [f"img_{i:02d}.txt" for i in range(len(paths))]
+    assert 'image+/1' in (out_dir / 'img_01.txt').read_text(encoding='utf-8')
@@ -8,15 +8,159 @@
 
 import os
 import glob
+import sqlite3
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
-from prompt_classifier import PromptClassifier
+from prompt_classifier import PromptClassifier, CATEGORY_IDS
+from extraction_cache import FLUSH_FILES, ExtractionCache
+
+# 並列処理で先行して投入しておくタスク数（ワーカー数に対する倍率）。
+# 結果の消費が遅くても、読み込み済みの内容はこの数までしかメモリに溜めない
+WINDOW_PER_WORKER = 4
+
+# プロセスプールへ1タスクとして渡すファイル数
+PROCESS_BATCH = 64
+
+
+def read_prompt_file(file_path):
+    """txtファイルを読み込み、前後の空白を除いた内容を返す"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def classify_content(classifier, content):
+    """
+    1ファイル分の内容を全カテゴリに分類
+
+    Args:
+        classifier (PromptClassifier): 分類器
+        content (str): ファイル内容（strip済み）
+
+    Returns:
+        tuple or None: カテゴリIDをインデックスとするタグリスト（空ファイルの場合はNone）
+    """
+    if not content:
+        return None
+
+    # ファイル全体を1プロンプトとして分類
+    return next(classifier.classify_stream([content]))
+
+
+def select_tags(classified, category_ids):
+    """分類結果から指定カテゴリのタグだけを選択順に取り出す"""
+    extracted_tags = []
+    for category_id in category_ids:
+        extracted_tags.extend(classified[category_id])
+    return extracted_tags
+
+
+# プロセスプール用（ワーカープロセスごとに1つ）
+_process_classifier = None
+
+
+def _classify_in_process(contents):
+    """プロセスプールのワーカーで複数ファイル分の分類を実行"""
+    global _process_classifier
+    if _process_classifier is None:
+        _process_classifier = PromptClassifier()
+    return [classify_content(_process_classifier, content) for content in contents]
+
+
+def bounded_map(executor, fn, iterable, window):
+    """
+    Executor.map と同じく結果を入力順に返すが、投入済みで未消費のタスクを window 個までに抑える
+
+    Executor.map は全タスクを最初に投入するため、消費側が遅いと結果がすべてメモリに溜まる。
+    ここでは結果を1つ返すごとに次のタスクを1つ投入する。
+    """
+    iterator = iter(iterable)
+    pending = deque(executor.submit(fn, item) for item in islice(iterator, max(1, window)))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(iterator, 1):
+                pending.append(executor.submit(fn, item))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _batches(iterable, size):
+    """size 個ずつのリストに分ける"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class PreviewBuffer:
+    """
+    抽出結果のプレビュー用に、先頭と末尾の一定行数だけを保持する
+
+    全行をメモリに持たないため、出力がどれだけ大きくても使用量は一定。
+    """
+
+    def __init__(self, head_size=500, tail_size=500):
+        self.head_size = head_size
+        self.head = []
+        self.tail = deque(maxlen=tail_size)
+        self.count = 0
+
+    def append(self, line):
+        self.count += 1
+        if len(self.head) < self.head_size:
+            self.head.append(line)
+        else:
+            self.tail.append(line)
+
+    @property
+    def omitted(self):
+        """プレビューに含まれない行数"""
+        return self.count - len(self.head) - len(self.tail)
+
+    def text(self):
+        """プレビュー表示用の文字列（省略部分は行数を表示）"""
+        lines = list(self.head)
+        if self.omitted:
+            lines.append(f"... （{self.omitted}行省略） ...")
+        lines.extend(self.tail)
+        return "\n".join(lines)
+
+
+def print_progress(index, total, filename, tag_count):
+    """デフォルトの進捗表示（従来のprint出力）"""
+    if tag_count is None:
+        print(f"  [SKIP] {filename}: 空ファイル")
+    else:
+        print(f"  [OK] {filename}: {tag_count} tags")
 
 
 class TextExtractor:
     def __init__(self):
         self.classifier = PromptClassifier()
 
-    def extract_from_folder(self, folder_path, selected_categories):
+    def list_txt_files(self, folder_path):
+        """
+        フォルダ内のtxtファイル一覧をファイル名順で取得
+
+        Raises:
+            FileNotFoundError: txtファイルが1つもない場合
+        """
+        pattern = os.path.join(folder_path, '*.txt')
+        txt_files = glob.glob(pattern)
+        txt_files.sort()  # ファイル名順にソート
+
+        if not txt_files:
+            raise FileNotFoundError(f"フォルダ内にtxtファイルが見つかりません: {folder_path}")
+
+        return txt_files
+
+    def extract_from_folder(self, folder_path, selected_categories, **options):
         """
         フォルダ内の全txtファイルから指定カテゴリのタグを抽出
 
@@ -26,58 +170,183 @@ class TextExtractor:
                 例: ['poseemotion']
                 例: ['clothing', 'poseemotion']
                 例: ['characterface', 'clothing', 'poseemotion', 'backgrounds', 'characterbody', 'uncategorized']
+            **options: iter_extracted_lines() のオプション
+                (workers, use_processes, progress_callback, quiet, use_cache, cache_path)
 
         Returns:
-            list: 各ファイルから抽出したタグの行リスト
+            list: 各ファイルから抽出したタグの行リスト（ファイル名順）
                 例: [
                     "all fours,open mouth,blush,:d,",
                     "looking at viewer,blush,looking back,cowboy shot,...",
                     "squatting,looking at viewer,blush,from below,arm up,"
                 ]
         """
-        # txtファイル一覧取得
-        pattern = os.path.join(folder_path, '*.txt')
-        txt_files = glob.glob(pattern)
-        txt_files.sort()  # ファイル名順にソート
+        return list(self.iter_extracted_lines(folder_path, selected_categories, **options))
 
-        if not txt_files:
-            raise FileNotFoundError(f"フォルダ内にtxtファイルが見つかりません: {folder_path}")
+    def extract_to_file(self, folder_path, selected_categories, output_path,
+                        preview=None, buffer_size=1024 * 1024, **options):
+        """
+        抽出結果をリストに溜めず、1行ずつ出力ファイルへ書き込む
+
+        Args:
+            folder_path (str): 対象フォルダのパス
+            selected_categories (list): 抽出するカテゴリリスト
+            output_path (str): 出力ファイルパス
+            preview (PreviewBuffer): 先頭・末尾のプレビューを保持するバッファ（省略時は新規作成）
+            buffer_size (int): 書き込みバッファサイズ（バイト）
+            **options: iter_extracted_lines() のオプション
+
+        Returns:
+            PreviewBuffer: 先頭・末尾の行と総行数
+        """
+        if preview is None:
+            preview = PreviewBuffer()
 
-        print(f"処理対象ファイル数: {len(txt_files)}")
-        print(f"抽出カテゴリ: {', '.join(selected_categories)}")
+        lines = self.iter_extracted_lines(folder_path, selected_categories, **options)
+        with open(output_path, 'w', encoding='utf-8', buffering=buffer_size) as f:
+            for line in lines:
+                f.write(line + '\n')
+                preview.append(line)
 
-        extracted_lines = []
+        if not options.get('quiet'):
+            print(f"\n保存完了: {output_path}")
+            print(f"  行数: {preview.count}")
 
-        # 各ファイルを処理
-        for txt_file in txt_files:
-            filename = os.path.basename(txt_file)
+        return preview
 
-            # ファイル読み込み
-            with open(txt_file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
+    def iter_extracted_lines(self, folder_path, selected_categories, workers=1,
+                             use_processes=False, progress_callback=None, quiet=False,
+                             use_cache=False, cache_path=None):
+        """
+        抽出結果を1ファイル=1行として順に返すジェネレータを作成
 
-            if not content:
-                print(f"  [SKIP] {filename}: 空ファイル")
-                continue
+        ファイル一覧の取得はこの呼び出し時点で行うため、txtファイルがない場合は
+        ジェネレータを回す前に FileNotFoundError になる。
+
+        Args:
+            folder_path (str): 対象フォルダのパス
+            selected_categories (list): 抽出するカテゴリリスト
+            workers (int): 並列数（1の場合は逐次処理）
+                2以上でファイル読み込みをスレッドプールで並列化
+            use_processes (bool): Trueの場合、分類もプロセスプールで並列化（workers >= 2 のとき有効）
+            progress_callback (callable): 進捗通知 callback(index, total, filename, tag_count)
+                tag_count は空ファイルの場合 None。省略時は従来通りprint出力
+            quiet (bool): Trueの場合、print出力を一切行わない
+            use_cache (bool): Trueの場合、フォルダのキャッシュ（ExtractionCache）を使い、
+                新規・変更ファイルだけを読み込み・分類する。分類結果は FLUSH_FILES 件ごとと
+                終了時（途中で止めた場合も）に保存する
+            cache_path (str): キャッシュファイルのパス（省略時はユーザーのキャッシュディレクトリ内）
+
+        Returns:
+            generator: 抽出したタグの行（ファイル名順、空ファイルはスキップ）
+        """
+        txt_files = self.list_txt_files(folder_path)
+
+        if not quiet:
+            print(f"処理対象ファイル数: {len(txt_files)}")
+            print(f"抽出カテゴリ: {', '.join(selected_categories)}")
+
+        if progress_callback is None and not quiet:
+            progress_callback = print_progress
+
+        category_ids = [CATEGORY_IDS[category] for category in selected_categories
+                        if category in CATEGORY_IDS]
+        classified_files = self._iter_classified_files(
+            folder_path, txt_files, workers, use_processes, use_cache, cache_path, quiet)
 
-            # プロンプトを分類
-            classified = self.classifier.classify_prompt(content)
+        return self._iter_lines(classified_files, len(txt_files), category_ids, progress_callback)
 
-            # 指定カテゴリのタグだけを抽出
-            extracted_tags = []
-            for category in selected_categories:
-                if category in classified:
-                    extracted_tags.extend(classified[category])
+    def _iter_lines(self, classified_files, total, category_ids, progress_callback):
+        """分類結果から指定カテゴリを選んで1行ずつ返す"""
+        for index, (txt_file, classified) in enumerate(classified_files, 1):
+            extracted_tags = None if classified is None else select_tags(classified, category_ids)
+
+            if progress_callback is not None:
+                tag_count = None if extracted_tags is None else len(extracted_tags)
+                progress_callback(index, total, os.path.basename(txt_file), tag_count)
+
+            if extracted_tags is None:
+                continue
 
             # 1行として結合（カンマ区切り）
             line = ','.join(extracted_tags)
             if line:
                 line += ','  # 末尾にカンマ追加
 
-            extracted_lines.append(line)
-            print(f"  [OK] {filename}: {len(extracted_tags)} tags")
-
-        return extracted_lines
+            yield line
+
+    def _iter_classified_files(self, folder_path, txt_files, workers, use_processes,
+                               use_cache, cache_path, quiet):
+        """(ファイルパス, 分類結果) をファイル順に返す（キャッシュ使用時は差分のみ分類）"""
+        if not use_cache:
+            yield from self._iter_classified(txt_files, workers, use_processes)
+            return
+
+        try:
+            cache = ExtractionCache(folder_path, cache_path)
+        except (sqlite3.Error, OSError) as e:
+            # 読み取り専用フォルダなどではキャッシュなしで続行
+            if not quiet:
+                print(f"キャッシュを使用できません（キャッシュなしで続行）: {e}")
+            yield from self._iter_classified(txt_files, workers, use_processes)
+            return
+
+        with cache:
+            cached = cache.load()
+            keys = []
+            stale_files = []
+            for txt_file in txt_files:
+                stat = os.stat(txt_file)
+                key = (os.path.basename(txt_file), stat.st_mtime_ns, stat.st_size)
+                keys.append(key)
+                entry = cached.get(key[0])
+                if entry is None or entry[:2] != key[1:]:
+                    stale_files.append(txt_file)
+
+            if not quiet:
+                print(f"キャッシュ: {len(keys) - len(stale_files)}件ヒット / {len(stale_files)}件を再分類")
+
+            # 新規・変更ファイルだけを分類（結果はファイル順）
+            fresh = self._iter_classified(stale_files, workers, use_processes)
+            stale_names = {os.path.basename(txt_file) for txt_file in stale_files}
+            records = []
+            try:
+                for txt_file, (filename, mtime_ns, size) in zip(txt_files, keys):
+                    if filename in stale_names:
+                        _, classified = next(fresh)
+                        records.append((filename, mtime_ns, size, classified))
+                        if len(records) >= FLUSH_FILES:
+                            cache.store(records)
+                            records.clear()
+                    else:
+                        classified = cached[filename][2]
+                    yield txt_file, classified
+            finally:
+                # キャンセル・途中終了でも分類済みの結果は保存する
+                fresh.close()
+                cache.store(records)
+                cache.prune(key[0] for key in keys)
+
+    def _iter_classified(self, txt_files, workers, use_processes):
+        """(ファイルパス, 分類結果) をファイル順に返す（空ファイルの分類結果はNone）"""
+        if workers <= 1:
+            for txt_file in txt_files:
+                yield txt_file, classify_content(self.classifier, read_prompt_file(txt_file))
+            return
+
+        window = workers * WINDOW_PER_WORKER
+        with ThreadPoolExecutor(max_workers=workers) as io_pool:
+            contents = bounded_map(io_pool, read_prompt_file, txt_files, window)
+
+            if use_processes:
+                with ProcessPoolExecutor(max_workers=workers) as cpu_pool:
+                    batches = bounded_map(cpu_pool, _classify_in_process,
+                                          _batches(contents, PROCESS_BATCH), window)
+                    classified = (result for batch in batches for result in batch)
+                    yield from zip(txt_files, classified)
+            else:
+                for txt_file, content in zip(txt_files, contents):
+                    yield txt_file, classify_content(self.classifier, content)
 
     def save_to_file(self, extracted_lines, output_path):
         """
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+仮想化プレビュー
+数十万行の結果でも、Textウィジェットには画面に見えている行だけを描画する
+"""
+
+import os
+import mmap
+from array import array
+import tkinter as tk
+from tkinter import ttk
+import tkinter.font as tkfont
+
+
+class ListLines:
+    """メモリ上の行リスト（処理中の途中経過表示用）"""
+
+    def __init__(self, lines=None):
+        self.items = list(lines) if lines else []
+
+    def __len__(self):
+        return len(self.items)
+
+    def lines(self, start, stop):
+        return self.items[start:stop]
+
+    def extend(self, lines):
+        self.items.extend(lines)
+
+    def close(self):
+        pass
+
+
+class FileLines:
+    """
+    テキストファイルをmmapし、行頭オフセットの索引で任意の行範囲を取り出す
+
+    ファイル全体を文字列として読み込まないため、巨大な出力でもメモリは
+    行数 × 8バイト（オフセット配列）程度で済む。
+    """
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+
+        # 空ファイルはmmapできない
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        # offsets[i] が i 行目の先頭。最後の要素は終端（改行の次の位置）
+        self.offsets = array('q', [0])
+        pos = self.data.find(b'\n')
+        while pos != -1:
+            self.offsets.append(pos + 1)
+            pos = self.data.find(b'\n', pos + 1)
+        if self.offsets[-1] != size:
+            # 末尾に改行がない最終行
+            self.offsets.append(size + 1)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lines(self, start, stop):
+        """start行目からstop行目の手前までを文字列リストで返す"""
+        stop = min(stop, len(self))
+        return [
+            self.data[self.offsets[i]:self.offsets[i + 1] - 1].decode(self.encoding).rstrip('\r')
+            for i in range(max(0, start), stop)
+        ]
+
+    def close(self):
+        """mmapとファイルを閉じる（Windowsでは閉じないと削除できない）"""
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b''
+        self.file.close()
+
+
+class VirtualTextView(ttk.Frame):
+    """
+    行ソース（ListLines / FileLines）の見えている範囲だけを描画するテキストビュー
+
+    縦スクロールバーは行ソース全体に対する位置を表し、スクロールのたびに
+    表示範囲の行だけを差し替える。折り返さない長い行は横スクロールバー（Textの xview）で
+    見る。末尾には統計情報などのフッター行を付けられる。
+    """
+
+    def __init__(self, master, **text_options):
+        super().__init__(master)
+        self.text = tk.Text(self, **text_options)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scroll)
+        self.xscrollbar = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.text.xview)
+        self.text.config(xscrollcommand=self.xscrollbar.set)
+        self.text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.xscrollbar.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.source = ListLines()
+        self.footer = []
+        self.top = 0
+        self.linespace = tkfont.Font(font=self.text['font']).metrics('linespace')
+
+        self.text.bind('<Configure>', lambda event: self.render())
+        self.text.bind('<MouseWheel>', self.on_mousewheel)
+        self.text.bind('<Shift-MouseWheel>', self.on_shift_mousewheel)
+        self.text.bind('<Shift-Button-4>', lambda event: self.text.xview_scroll(-3, 'units'))
+        self.text.bind('<Shift-Button-5>', lambda event: self.text.xview_scroll(3, 'units'))
+        self.text.bind('<Button-4>', lambda event: self.scroll_lines(-3))
+        self.text.bind('<Button-5>', lambda event: self.scroll_lines(3))
+        self.render()
+
+    def __len__(self):
+        return len(self.source) + len(self.footer)
+
+    def set_source(self, source, footer=()):
+        """表示する行ソースを差し替え（以前のソースは閉じる）"""
+        self.source.close()
+        self.source = source
+        self.footer = list(footer)
+        self.top = 0
+        self.render()
+
+    def append_lines(self, lines):
+        """メモリ上の行ソースに行を追加（処理中の途中経過表示）"""
+        self.source.extend(lines)
+        self.render()
+
+    def clear(self):
+        """表示を空にし、ファイルを開いていれば閉じる"""
+        self.set_source(ListLines())
+
+    def visible_count(self):
+        """画面に収まる行数"""
+        return max(1, self.text.winfo_height() // self.linespace)
+
+    def get_lines(self, start, stop):
+        """行ソースとフッターを連結した範囲を取得"""
+        source_count = len(self.source)
+        lines = self.source.lines(start, min(stop, source_count))
+        if stop > source_count:
+            lines.extend(self.footer[max(0, start - source_count):stop - source_count])
+        return lines
+
+    def render(self):
+        """見えている範囲の行だけをTextウィジェットに描画"""
+        total = len(self)
+        count = self.visible_count()
+        self.top = max(0, min(self.top, total - count))
+
+        # 行を差し替えても横スクロール位置は保つ
+        xview = self.text.xview()[0]
+        self.text.config(state=tk.NORMAL)
+        self.text.delete('1.0', tk.END)
+        self.text.insert('1.0', '\n'.join(self.get_lines(self.top, self.top + count)))
+        self.text.config(state=tk.DISABLED)
+        self.text.xview_moveto(xview)
+
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + count) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_lines(self, delta):
+        self.top += delta
+        self.render()
+
+    def on_scroll(self, action, amount, unit=None):
+        """スクロールバーからのコマンド（moveto / scroll）"""
+        if action == 'moveto':
+            self.top = int(float(amount) * len(self))
+            self.render()
+        elif action == 'scroll':
+            step = self.visible_count() if unit == 'pages' else 1
+            self.scroll_lines(int(amount) * step)
+
+    def on_mousewheel(self, event):
+        self.scroll_lines(-3 if event.delta > 0 else 3)
+        return 'break'
+
+    def on_shift_mousewheel(self, event):
+        self.text.xview_scroll(-3 if event.delta > 0 else 3, 'units')
+        return 'break'
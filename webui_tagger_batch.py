@@ -2,18 +2,23 @@
 # -*- coding: utf-8 -*-
 
 import os
-import sys
-import json
-import requests
 import time
+import base64
+import mimetypes
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import argparse
-from PIL import Image
+import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 # WebUI APIのURL
 WEBUI_URL = "http://127.0.0.1:8500"
 
+# 再試行するHTTPステータス（過負荷・一時的なサーバーエラー）
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
 # カテゴリ定義
 TAG_CATEGORIES = {
     "キャラクター特性": ["1girl", "girl", "female", "1boy", "boy", "male", "woman", "man", "loli", "shota", "solo"],
@@ -41,8 +46,13 @@ def parse_arguments():
     parser.add_argument('--input', '-i', type=str, required=True, help='入力画像ディレクトリ')
     parser.add_argument('--output', '-o', type=str, required=True, help='出力ディレクトリ')
     parser.add_argument('--threshold', '-t', type=float, default=0.05, help='タグの閾値 (0.0-1.0)')
-    parser.add_argument('--batch-size', '-b', type=int, default=10, help='一度に処理する画像数')
+    parser.add_argument('--batch-size', '-b', type=int, default=10,
+                        help='先行して送信する画像数（読み込み済みの画像をメモリに保持する上限）')
+    parser.add_argument('--concurrency', '-c', type=int, default=4, help='同時に送信するリクエスト数')
+    parser.add_argument('--retries', type=int, default=3, help='失敗時の再試行回数')
+    parser.add_argument('--timeout', type=float, default=120, help='1リクエストのタイムアウト（秒）')
     parser.add_argument('--interrogator', type=str, default='wd-EVA02-Large-v3', help='使用するインタロゲーター')
+    parser.add_argument('--url', type=str, default=WEBUI_URL, help='WebUIのURL')
     return parser.parse_args()
 
 def get_image_files(input_dir):
@@ -56,40 +66,113 @@ def get_image_files(input_dir):
 
     return sorted(files)
 
-def check_webui_status():
-    """WebUIが動作しているか確認"""
-    try:
-        response = requests.get(f"{WEBUI_URL}/internal/ping")
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
-
-def interrogate_image(image_path, threshold=0.05, interrogator='wd-EVA02-Large-v3'):
-    """WebUI API経由で画像のタグを取得"""
-    # 画像をbase64エンコード
-    try:
-        with open(image_path, 'rb') as img_file:
-            image_data = img_file.read()
-    except Exception as e:
-        print(f"画像ファイルの読み込みエラー {image_path}: {e}")
-        return {}
-
-    url = f"{WEBUI_URL}/sdapi/v1/interrogate"
-
-    payload = {
-        "image": f"data:image/jpeg;base64,{requests.utils.quote(image_data)}",
-        "model": interrogator,
-        "threshold": threshold
-    }
-
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        return result.get("tags", {})
-    except requests.exceptions.RequestException as e:
-        print(f"APIリクエストエラー: {e}")
-        return {}
+def encode_image(image_path):
+    """画像ファイルを data URI（base64）に変換"""
+    mime_type = mimetypes.guess_type(str(image_path))[0] or 'image/jpeg'
+    with open(image_path, 'rb') as img_file:
+        encoded = base64.b64encode(img_file.read()).decode('ascii')
+    return f"data:{mime_type};base64,{encoded}"
+
+class WebUITaggerClient:
+    """
+    WebUI Tagger APIのクライアント
+
+    接続を使い回すセッションと、同時リクエスト数分のスレッドでAPIを呼び出す。
+    一時的なエラー（接続失敗・タイムアウト・429/5xx）は間隔を倍にしながら再試行する。
+    """
+
+    def __init__(self, url=WEBUI_URL, concurrency=4, retries=3, backoff=0.5, timeout=120):
+        self.url = url.rstrip('/')
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def ping(self):
+        """WebUIが動作しているか確認"""
+        try:
+            response = self.session.get(f"{self.url}/internal/ping", timeout=self.timeout)
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def interrogate(self, image_path, threshold=0.05, interrogator='wd-EVA02-Large-v3'):
+        """
+        1画像のタグを取得
+
+        Returns:
+            dict: タグ → スコア
+
+        Raises:
+            OSError: 画像を読み込めない
+            requests.exceptions.RequestException: 再試行しても失敗した
+        """
+        payload = {
+            "image": encode_image(image_path),
+            "model": interrogator,
+            "threshold": threshold
+        }
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(f"{self.url}/sdapi/v1/interrogate", json=payload,
+                                             timeout=self.timeout)
+                if response.status_code in RETRY_STATUS and attempt < self.retries:
+                    raise requests.exceptions.HTTPError(f"{response.status_code} {response.reason}",
+                                                        response=response)
+                response.raise_for_status()
+                return response.json().get("tags", {})
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                retryable = not isinstance(e, requests.exceptions.HTTPError) or \
+                    e.response is not None and e.response.status_code in RETRY_STATUS
+                if not retryable or attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def _interrogate_safely(self, image_path, threshold, interrogator):
+        try:
+            return self.interrogate(image_path, threshold, interrogator), None
+        except Exception as e:
+            return None, e
+
+    def interrogate_many(self, image_paths, threshold=0.05, interrogator='wd-EVA02-Large-v3', batch_size=10):
+        """
+        複数画像のタグを並行して取得し、入力順に返す
+
+        送信済みで結果を受け取っていない画像は最大 batch_size 件までに抑える
+        （読み込んだ画像データを溜め込まない）。同時に送るリクエストは concurrency 件までで、
+        batch_size の方が小さい場合は batch_size 件まで。
+
+        Yields:
+            tuple: (image_path, tags, error)
+        """
+        window = max(1, batch_size)
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, window)) as pool:
+            pending = deque()
+            for image_path in image_paths:
+                pending.append((image_path, pool.submit(
+                    self._interrogate_safely, image_path, threshold, interrogator)))
+                if len(pending) >= window:
+                    image_path, future = pending.popleft()
+                    yield (image_path, *future.result())
+            while pending:
+                image_path, future = pending.popleft()
+                yield (image_path, *future.result())
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
 def categorize_tags(tags_with_scores):
     """タグをカテゴリごとに分類"""
@@ -160,46 +243,51 @@ def tag_images_batch(args):
     # 出力ディレクトリの作成
     os.makedirs(args.output, exist_ok=True)
 
+    client = WebUITaggerClient(args.url, concurrency=args.concurrency,
+                               retries=args.retries, timeout=args.timeout)
+
     # WebUIの状態確認
-    if not check_webui_status():
+    if not client.ping():
         print("エラー: WebUIが起動していないか、接続できません。")
-        print(f"WebUI URL: {WEBUI_URL} が正しいことを確認してください。")
+        print(f"WebUI URL: {args.url} が正しいことを確認してください。")
+        client.close()
         return
 
     # 画像ファイルのリスト取得
     image_files = get_image_files(args.input)
     if not image_files:
         print(f"エラー: ディレクトリ '{args.input}' に画像ファイルが見つかりません。")
+        client.close()
         return
 
     print(f"処理する画像数: {len(image_files)}")
     print(f"インタロゲーター: {args.interrogator}")
     print(f"タグ閾値: {args.threshold}")
+    print(f"同時リクエスト数: {min(client.concurrency, max(1, args.batch_size))}")
+    if args.batch_size < client.concurrency:
+        print(f"注意: --batch-size ({args.batch_size}) が --concurrency ({client.concurrency}) より小さいため、"
+              f"同時リクエスト数は --batch-size に制限されます")
 
-    # 画像処理
+    # 画像処理（並行して送信し、結果は入力順に保存）
     results = []
-    for image_file in tqdm(image_files, desc="画像処理"):
-        try:
-            # 画像のタグ取得
-            tags = interrogate_image(
-                image_file,
-                threshold=args.threshold,
-                interrogator=args.interrogator
-            )
+    with client:
+        for image_file, tags, error in tqdm(
+                client.interrogate_many(image_files, args.threshold, args.interrogator, args.batch_size),
+                total=len(image_files), desc="画像処理"):
+            if error is not None:
+                print(f"処理エラー {image_file}: {error}")
+                continue
 
             if not tags:
                 print(f"警告: {image_file} のタグ付けに失敗しました。")
                 continue
 
-            # タグを保存
-            output_file = save_tags_to_file(image_file, tags, args.output, args.threshold)
-            results.append((image_file, len(tags), output_file))
-
-            # APIに負荷をかけないよう少し待機
-            time.sleep(0.5)
-
-        except Exception as e:
-            print(f"処理エラー {image_file}: {e}")
+            try:
+                # タグを保存
+                output_file = save_tags_to_file(image_file, tags, args.output, args.threshold)
+                results.append((image_file, len(tags), output_file))
+            except Exception as e:
+                print(f"処理エラー {image_file}: {e}")
 
     # 結果サマリー
     print("\n=== 処理結果 ===")